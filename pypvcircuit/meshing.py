@@ -1,5 +1,10 @@
+import os
 import math
 import warnings
+import hashlib
+import collections
+import tempfile
+import zipfile
 import typing
 import numpy as np
 from scipy.interpolate import interp2d
@@ -21,13 +26,22 @@ def get_merged_r_image(mask_image: np.ndarray, rw, cw):
     return agg_image
 
 
-def get_merged_r_image_from_coordset(mask_image, sub_image_coord):
-    agg_image = np.zeros((sub_image_coord.shape[0], sub_image_coord.shape[1]))
-    for i in range(sub_image_coord.shape[0]):
-        for j in range(sub_image_coord.shape[1]):
-            a, b, c, d = sub_image_coord[i, j, :]
-            agg_image[i, j] = np.mean(mask_image[a:b, c:d])
-    return agg_image
+def get_merged_r_image_from_coordset(mask_image, sub_image_coord, mask_index=None):
+    """
+    Generate merged resistance image of the given sub-images
+
+    :param mask_image: mask image array
+    :param sub_image_coord: the coordinate set of the sub-images
+    :param mask_index: a MaskIndex of mask_image. If None, a new MaskIndex is built.
+    :return: the merged mask image
+    """
+
+    if mask_index is None:
+        mask_index = MaskIndex(mask_image)
+    else:
+        assert mask_index.shape == mask_image.shape
+
+    return mask_index.mean_value(sub_image_coord)
 
 
 def resize(image, new_shape):
@@ -68,27 +82,63 @@ def iterate_sub_image(image, rw, cw):
 
 
 def convert_boundary_to_coordset(image_shape, ri, ci):
-    coord_set = np.empty((ri.shape[0], ci.shape[0], 4), dtype=np.uint)
-    for rii in np.arange(0, ri.shape[0], 1):
-        for cii in np.arange(0, ci.shape[0], 1):
+    ri = np.asarray(ri)
+    ci = np.asarray(ci)
 
-            if rii == ri.shape[0] - 1:
-                end_ri = image_shape[0]
-            else:
-                end_ri = ri[rii + 1]
+    end_ri = np.append(ri[1:], image_shape[0])
+    end_ci = np.append(ci[1:], image_shape[1])
 
-            if cii == ci.shape[0] - 1:
-                end_ci = image_shape[1]
-            else:
-                end_ci = ci[cii + 1]
+    coord_set = np.empty((ri.shape[0], ci.shape[0], 4), dtype=np.uint)
+    coord_set[:, :, 0] = ri[:, np.newaxis]
+    coord_set[:, :, 1] = end_ri[:, np.newaxis]
+    coord_set[:, :, 2] = ci[np.newaxis, :]
+    coord_set[:, :, 3] = end_ci[np.newaxis, :]
 
-            coord_set[rii, cii, 0] = ri[rii]
-            coord_set[rii, cii, 1] = end_ri
-            coord_set[rii, cii, 2] = ci[cii]
-            coord_set[rii, cii, 3] = end_ci
     return coord_set
 
 
+def convert_coordset_to_boundary(image_shape, coord_set):
+    """
+    Find the mesh boundaries (ri, ci) of a coordinate set.
+
+    :param image_shape: the shape of the image
+    :param coord_set: the coordinate set
+    :return: (ri, ci) if the sub-images tile the whole image without gaps or overlaps, otherwise None
+    """
+    ri = coord_set[:, 0, 0].astype(np.intp)
+    ci = coord_set[0, :, 2].astype(np.intp)
+
+    if ri[0] != 0 or ci[0] != 0 or np.any(np.diff(ri) <= 0) or np.any(np.diff(ci) <= 0) or \
+            ri[-1] >= image_shape[0] or ci[-1] >= image_shape[1]:
+        return None
+
+    if not np.array_equal(convert_boundary_to_coordset(image_shape, ri, ci), coord_set):
+        return None
+
+    return ri, ci
+
+
+def block_sum(image: np.ndarray, coord_set: np.ndarray) -> np.ndarray:
+    """
+    Sum every sub-image of a coordinate set over the first two axes.
+    If the image is 3D, e.g. (rows, columns, wavelengths), the sum is done for all the wavelengths in one pass.
+
+    :param image: 2D or 3D image
+    :param coord_set: the coordinate set
+    :return: the summed image with shape (r_pixels, c_pixels) + image.shape[2:]
+    """
+
+    boundary = convert_coordset_to_boundary(image.shape, coord_set)
+
+    if boundary is not None:
+        ri, ci = boundary
+        row_sum = np.add.reduceat(image, ri, axis=0, dtype=float)
+        return np.add.reduceat(row_sum, ci, axis=1)
+
+    # summed-area table for sub-images that do not tile the image
+    return _rect_sum(summed_area_table(image), coord_set)
+
+
 def resize_illumination(illumination, contact_mask, coord_set: np.array, threshold=0):
     assert illumination.shape == contact_mask.shape
     # TODO fix this line. it is reversed
@@ -97,18 +147,7 @@ def resize_illumination(illumination, contact_mask, coord_set: np.array, thresho
 
     filtered_illumination = illumination * light_mask
 
-    r_pixels, c_pixels, _ = coord_set.shape
-
-    resized_illumination = np.empty((r_pixels, c_pixels))
-
-    for c_index in range(c_pixels):
-        for r_index in range(r_pixels):
-            sub_image = filtered_illumination[coord_set[r_index, c_index, 0]:coord_set[r_index, c_index, 1],
-                        coord_set[r_index, c_index, 2]:coord_set[r_index, c_index, 3]]
-
-            resized_illumination[r_index, c_index] = np.sum(sub_image)
-
-    return resized_illumination
+    return block_sum(filtered_illumination, coord_set)
 
 
 def resize_illumination_3d(illumination: np.ndarray, contact_mask,
@@ -116,15 +155,323 @@ def resize_illumination_3d(illumination: np.ndarray, contact_mask,
     assert illumination.ndim == 3
     assert illumination[:, :, 0].shape == contact_mask.shape
 
-    # stupid method for resizing. Need to figure out a faster way to do this
-    r_pixels, c_pixels, _ = coord_set.shape
+    light_mask = np.logical_not(contact_mask > threshold)
+
+    filtered_illumination = illumination * light_mask[:, :, np.newaxis]
+
+    return block_sum(filtered_illumination, coord_set)
+
+
+def find_mirror_axes(metal_contact: np.ndarray, illumination: np.ndarray = None) -> typing.Tuple[int, ...]:
+    """
+    Find the axes along which both the metal contact and the illumination are mirror-symmetric.
+    Only the axes of even length are considered, so that the symmetry plane lies between two pixels.
+
+    :param metal_contact: 2D metal contact image
+    :param illumination: 2D or 3D illumination. The symmetry is checked over its first two axes.
+    :return: a tuple of the symmetric axes, e.g. (), (0,), (1,) or (0, 1)
+    """
+
+    axes = []
+    for axis in (0, 1):
+        if metal_contact.shape[axis] % 2 != 0:
+            continue
+        if not np.array_equal(metal_contact, np.flip(metal_contact, axis=axis)):
+            continue
+        if illumination is not None and not np.allclose(illumination, np.flip(illumination, axis=axis)):
+            continue
+        axes.append(axis)
+
+    return tuple(axes)
+
+
+def reduce_by_symmetry(image: np.ndarray, axes) -> np.ndarray:
+    """
+    Crop the irreducible sub-domain of a mirror-symmetric image, i.e. the bottom and/or right half.
+
+    :param image: 2D or 3D image
+    :param axes: the symmetric axes, returned by find_mirror_axes()
+    :return: the cropped image
+    """
+
+    for axis in axes:
+        half = image.shape[axis] // 2
+        image = np.take(image, np.arange(half, image.shape[axis]), axis=axis)
+
+    return image
+
+
+def expand_by_symmetry(image: np.ndarray, axes) -> np.ndarray:
+    """
+    Rebuild the full image from its irreducible sub-domain by reflection. This is the inverse of reduce_by_symmetry().
+
+    :param image: the image of the sub-domain, e.g. the v_junc of the sub-domain with shape (rows, columns, steps)
+    :param axes: the symmetric axes
+    :return: the full image
+    """
+
+    for axis in axes:
+        image = np.concatenate((np.flip(image, axis=axis), image), axis=axis)
+
+    return image
+
+
+def coordset_centers(coord_set: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the centers of the rows and the columns of a coordinate set generated by a MeshGenerator
+
+    :param coord_set: the coordinate set
+    :return: row centers and column centers in the coordinate of the original image
+    """
+    row_centers = (coord_set[:, 0, 0] + coord_set[:, 0, 1]) / 2
+    col_centers = (coord_set[0, :, 2] + coord_set[0, :, 3]) / 2
+
+    return row_centers, col_centers
+
+
+def interpolate_node_map(node_map: np.ndarray, coarse_coord_set: np.ndarray, fine_coord_set: np.ndarray) -> np.ndarray:
+    """
+    Bilinearly interpolate a map of node values from a coarse mesh to a fine mesh of the same image.
+    The values outside the coarse pixel centers take the nearest values.
+
+    :param node_map: 2D map on the coarse mesh, with shape coarse_coord_set.shape[0:2]
+    :param coarse_coord_set: the coordinate set of the coarse mesh
+    :param fine_coord_set: the coordinate set of the fine mesh
+    :return: 2D map with shape fine_coord_set.shape[0:2]
+    """
+
+    coarse_r, coarse_c = coordset_centers(coarse_coord_set)
+    fine_r, fine_c = coordset_centers(fine_coord_set)
+
+    row_interp = np.array([np.interp(fine_r, coarse_r, node_map[:, ci]) for ci in range(coarse_c.size)]).T
+
+    return np.array([np.interp(fine_c, coarse_c, row_interp[ri, :]) for ri in range(fine_r.size)])
+
+
+def summed_area_table(image: np.ndarray) -> np.ndarray:
+    """
+    Calculate the summed-area table (integral image) of an image, padded with zeros on the first row and column,
+    i.e. sat[r, c] = np.sum(image[:r, :c])
+
+    :param image: 2D or 3D image
+    :return: the summed-area table with shape (rows+1, columns+1) + image.shape[2:]
+    """
+    sat = np.zeros((image.shape[0] + 1, image.shape[1] + 1) + image.shape[2:])
+    sat[1:, 1:] = np.cumsum(np.cumsum(image, axis=0, dtype=float), axis=1)
+
+    return sat
 
-    resized_illumination = np.empty((r_pixels, c_pixels, illumination.shape[2]))
 
-    for zi in range(illumination.shape[2]):
-        resized_illumination[:, :, zi] = resize_illumination(illumination[:, :, zi], contact_mask, coord_set, threshold)
+def _rect_sum(sat: np.ndarray, coord_set: np.ndarray) -> np.ndarray:
+    r0, r1, c0, c1 = [coord_set[:, :, k].astype(np.intp) for k in range(4)]
 
-    return resized_illumination
+    return sat[r1, c1] - sat[r0, c1] - sat[r1, c0] + sat[r0, c0]
+
+
+class MaskIndex(object):
+    """
+    A precomputed integral-image index of a metal mask.
+
+    The index is built once for a mask. It gives the metal coverage, the mean mask value and whether there is bus bar
+    of any rectangle in O(1). The aggregated metal resistances are computed from the running sums of every
+    row and column, so the cost scales with the number of mesh cells times the image width (or height),
+    instead of the number of image pixels.
+
+    """
+
+    def __init__(self, mask_image: np.ndarray, threshold=0, bus_threshold=250):
+        assert mask_image.ndim == 2
+
+        self.shape = mask_image.shape
+        self.threshold = threshold
+        self.bus_threshold = bus_threshold
+
+        metal = mask_image > threshold
+
+        self._value_sat = summed_area_table(mask_image)
+        self._metal_sat = summed_area_table(metal)
+        self._bus_sat = summed_area_table(mask_image > bus_threshold)
+
+        # running sums of metal pixels along each column and along each row
+        self._col_cumsum = np.zeros((self.shape[0] + 1, self.shape[1]), dtype=np.int64)
+        self._col_cumsum[1:, :] = np.cumsum(metal, axis=0)
+        self._row_cumsum = np.zeros((self.shape[0], self.shape[1] + 1), dtype=np.int64)
+        self._row_cumsum[:, 1:] = np.cumsum(metal, axis=1)
+
+    @staticmethod
+    def _area(coord_set):
+        return (coord_set[:, :, 1].astype(np.int64) - coord_set[:, :, 0].astype(np.int64)) * \
+               (coord_set[:, :, 3].astype(np.int64) - coord_set[:, :, 2].astype(np.int64))
+
+    def metal_count(self, coord_set: np.ndarray) -> np.ndarray:
+        return _rect_sum(self._metal_sat, coord_set)
+
+    def metal_coverage(self, coord_set: np.ndarray) -> np.ndarray:
+        return self.metal_count(coord_set) / self._area(coord_set)
+
+    def mean_value(self, coord_set: np.ndarray) -> np.ndarray:
+        return _rect_sum(self._value_sat, coord_set) / self._area(coord_set)
+
+    def is_bus(self, coord_set: np.ndarray) -> np.ndarray:
+        """
+        :return: boolean array, True if any value of the sub-image is larger than bus_threshold
+        """
+        return _rect_sum(self._bus_sat, coord_set) > 0
+
+    def _line_conductance(self, coord_set, r, dim):
+        """
+        Sum of 1/(n*r) of every sub-image, where n is the number of metal pixels of each column (dim=0)
+        or each row (dim=1) in the sub-image. Columns or rows without metal are skipped.
+
+        """
+
+        r0, r1, c0, c1 = [coord_set[:, :, k].astype(np.intp).ravel() for k in range(4)]
+
+        # the columns (dim=0) or the rows (dim=1) of all the sub-images, concatenated sub-image by sub-image
+        start, end = (c0, c1) if dim == 0 else (r0, r1)
+        lines = end - start
+        offsets = np.cumsum(lines) - lines
+        cell = np.repeat(np.arange(lines.size), lines)
+        line = np.arange(np.sum(lines)) - offsets[cell] + start[cell]
+
+        if dim == 0:
+            counts = self._col_cumsum[r1[cell], line] - self._col_cumsum[r0[cell], line]
+        else:
+            counts = self._row_cumsum[line, c1[cell]] - self._row_cumsum[line, c0[cell]]
+
+        with np.errstate(divide='ignore'):
+            conductance = np.where(counts > 0, 1 / (counts * r), 0)
+
+        return np.add.reduceat(conductance, offsets).reshape(coord_set.shape[0:2])
+
+    def pixel_r(self, coord_set: np.ndarray, r_row, r_col):
+        """
+        Calculate the aggregated metal resistances and metal coverage of every sub-image.
+        The results are the same as calling pixel_processor.get_pixel_r() on every sub-image.
+
+        :param coord_set: the coordinate set of the sub-images
+        :param r_col: resistance value per pixel in x-direction (columns, dim=1)
+        :param r_row: resistance value per pixel in y-direction (rows, dim=0)
+        :return: arrays of aggregated resistance in x, resistance in y and metal coverage ratio
+        """
+
+        metal_count = self.metal_count(coord_set)
+        has_metal = metal_count > 0
+
+        with np.errstate(divide='ignore'):
+            agg_r_row = np.where(has_metal, 1 / self._line_conductance(coord_set, r_row, dim=0), np.inf)
+            agg_r_col = np.where(has_metal, 1 / self._line_conductance(coord_set, r_col, dim=1), np.inf)
+
+        metal_coverage = metal_count / self._area(coord_set)
+
+        return agg_r_col, agg_r_row, metal_coverage
+
+
+class PreprocessingCache(object):
+    """
+    A least-recently-used cache of the image-level preprocessing of the solvers, e.g. the resized illumination,
+    the metal coverage and the aggregated metal resistances of a mesh.
+
+    The entries are keyed on the hashes of the metal mask, the illumination and the mesh (rw, cw or the mesh
+    boundaries), so that the solvers of a parameter scan over the electrical parameters share them.
+    If cache_path is given, the entries made of numpy arrays are also saved in this folder as .npz files,
+    and later processes load them from there.
+
+    """
+
+    def __init__(self, maxsize=256, cache_path=None):
+        """
+
+        :param maxsize: the maximum number of entries kept in memory
+        :param cache_path: the folder of the persistent entries. If None, the entries are only kept in memory.
+        """
+
+        if cache_path is not None:
+            os.makedirs(cache_path, exist_ok=True)
+        self.cache_path = cache_path
+        self.maxsize = maxsize
+        self._cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(*parts) -> str:
+        """
+        Hash the inputs of a preprocessing step
+
+        :param parts: numpy arrays (hashed by their contents, shapes and dtypes) or values hashed by their repr()
+        :return: the hex digest
+        """
+
+        h = hashlib.sha1()
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                h.update("{}{}".format(part.dtype.str, part.shape).encode('ascii'))
+                h.update(np.ascontiguousarray(part).tobytes())
+            else:
+                h.update(repr(part).encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.cache_path, key + '.npz')
+
+    def _load(self, key):
+        if self.cache_path is None:
+            return None
+        try:
+            with np.load(self._file(key), allow_pickle=False) as data:
+                return tuple(data['arr_{}'.format(i)] for i in range(len(data.files)))
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
+
+    def _save(self, key, value):
+        if self.cache_path is None or not isinstance(value, tuple) or \
+                not all(isinstance(v, np.ndarray) for v in value):
+            return
+
+        # write to a temporary file first, so that other processes never read a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fp:
+            np.savez(fp, *value)
+        os.replace(tmp_path, self._file(key))
+
+    def get(self, key, compute):
+        """
+        Get a cached entry, or compute and cache it
+
+        :param key: the key returned by PreprocessingCache.key()
+        :param compute: a function without arguments that computes the entry.
+        Only the entries that are tuples of numpy arrays are persisted.
+        :return: the entry
+        """
+
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        value = self._load(key)
+        if value is None:
+            self.misses += 1
+            value = compute()
+            self._save(key, value)
+        else:
+            self.hits += 1
+
+        self._cache[key] = value
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+        return value
+
+    def clear(self):
+
+        self._cache.clear()
+        if self.cache_path is not None:
+            for name in os.listdir(self.cache_path):
+                if name.endswith('.npz'):
+                    os.remove(os.path.join(self.cache_path, name))
 
 
 class MeshGenerator(object):
@@ -158,6 +505,28 @@ class MeshGenerator(object):
     def to_coordset(self):
         return convert_boundary_to_coordset(self.raw_image_shape, self.ri(), self.ci())
 
+    def refine_cells(self, indicator, delta_y, dim: int):
+        """
+        Bisect the cells along a dimension whose error indicator is larger or equal to delta_y.
+        The previous mesh is saved in r_hist or c_hist.
+
+        :param indicator: error indicator of each cell along the dimension, e.g. the output of cell_jump_indicator()
+        :param delta_y: the threshold of the error indicator
+        :param dim: 0 (rows) or 1 (columns)
+        :return: number of added mesh lines
+        """
+
+        assert (dim == 0 or dim == 1)
+
+        if dim == 0:
+            self.r_hist.append(np.copy(self.current_ri))
+            self.current_ri = bisect_cells(self.current_ri, indicator >= delta_y, self.raw_image_shape[0])
+            return self.current_ri.size - self.r_hist[-1].size
+        else:
+            self.c_hist.append(np.copy(self.current_ci))
+            self.current_ci = bisect_cells(self.current_ci, indicator >= delta_y, self.raw_image_shape[1])
+            return self.current_ci.size - self.c_hist[-1].size
+
     def refine(self, y, delta_y, dim: int):
 
         assert (dim == 0 or dim == 1)
@@ -178,6 +547,146 @@ class MeshGenerator(object):
             self.current_ci = nx
 
 
+class QuadtreeMesh(object):
+    """
+    A quadtree (non-tensor-product) mesh of an image.
+
+    The image is tiled by root cells of rw x cw pixels. A cell is split into four quadrants until the metal mask
+    (and the illumination) in it is uniform, or until its size is not larger than min_cell.
+    Therefore, large cells are kept in the uniform open-emitter regions and the cells are refined along the edges
+    of the fingers and the bus bars. A cell can have several neighbours on one side.
+
+    """
+
+    def __init__(self, metal_contact: np.ndarray, rw: int, cw: int, min_cell=1, illumination: np.ndarray = None,
+                 illumination_tol=0.0):
+        """
+
+        :param metal_contact: 2D metal mask
+        :param rw: the size of the root cells in row direction
+        :param cw: the size of the root cells in column direction
+        :param min_cell: cells that are not larger than min_cell are not split
+        :param illumination: 2D illumination. If not None, cells with non-uniform illumination are also split.
+        :param illumination_tol: the tolerance of the illumination variation in a cell, relative to the maximum illumination
+        """
+
+        assert metal_contact.ndim == 2
+
+        self.image_shape = metal_contact.shape
+        rows, cols = self.image_shape
+
+        if illumination is not None:
+            assert illumination.shape == metal_contact.shape
+            illumination_range = illumination_tol * np.max(np.abs(illumination))
+
+        def is_uniform(r0, r1, c0, c1):
+            sub_mask = metal_contact[r0:r1, c0:c1]
+            if not np.all(sub_mask == sub_mask[0, 0]):
+                return False
+            if illumination is not None:
+                return np.ptp(illumination[r0:r1, c0:c1]) <= illumination_range
+            return True
+
+        cells = []
+        stack = [(r, min(r + rw, rows), c, min(c + cw, cols)) for r in range(0, rows, rw) for c in range(0, cols, cw)]
+        while len(stack) > 0:
+            r0, r1, c0, c1 = stack.pop()
+            split_r = r1 - r0 > min_cell
+            split_c = c1 - c0 > min_cell
+            if not (split_r or split_c) or is_uniform(r0, r1, c0, c1):
+                cells.append((r0, r1, c0, c1))
+                continue
+            r_edges = [r0, (r0 + r1) // 2, r1] if split_r else [r0, r1]
+            c_edges = [c0, (c0 + c1) // 2, c1] if split_c else [c0, c1]
+            stack.extend([(ra, rb, ca, cb) for ra, rb in zip(r_edges[:-1], r_edges[1:])
+                          for ca, cb in zip(c_edges[:-1], c_edges[1:])])
+
+        cells = np.array(cells, dtype=np.int64)
+
+        # cells: (cells, 4) array of (r0, r1, c0, c1), sorted by rows and then columns
+        self.cells = cells[np.lexsort((cells[:, 2], cells[:, 0]))]
+
+        # labels: the cell index of every pixel of the image
+        self.labels = np.empty(self.image_shape, dtype=np.intp)
+        for k, (r0, r1, c0, c1) in enumerate(self.cells.tolist()):
+            self.labels[r0:r1, c0:c1] = k
+
+    def cell_num(self):
+        return self.cells.shape[0]
+
+    def to_coordset(self):
+        """
+        :return: the coordinate set of the cells with shape (cells, 1, 4)
+        """
+        return self.cells[:, np.newaxis, :]
+
+    def edges(self):
+        """
+        Find the edges between neighbouring cells. A cell can share edges with several smaller cells on one side.
+
+        :return: arrays (a, b, dim, shared): the indices of the two cells, where a is above (dim=0) or
+        on the left (dim=1) of b, and the length of the common edge in pixels
+        """
+
+        a, b, dim, shared = [], [], [], []
+        for d, (first, second) in enumerate(((self.labels[:-1, :], self.labels[1:, :]),
+                                             (self.labels[:, :-1], self.labels[:, 1:]))):
+            crossing = first != second
+            pairs, counts = np.unique(np.column_stack((first[crossing], second[crossing])), axis=0,
+                                      return_counts=True)
+            a.append(pairs[:, 0])
+            b.append(pairs[:, 1])
+            dim.append(np.full(counts.size, d))
+            shared.append(counts)
+
+        return tuple(np.concatenate(x) for x in (a, b, dim, shared))
+
+    def to_image(self, values: np.ndarray) -> np.ndarray:
+        """
+        Map the values of the cells back to an image
+
+        :param values: array with shape (cells, ...)
+        :return: array with shape image_shape + values.shape[1:]
+        """
+        return np.asarray(values)[self.labels]
+
+
+def cell_jump_indicator(value_map: np.ndarray, dim: int) -> np.ndarray:
+    """
+    Error indicator of the cells along a dimension of a 2D map: the largest jump between a cell and
+    its neighbours along this dimension, taken over all the cells of the same row (dim=0) or column (dim=1).
+
+    :param value_map: 2D map, e.g. the junction voltage map
+    :param dim: 0 (rows) or 1 (columns)
+    :return: 1D indicator with the size of value_map.shape[dim]
+    """
+
+    jumps = np.abs(np.diff(value_map, axis=dim)).max(axis=1 - dim)
+
+    indicator = np.zeros(value_map.shape[dim])
+    indicator[:-1] = jumps
+    indicator[1:] = np.maximum(indicator[1:], jumps)
+
+    return indicator
+
+
+def bisect_cells(x, marked, image_size):
+    """
+    Split the marked cells into halves. Cells that are one pixel wide cannot be split.
+
+    :param x: the starting indices of the cells
+    :param marked: boolean array, True if the cell is to be split
+    :param image_size: the size of the image along this dimension, i.e. the end of the last cell
+    :return: the new starting indices of the cells
+    """
+
+    x = np.asarray(x)
+    end = np.append(x[1:], image_size)
+    split = np.logical_and(marked, end - x > 1)
+
+    return np.sort(np.concatenate((x, (x[split] + end[split]) // 2))).astype(x.dtype)
+
+
 def single_step_remeshing(x, y, delta_y, interp_func):
     index_to_be_add = []
     for xi, xval in enumerate(x[:-1]):
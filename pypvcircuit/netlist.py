@@ -0,0 +1,408 @@
+"""
+An array-backed representation of the netlists used by this package.
+
+The elements are stored as numpy columns: element type, the ids of the two nodes, values and diode model names.
+Pixel processors add elements in batches, preprocessors such as NodeReducer transform the arrays in place,
+and the netlist is written to SPICE text only once, right before it is sent to ngspice.
+The sparse backend reads the arrays directly without any text.
+
+"""
+
+import re
+import numpy as np
+
+GROUND = '0'
+
+
+def parse_diode_model(model_str: str) -> dict:
+    """
+    Parse the parameters of a diode model card, e.g. ``d(is=1e-20,n=1,eg=1.42)``
+
+    :param model_str: the model definition after the model name
+    :return: a dictionary of model parameters in lower case
+    """
+
+    params = dict()
+    body = model_str[model_str.index('(') + 1:model_str.rindex(')')]
+    for item in body.replace(',', ' ').split():
+        key, value = item.split('=')
+        params[key.strip().lower()] = float(value)
+
+    return params
+
+
+def _to_str(values) -> list:
+    return list(map(str, np.asarray(values, dtype=float).ravel().tolist()))
+
+
+class Netlist(object):
+    """
+    A netlist with resistors ('R'), DC current sources ('I'), diodes ('D') and DC voltage sources ('V').
+
+    Nodes are referred by integer ids, the name of node i is node_names[i]. The ground node '0' always has the id 0.
+    Elements without names are named by their types and positions when they are written,
+    e.g. the 10th element is R10 if it is a resistor.
+
+    """
+
+    def __init__(self, title="*** A SPICE simulation with python"):
+
+        self.title = title
+        self.options = dict()
+        # {model name: {parameter: value}}, only diode models are supported
+        self.models = dict()
+
+        self.node_names = [GROUND]
+        self._node_id = {GROUND: 0}
+
+        self.kind = np.empty(0, dtype='<U1')
+        self.name = np.empty(0, dtype=object)
+        self.p_node = np.empty(0, dtype=np.int64)
+        self.n_node = np.empty(0, dtype=np.int64)
+        self.value = np.empty(0)
+        self.model = np.empty(0, dtype=object)
+        self._pending = []
+
+        # the ids of the nodes whose voltages are printed, and the names of voltage sources whose currents are printed
+        self.probes = np.empty(0, dtype=np.int64)
+        self.current_probes = []
+
+        # (source name, start, stop, step) of the .DC statement
+        self.dc = None
+        # {node name: initial voltage} of the .NODESET statement
+        self.nodeset = dict()
+        # if not None, these vectors are saved by a .save statement instead of printing the probes
+        self.save = None
+
+    def __len__(self):
+        self._flush()
+        return self.kind.size
+
+    def node_ids(self, names) -> np.ndarray:
+        """
+        Get the ids of nodes. New nodes are created for the names that are not in the netlist.
+
+        :param names: a list of node names
+        :return: array of node ids
+        """
+
+        ids = np.empty(len(names), dtype=np.int64)
+        for i, name in enumerate(names):
+            node_id = self._node_id.get(name)
+            if node_id is None:
+                node_id = len(self.node_names)
+                self._node_id[name] = node_id
+                self.node_names.append(name)
+            ids[i] = node_id
+
+        return ids
+
+    def add_elements(self, kind, p_node, n_node, value=None, model=None, name=None):
+        """
+        Add a batch of elements of the same type
+
+        :param kind: 'R', 'I', 'D' or 'V'
+        :param p_node: array of the ids of the positive nodes
+        :param n_node: array of the ids of the negative nodes
+        :param value: the values of resistors and sources
+        :param model: the model names of diodes
+        :param name: the element names. If None, the elements are named when the netlist is written.
+        """
+
+        assert kind in ('R', 'I', 'D', 'V')
+
+        p_node = np.asarray(p_node, dtype=np.int64).ravel()
+        n_node = np.broadcast_to(np.asarray(n_node, dtype=np.int64).ravel(), p_node.shape)
+        size = p_node.size
+
+        value = np.full(size, np.nan) if value is None else np.broadcast_to(np.asarray(value, dtype=float), (size,))
+        model_col = np.empty(size, dtype=object)
+        if model is not None:
+            model_col[:] = np.asarray(model, dtype=object).ravel()
+        name_col = np.empty(size, dtype=object)
+        if name is not None:
+            name_col[:] = np.asarray(name, dtype=object).ravel()
+
+        self._pending.append((np.full(size, kind, dtype='<U1'), name_col, p_node, n_node, value, model_col))
+
+    def _flush(self):
+        """
+        Concatenate the batches of added elements into the columns
+
+        """
+
+        if len(self._pending) == 0:
+            return
+
+        columns = list(zip(*self._pending))
+        self.kind, self.name, self.p_node, self.n_node, self.value, self.model = \
+            [np.concatenate((old,) + new) for old, new in
+             zip((self.kind, self.name, self.p_node, self.n_node, self.value, self.model), columns)]
+        self._pending = []
+
+    def elements(self):
+        """
+        :return: the columns (kind, name, p_node, n_node, value, model)
+        """
+        self._flush()
+        return self.kind, self.name, self.p_node, self.n_node, self.value, self.model
+
+    def remove_elements(self, mask):
+        """
+        Remove the elements selected by a boolean mask
+
+        """
+
+        self._flush()
+        keep = np.logical_not(mask)
+        self.kind, self.name, self.p_node, self.n_node, self.value, self.model = \
+            [col[keep] for col in (self.kind, self.name, self.p_node, self.n_node, self.value, self.model)]
+
+    def connected_node_names(self) -> set:
+        """
+        :return: the names of the nodes connected to at least one element.
+        Nodes removed by preprocessors, e.g. merged or eliminated nodes, are not included.
+        """
+
+        _, _, p_node, n_node, _, _ = self.elements()
+        return {self.node_names[i] for i in np.unique(np.concatenate((p_node, n_node))).tolist()}
+
+    def add_probes(self, node_ids):
+
+        self.probes = np.concatenate((self.probes, np.asarray(node_ids, dtype=np.int64).ravel()))
+
+    def select_probes(self, names):
+        """
+        Replace the probes by the nodes with the given names. The names that are not in the netlist are ignored.
+
+        :param names: a list of node names
+        """
+
+        self.probes = np.array([self._node_id[name] for name in names if name in self._node_id], dtype=np.int64)
+
+    def relabel_nodes(self, labels, new_names):
+        """
+        Merge and rename the nodes. Node i becomes node labels[i], whose name is new_names[labels[i]].
+
+        :param labels: array of new node ids, labels[0] must be 0 (ground)
+        :param new_names: list of the names of the new nodes
+        """
+
+        self._flush()
+        labels = np.asarray(labels, dtype=np.int64)
+        assert labels[0] == 0 and new_names[0] == GROUND
+
+        self.p_node = labels[self.p_node]
+        self.n_node = labels[self.n_node]
+        self.probes = np.unique(labels[self.probes])
+
+        self.node_names = list(new_names)
+        self._node_id = {name: i for i, name in enumerate(self.node_names)}
+
+    def extend(self, other):
+        """
+        Append the elements, models and probes of another netlist. Nodes with the same names are connected.
+
+        :param other: a Netlist
+        """
+
+        kind, name, p_node, n_node, value, model = other.elements()
+        node_map = self.node_ids(other.node_names)
+
+        self.options.update(other.options)
+        self.models.update(other.models)
+        self._pending.append((kind, name, node_map[p_node], node_map[n_node], value, model))
+        self.add_probes(node_map[other.probes])
+        self.current_probes += [s for s in other.current_probes if s not in self.current_probes]
+        self.nodeset.update(other.nodeset)
+        if other.dc is not None:
+            self.dc = other.dc
+
+    def copy(self):
+
+        self._flush()
+        netlist = Netlist(self.title)
+        netlist.options = dict(self.options)
+        netlist.models = dict(self.models)
+        netlist.node_names = list(self.node_names)
+        netlist._node_id = dict(self._node_id)
+        netlist.kind, netlist.name, netlist.p_node, netlist.n_node, netlist.value, netlist.model = \
+            self.kind, self.name, self.p_node, self.n_node, self.value, self.model
+        netlist.probes = self.probes
+        netlist.current_probes = list(self.current_probes)
+        netlist.dc = self.dc
+        netlist.nodeset = dict(self.nodeset)
+        netlist.save = None if self.save is None else list(self.save)
+
+        return netlist
+
+    def element_names(self) -> list:
+
+        kind, name, *_ = self.elements()
+        return [n if n is not None else "{}{}".format(k, i) for i, (k, n) in enumerate(zip(kind.tolist(), name))]
+
+    def to_spice(self, vectors_per_line=20) -> str:
+        """
+        Write the netlist in SPICE format
+
+        :param vectors_per_line: number of vectors written in each line of .NODESET and .save statements
+        :return: the SPICE input
+        """
+
+        kind, _, p_node, n_node, value, model = self.elements()
+        names = np.array(self.node_names, dtype=object)
+
+        lines = [self.title, ""]
+        if len(self.options) > 0:
+            lines.append(".OPTIONS " + " ".join("{}={}".format(k, v) for k, v in self.options.items()))
+            lines.append("")
+
+        for model_name, params in self.models.items():
+            lines.append(".model {0} d({1})".format(model_name, ",".join(
+                "{}={}".format(k, v) for k, v in zip(params.keys(), _to_str(list(params.values()))))))
+
+        values = _to_str(value)
+        for element, k, p, n, v, m in zip(self.element_names(), kind.tolist(), names[p_node], names[n_node],
+                                          values, model):
+            if k == 'D':
+                lines.append("{0} {1} {2} {3}".format(element, p, n, m))
+            elif k == 'R':
+                lines.append("{0} {1} {2} {3}".format(element, p, n, v))
+            else:
+                lines.append("{0} {1} {2} DC {3}".format(element, p, n, v))
+
+        if self.save is None:
+            lines.extend([".PRINT DC i({})".format(s) for s in self.current_probes])
+            lines.extend([".PRINT DC v({})".format(n) for n in names[self.probes] if n != GROUND])
+
+        items = ["v({})={}".format(node, repr(float(v))) for node, v in self.nodeset.items()]
+        lines.extend([".NODESET " + " ".join(items[i:i + vectors_per_line])
+                      for i in range(0, len(items), vectors_per_line)])
+
+        if self.save is not None:
+            for i in range(0, len(self.save), vectors_per_line):
+                prefix = ".save " if i == 0 else "+ "
+                lines.append(prefix + " ".join(self.save[i:i + vectors_per_line]))
+
+        if self.dc is not None:
+            lines.append(".DC {0} {1} {2} {3}".format(*self.dc))
+
+        lines.append(".end")
+
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def from_spice(cls, spice_input_contents: str):
+        """
+        Read a netlist from SPICE text. Only the devices and statements used by this package are supported.
+
+        :param spice_input_contents: the SPICE input
+        :return: a Netlist
+        """
+
+        netlist = cls()
+        title_read = False
+
+        columns = {k: ([], [], [], [], []) for k in ('R', 'I', 'D', 'V')}
+        last_card = None
+        for line in spice_input_contents.splitlines():
+            tokens = line.split()
+            if len(tokens) == 0:
+                continue
+
+            if tokens[0][0] == '*':
+                if not title_read:
+                    netlist.title = line
+                    title_read = True
+                continue
+
+            lead = tokens[0][0].upper()
+            if lead in columns:
+                cmd_atoms = parse_spice_command(line.strip())
+                if not cmd_atoms:
+                    raise ValueError("Cannot parse the SPICE command: {}".format(line))
+                names, p_nodes, n_nodes, values, models = columns[lead]
+                names.append(cmd_atoms['name'])
+                p_nodes.append(cmd_atoms['p_node'])
+                n_nodes.append(cmd_atoms['n_node'])
+                if lead == 'D':
+                    values.append(np.nan)
+                    models.append(cmd_atoms['value'])
+                else:
+                    values.append(cmd_atoms['value'])
+                    models.append(None)
+                continue
+
+            card = tokens[0].lower()
+            if card == '+' and last_card == '.save':
+                netlist.save.extend(tokens[1:])
+                continue
+            last_card = card
+
+            if card == '.options':
+                for item in tokens[1:]:
+                    key, value = item.split('=')
+                    netlist.options[key] = value
+            elif card == '.model':
+                netlist.models[tokens[1]] = parse_diode_model(line[line.lower().index(' d(') + 1:])
+            elif card == '.print':
+                for probe in tokens[2:]:
+                    if probe[0].lower() == 'i':
+                        if probe[2:-1] not in netlist.current_probes:
+                            netlist.current_probes.append(probe[2:-1])
+                    else:
+                        netlist.add_probes(netlist.node_ids([probe[2:-1]]))
+            elif card == '.dc':
+                netlist.dc = (tokens[1], float(tokens[2]), float(tokens[3]), float(tokens[4]))
+            elif card == '.nodeset':
+                for item in tokens[1:]:
+                    probe, value = item.split('=')
+                    netlist.nodeset[probe[2:-1]] = float(value)
+            elif card == '.save':
+                netlist.save = list(tokens[1:])
+
+        for kind, (names, p_nodes, n_nodes, values, models) in columns.items():
+            if len(names) > 0:
+                netlist.add_elements(kind, netlist.node_ids(p_nodes), netlist.node_ids(n_nodes), values,
+                                     np.array(models, dtype=object), np.array(names, dtype=object))
+
+        return netlist
+
+
+def parse_spice_command(command: str):
+    # the netlists of this package also have infinite resistors
+    floating_point_num_pat = r"[-+]?([0-9]*\.?[0-9]+([eE][-+]?[0-9]+)?|inf)"
+
+    r_pat = r'(?P<name>[Rr]\w+)\s+(?P<pnode>\w+)\s+(?P<nnode>\w+)\s+(?P<value>' + floating_point_num_pat + ')'
+
+    i_pat = r'(?P<name>[Ii]\w+)\s+(?P<pnode>\w+)\s+(?P<nnode>\w+)\s+((?P<opmode>DC|AC|dc|ac)\s+)?(?P<value>' + floating_point_num_pat + ')'
+
+    v_pat = r'(?P<name>[Vv]\w+)\s+(?P<pnode>\w+)\s+(?P<nnode>\w+)\s+(?P<opmode>DC\s+|\s*)(?P<value>' + floating_point_num_pat + ')'
+    # not very clean way of matching <opmode>. This requires using str.strip() when retrieving <opmode>
+
+    d_pat = r'(?P<name>[Dd][\w-]+)\s+(?P<pnode>\w+)\s+(?P<nnode>\w+)\s+(?P<value>[\w-]+)(\s+(?P<opmode>OFF))?'
+
+    pattern_base = dict()
+
+    pattern_base['v'] = v_pat
+    pattern_base['r'] = r_pat
+    pattern_base['d'] = d_pat
+    pattern_base['i'] = i_pat
+
+    cmd_atoms = dict()
+
+    try:
+        match_obj = re.match(pattern_base[command[0].lower()], command)
+    except ValueError:
+        print("The input command is not valid")
+        return None
+
+    if match_obj is not None:
+        cmd_atoms['name'] = match_obj['name']
+        cmd_atoms['p_node'] = match_obj['pnode']
+        cmd_atoms['n_node'] = match_obj['nnode']
+        cmd_atoms['value'] = match_obj['value']
+        if command[0].lower() in ['v', 'r', 'i']:
+            cmd_atoms['value'] = float(cmd_atoms['value'])
+
+    return cmd_atoms
@@ -0,0 +1,228 @@
+"""
+Solves an electrical circuit with ngspice loaded as a shared library (libngspice) through ctypes.
+The ngspice session is kept alive between solves, the netlist is sent to ngspice as an array of lines in memory,
+and the results are retrieved as numpy arrays. No process is spawned and no file is written.
+
+"""
+
+import ctypes
+import ctypes.util
+import threading
+import numpy as np
+
+from .config_tool import user_config_data
+from .parse_spice_output import normalize_vector_name
+
+
+class NgComplex(ctypes.Structure):
+    _fields_ = [("cx_real", ctypes.c_double),
+                ("cx_imag", ctypes.c_double)]
+
+
+class VectorInfo(ctypes.Structure):
+    _fields_ = [("v_name", ctypes.c_char_p),
+                ("v_type", ctypes.c_int),
+                ("v_flags", ctypes.c_short),
+                ("v_realdata", ctypes.POINTER(ctypes.c_double)),
+                ("v_compdata", ctypes.POINTER(NgComplex)),
+                ("v_length", ctypes.c_int)]
+
+
+class SharedSolveError(RuntimeError):
+    """
+    ngspice reported errors while solving the circuit in the libngspice session, e.g. the DC sweep does not converge
+
+    """
+    pass
+
+
+# libngspice holds one circuit at a time, so the solves of different threads are serialized
+_session_lock = threading.Lock()
+
+SendChar = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_void_p)
+SendStat = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_void_p)
+ControlledExit = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_int, ctypes.c_bool, ctypes.c_bool, ctypes.c_int,
+                                  ctypes.c_void_p)
+
+
+def find_libngspice():
+    """
+    Find the location of libngspice. The location can be set in the configuration file by
+    [External programs] libngspice = /path/to/libngspice.so
+
+    :return: the path of libngspice
+    """
+
+    library_path = user_config_data.get('External programs', 'libngspice', fallback='')
+
+    if library_path == '':
+        library_path = ctypes.util.find_library('ngspice')
+
+    if library_path is None:
+        raise ValueError("Cannot find libngspice. "
+                         "Please assign a valid path of libngspice in the configuration file.")
+
+    return library_path
+
+
+class NgspiceSession(object):
+    """
+    A persistent in-process ngspice session.
+    libngspice keeps global states, therefore only one session is created for each process. Use NgspiceSession.get() to obtain it.
+
+    """
+
+    _session = None
+
+    def __init__(self, library_path=None):
+
+        if library_path is None:
+            library_path = find_libngspice()
+
+        self.lib = ctypes.CDLL(library_path)
+
+        self.lib.ngSpice_Init.argtypes = [SendChar, SendStat, ControlledExit, ctypes.c_void_p, ctypes.c_void_p,
+                                          ctypes.c_void_p, ctypes.c_void_p]
+        self.lib.ngSpice_Init.restype = ctypes.c_int
+        self.lib.ngSpice_Circ.argtypes = [ctypes.POINTER(ctypes.c_char_p)]
+        self.lib.ngSpice_Circ.restype = ctypes.c_int
+        self.lib.ngSpice_Command.argtypes = [ctypes.c_char_p]
+        self.lib.ngSpice_Command.restype = ctypes.c_int
+        self.lib.ngGet_Vec_Info.argtypes = [ctypes.c_char_p]
+        self.lib.ngGet_Vec_Info.restype = ctypes.POINTER(VectorInfo)
+        self.lib.ngSpice_CurPlot.argtypes = []
+        self.lib.ngSpice_CurPlot.restype = ctypes.c_char_p
+        self.lib.ngSpice_AllVecs.argtypes = [ctypes.c_char_p]
+        self.lib.ngSpice_AllVecs.restype = ctypes.POINTER(ctypes.c_char_p)
+
+        self.output = []
+        self.errors = []
+
+        # The callbacks have to be referenced as long as the library is loaded
+        self._send_char = SendChar(self._on_send_char)
+        self._send_stat = SendStat(self._on_send_stat)
+        self._controlled_exit = ControlledExit(self._on_controlled_exit)
+
+        self.lib.ngSpice_Init(self._send_char, self._send_stat, self._controlled_exit, None, None, None, None)
+
+    @classmethod
+    def get(cls, library_path=None):
+        """
+        Return the ngspice session of this process. The session is created at the first call.
+
+        :param library_path: the path of libngspice. It is only used when the session is created.
+        :return: the NgspiceSession object
+        """
+        if cls._session is None:
+            cls._session = cls(library_path)
+        return cls._session
+
+    def _on_send_char(self, message, ident, user_data):
+        message = message.decode('ascii', errors='replace')
+        self.output.append(message)
+        if message.startswith('stderr Error') or message.startswith('stderr error'):
+            self.errors.append(message[len('stderr '):])
+        return 0
+
+    def _on_send_stat(self, message, ident, user_data):
+        return 0
+
+    def _on_controlled_exit(self, status, unload, quit, ident, user_data):
+        self.errors.append("ngspice exited with status {}".format(status))
+        return 0
+
+    def command(self, cmd: str):
+
+        return self.lib.ngSpice_Command(cmd.encode('ascii'))
+
+    def load_circuit(self, spice_file_contents: str):
+        """
+        Send the circuit to ngspice as an array of lines
+
+        :param spice_file_contents: the SPICE netlist
+        """
+
+        lines = [l.encode('ascii') for l in spice_file_contents.splitlines() if len(l.strip()) > 0]
+
+        circ_array = (ctypes.c_char_p * (len(lines) + 1))(*lines, None)
+
+        if self.lib.ngSpice_Circ(circ_array) != 0:
+            raise RuntimeError("ngspice failed to load the circuit: {}".format("\n".join(self.errors)))
+
+    def vector_names(self):
+
+        plot_name = self.lib.ngSpice_CurPlot()
+        names_ptr = self.lib.ngSpice_AllVecs(plot_name)
+
+        names = []
+        idx = 0
+        while names_ptr[idx] is not None:
+            names.append(names_ptr[idx].decode('ascii'))
+            idx += 1
+
+        return names
+
+    def vector(self, name: str):
+        """
+        Copy a vector in the current plot into a numpy array
+
+        :param name: the name of the vector
+        :return: a 1D numpy array
+        """
+        info = self.lib.ngGet_Vec_Info(name.encode('ascii')).contents
+
+        if bool(info.v_realdata):
+            return np.ctypeslib.as_array(info.v_realdata, shape=(info.v_length,)).copy()
+
+        data = np.ctypeslib.as_array(ctypes.cast(info.v_compdata, ctypes.POINTER(ctypes.c_double)),
+                                     shape=(info.v_length * 2,))
+        return data[0::2] + 1j * data[1::2]
+
+    def run(self, spice_file_contents: str):
+        """
+        Load and run the circuit, and collect all the vectors of the resulted plot.
+
+        :param spice_file_contents: the SPICE netlist
+        :return: a list of the vector names and a 2D data array with the shape (number of points, number of vectors).
+        The first vector is the sweep variable. The names follow the same convention as parse_rawfile().
+        """
+
+        self.output = []
+        self.errors = []
+
+        self.load_circuit(spice_file_contents)
+        self.command('run')
+
+        if len(self.errors) > 0:
+            raise SharedSolveError("ngspice failed to solve the circuit: {}".format("\n".join(self.errors)))
+
+        names = self.vector_names()
+
+        # move the sweep variable to the first column
+        sweep = [n for n in names if n.lower() == 'v-sweep']
+        names = sweep + [n for n in names if n.lower() != 'v-sweep']
+
+        data = np.stack([self.vector(n) for n in names], axis=1)
+
+        # free the results and the circuit to keep the memory usage of a long session bounded
+        self.command('destroy all')
+        self.command('remcirc')
+
+        return [normalize_vector_name(n) for n in names], data
+
+
+def solve_circuit_shared(spice_file_contents, postprocess_input=None, library_path=None):
+    """
+    Solve the circuit with the in-process ngspice session.
+
+    :param spice_file_contents: string formated as a spice-readable file
+    :param postprocess_input: the function that post-processes the input netlist
+    :param library_path: the path of libngspice. If None, it is read from the configuration file.
+    :return: a list of the vector names and a 2D data array with the shape (number of points, number of vectors)
+    """
+
+    if postprocess_input is not None:
+        spice_file_contents = postprocess_input(spice_file_contents)
+
+    with _session_lock:
+        return NgspiceSession.get(library_path).run(spice_file_contents)
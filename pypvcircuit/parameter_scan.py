@@ -1,6 +1,8 @@
 from itertools import product
 from functools import partial, reduce
+from concurrent.futures import ProcessPoolExecutor
 import operator
+import warnings
 import numpy as np
 import pandas as pd
 
@@ -43,7 +45,39 @@ def run_search(func, param_grid):
         print(c)
 
 
-def run_search_to_numpy(func, param_grid):
+def _evaluate_point(func, errors, params):
+    """
+    Evaluate func at one point of the parameter grid.
+
+    :param func: the function to be evaluated
+    :param errors: 'raise': the exception is raised, 'ignore': a warning is issued and nan is returned
+    :param params: the parameters of this point
+    :return: the result of func(**params)
+    """
+    try:
+        return func(**params)
+    except Exception as e:
+        if errors == 'raise':
+            raise
+        warnings.warn("Evaluation failed at {}: {!r}".format(params, e), RuntimeWarning)
+        return np.nan
+
+
+def run_search_to_numpy(func, param_grid, n_workers=1, chunksize=1, errors='raise'):
+    """
+    Evaluate func at every point of the parameter grid.
+
+    :param func: the function to be evaluated. It has to be picklable (e.g. defined at the module level) if n_workers>1.
+    :param param_grid: list of dictionaries of {parameter name: list of values}
+    :param n_workers: number of worker processes. If n_workers is 1, the points are evaluated serially.
+    If it is None, the number of CPUs is used.
+    :param chunksize: number of points sent to a worker process at a time
+    :param errors: 'raise': stop the scan when a point fails, 'ignore': the result of a failed point is nan
+    :return: the parameter names, 2D array of parameters (one row per point), list of the results in the same order
+    """
+
+    assert errors == 'raise' or errors == 'ignore'
+
     param_grid_len = count_len(param_grid)
     print("total counts: {}".format(param_grid_len))
 
@@ -51,18 +85,23 @@ def run_search_to_numpy(func, param_grid):
     param_names = None
 
     param_array = np.empty((param_grid_len, len(param_grid[0])))
-    index = 0
 
-    result_array = []
-    for params in yield_param(param_grid):
+    param_list = list(yield_param(param_grid))
+    for index, params in enumerate(param_list):
         if param_names is None:
             param_names = [col for col in params.keys()]
 
         for jj, pp in enumerate(params.keys()):
             param_array[index, jj] = params[pp]
-        index += 1
-        c = func(**params)
-        result_array.append(c)
+
+    evaluate = partial(_evaluate_point, func, errors)
+
+    if n_workers == 1:
+        result_array = [evaluate(params) for params in param_list]
+    else:
+        # executor.map() returns the results in the order of param_list
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            result_array = list(executor.map(evaluate, param_list, chunksize=chunksize))
 
     return param_names, param_array, result_array
 
@@ -1,59 +1,80 @@
-import networkx
 import re
+import warnings
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
 
+from .netlist import Netlist, parse_spice_command
 
-def parse_spice_command(command: str):
-    floating_point_num_pat = "[-+]?[0-9]*\.?[0-9]+([eE][-+]?[0-9]+)?"
 
-    r_pat = '(?P<name>[Rr]\w+)\s+(?P<pnode>\w+)\s+(?P<nnode>\w+)\s+(?P<value>[-+]?[0-9]*\.?[0-9]+([eE][-+]?[0-9]+)?)'
+def parse_v_probe(command: str):
+    cmd_atoms = dict()
+    pat = ".PRINT DC v\((?P<node1>\w+)\) v\((?P<node2>\w+)\)"
 
-    i_pat = '(?P<name>[Ii]\w+)\s+(?P<pnode>\w+)\s+(?P<nnode>\w+)\s+(?P<opmode>DC|AC|dc|ac|\s*)\s+(?P<value>[-+]?[0-9]*\.?[0-9]+([eE][-+]?[0-9]+)?)'
+    match_obj = re.match(pat, command)
 
-    v_pat = '(?P<name>[Vv]\w+)\s+(?P<pnode>\w+)\s+(?P<nnode>\w+)\s+(?P<opmode>DC\s+|\s*)(?P<value>[-+]?[0-9]*\.?[0-9]+([eE][-+]?[0-9]+)?)'
-    # not very clean way of matching <opmode>. This requires using str.strip() when retrieving <opmode>
+    if match_obj is not None:
+        cmd_atoms['p_node'] = match_obj['node1']
+        cmd_atoms['n_node'] = match_obj['node2']
 
-    d_pat = '(?P<name>[Dd][\w-]+)\s+(?P<pnode>\w+)\s+(?P<nnode>\w+)\s+(?P<value>[\w-]+)\s+(?P<opmode>OFF|\s*)'
+    else:
+        cmd_atoms = None
 
-    pattern_base = dict()
+    return cmd_atoms
 
-    pattern_base['v'] = v_pat
-    pattern_base['r'] = r_pat
-    pattern_base['d'] = d_pat
-    pattern_base['i'] = i_pat
 
-    cmd_atoms = dict()
+def replace_print_with_save(spice_input_contents: str, save_vectors, vectors_per_line=20):
+    """
+    Remove the .PRINT statements in the SPICE input and save only the selected vectors in the rawfile.
+    This avoids ngspice printing a text table for every probe when the results are read from a rawfile.
 
-    try:
-        match_obj = re.match(pattern_base[command[0].lower()], command)
-    except ValueError:
-        print("The input command is not valid")
-        return None
+    :param spice_input_contents: the SPICE input
+    :param save_vectors: list of vectors to be saved, e.g. ['i(vdep)', 'v(t_0_000_000)']
+    :param vectors_per_line: number of vectors written in each line of the .save statement
+    :return: the processed SPICE input
+    """
 
-    if match_obj is not None:
-        cmd_atoms['name'] = match_obj['name']
-        cmd_atoms['p_node'] = match_obj['pnode']
-        cmd_atoms['n_node'] = match_obj['nnode']
-        cmd_atoms['value'] = match_obj['value']
-        if command[0].lower() in ['v', 'r', 'i']:
-            cmd_atoms['value'] = float(cmd_atoms['value'])
+    commands = [c for c in spice_input_contents.splitlines() if not c.lstrip().upper().startswith('.PRINT')]
 
-    return cmd_atoms
+    save_lines = []
+    for i in range(0, len(save_vectors), vectors_per_line):
+        prefix = ".save " if i == 0 else "+ "
+        save_lines.append(prefix + " ".join(save_vectors[i:i + vectors_per_line]))
 
+    # .save statements are placed before the .end statement
+    end_idx = len(commands)
+    for idx, c in enumerate(commands):
+        if c.strip().lower() == '.end':
+            end_idx = idx
 
-def parse_v_probe(command: str):
-    cmd_atoms = dict()
-    pat = ".PRINT DC v\((?P<node1>\w+)\) v\((?P<node2>\w+)\)"
+    commands = commands[:end_idx] + save_lines + commands[end_idx:]
 
-    match_obj = re.match(pat, command)
+    return "\n".join(commands) + "\n"
 
-    if match_obj is not None:
-        cmd_atoms['p_node'] = match_obj['node1']
-        cmd_atoms['n_node'] = match_obj['node2']
 
-    else:
-        cmd_atoms = None
+def add_nodeset(spice_input_contents: str, node_voltages: dict, nodes_per_line=20):
+    """
+    Add .NODESET statements, i.e. the initial guesses of node voltages, to the SPICE input.
 
-    return cmd_atoms
+    :param spice_input_contents: the SPICE input
+    :param node_voltages: dictionary of {node name: voltage}
+    :param nodes_per_line: number of nodes written in each .NODESET statement
+    :return: the processed SPICE input
+    """
+
+    commands = spice_input_contents.splitlines()
+
+    items = ["v({})={}".format(node, repr(float(v))) for node, v in node_voltages.items()]
+    nodeset_lines = [".NODESET " + " ".join(items[i:i + nodes_per_line]) for i in range(0, len(items), nodes_per_line)]
+
+    end_idx = len(commands)
+    for idx, c in enumerate(commands):
+        if c.strip().lower() == '.end':
+            end_idx = idx
+
+    commands = commands[:end_idx] + nodeset_lines + commands[end_idx:]
+
+    return "\n".join(commands) + "\n"
 
 
 def is_device(command: str):
@@ -65,139 +86,319 @@ def is_device(command: str):
     # TODO: this line should be more general
     # for now we only assume we only have reisitors (r),
     # diodes (d), voltage (v) and current (i) sources
-    if command[0] in ['R', 'r', 'V', 'd', 'i', 'v']:
+    if command[0].lower() in ['r', 'v', 'd', 'i']:
         return True
     else:
         return False
 
 
-def add_rep_node(circuit_graph: networkx.Graph)->networkx.Graph:
+def merge_shorted_nodes(node_names, p_node, n_node):
     """
-    Find the root of a node and record it to
-    ```circuit_graph.nodes[node]['root'] = node_root```
-
-    :param circuit_graph: the graph that represents the circuit
-    :return: processed circuit graph
+    Find the sets of nodes that are connected by zero-ohm resistors.
+    A set that contains the ground '0' is named '0', the other sets are named sn1, sn2, ... in the order of
+    their first nodes. The nodes that are not shorted keep their names.
+
+    :param node_names: list of node names
+    :param p_node: the ids of the positive nodes of the zero-ohm resistors
+    :param n_node: the ids of the negative nodes of the zero-ohm resistors
+    :return: array of the set id of every node, list of the names of the sets
     """
 
-    shorted_set = list(networkx.connected_components(circuit_graph))
-
-    # Every node will have an attribute 'root', every "shorted nodes"
-    # in the circuit will be given the new name 'root'
+    node_num = len(node_names)
+    graph = sp.coo_matrix((np.ones(len(p_node)), (p_node, n_node)), shape=(node_num, node_num))
+    set_num, labels = connected_components(graph, directed=False)
 
-    set_id = 1
-    for cset in shorted_set:
+    sizes = np.bincount(labels, minlength=set_num)
+    first = np.empty(set_num, dtype=np.int64)
+    first[labels[::-1]] = np.arange(node_num)[::-1]
 
-        # '0' is earth in SPICE. Any nodes shorted to '0' should be '0'
-        if '0' in cset:
-            node_root = '0'
+    ground_set = labels[node_names.index('0')] if '0' in node_names else -1
 
-        # otherwise we give the nodes another name.
+    set_names = []
+    set_id = 1
+    for k, (size, node) in enumerate(zip(sizes.tolist(), first.tolist())):
+        if size == 1:
+            set_names.append(node_names[node])
+        elif k == ground_set:
+            set_names.append('0')
         else:
-            node_root = 'sn{}'.format(set_id)
+            set_names.append('sn{}'.format(set_id))
             set_id += 1
 
-        for node in cset:
-            circuit_graph.nodes[node]['root'] = node_root
-
-    return circuit_graph
+    return labels, set_names
 
 
 class NodeReducer(object):
+    """
+    Merge the nodes that are connected by zero-ohm resistors into single nodes.
+    The mapping of the merged nodes is kept in self.roots until the next netlist is processed.
+
+    """
 
     def __init__(self):
 
-        self.shorted_node_g = networkx.Graph()
+        # {node name: name of the merged node} of the nodes shorted in the last processed netlist
+        self.roots = dict()
 
     def find_root(self, node):
 
-        return self.shorted_node_g.nodes[node]['root']
+        return self.roots[node]
 
-    def process_spice_input(self, spice_input_contents: str):
+    def _record_roots(self, node_names, labels, set_names):
+
+        sizes = np.bincount(labels)
+        self.roots = {node_names[k]: set_names[labels[k]] for k in np.flatnonzero(sizes[labels] > 1).tolist()}
+
+    def process_netlist(self, netlist: Netlist) -> Netlist:
+        """
+        Merge the nodes connected by zero-ohm resistors and remove these resistors. The netlist is modified in place.
+        The merged nodes are named in the same way as process_spice_input(): '0' if they are shorted to the ground,
+        otherwise sn1, sn2, ...
+
+        :param netlist: the Netlist
+        :return: the processed Netlist
         """
-        Find the commands in the SPICE input string that has zero resistance.
 
+        kind, _, p_node, n_node, value, _ = netlist.elements()
+        shorted = (kind == 'R') & (value == 0)
+
+        labels, set_names = merge_shorted_nodes(netlist.node_names, p_node[shorted], n_node[shorted])
+        self._record_roots(netlist.node_names, labels, set_names)
+
+        netlist.remove_elements(shorted)
+        netlist.relabel_nodes(labels, set_names)
+
+        return netlist
 
-        :param spice_input_contents:
-        :return:
+    def process_spice_input(self, spice_input_contents: str):
+        """
+        Merge the nodes connected by zero-ohm resistors and remove these resistors.
+
+        :param spice_input_contents: the SPICE input
+        :return: the processed SPICE input
         """
-        commands = spice_input_contents.splitlines()
+        commands = [c.lstrip() for c in spice_input_contents.splitlines()]
 
         new_commands = []
 
-        reprocessed_output = ""
+        # the ids of the nodes of the zero-ohm resistors
+        node_id = dict()
+        p_node, n_node = [], []
 
-        # Read the input and construct the network graph
         for c in commands:
             if len(c) == 0:
                 continue
 
             if c[0] in ['R', 'r']:
-                r_cmd = parse_spice_command(c)
-                if r_cmd['value'] == 0:
-
-                    # we should add nodes first. Otherwise we cannot assign
-                    # the attributes of the nodes later
-                    self.shorted_node_g.add_nodes_from([r_cmd['p_node'], r_cmd['n_node']])
-
-                    self.shorted_node_g.add_edge(r_cmd['p_node'], r_cmd['n_node'])
-                else:
+                tokens = c.split()
+                if float(tokens[3]) == 0:
+                    p_node.append(node_id.setdefault(tokens[1], len(node_id)))
+                    n_node.append(node_id.setdefault(tokens[2], len(node_id)))
                     # resistors that are shorted will be discarded
-                    new_commands.append(c)
-            else:
-                new_commands.append(c)
+                    continue
 
-        shorted_node_g = add_rep_node(self.shorted_node_g)
+            new_commands.append(c)
+
+        labels, set_names = merge_shorted_nodes(list(node_id.keys()), p_node, n_node)
+        self._record_roots(list(node_id.keys()), labels, set_names)
+        roots = self.roots
 
         # write the processed spice commands
+        reprocessed_output = []
         for c in new_commands:
-            c = c.lstrip()
-            if len(c) == 0:
-                continue
-
             if is_device(c):
-                dev_cmd = parse_spice_command(c)
+                tokens = c.split()
+                tokens[1] = roots.get(tokens[1], tokens[1])
+                tokens[2] = roots.get(tokens[2], tokens[2])
+                c = " ".join(tokens)
+
+            elif c.upper().startswith('.PRINT'):
+                tokens = c.split()
+                probes = []
+                for probe in tokens[2:]:
+                    if probe[0] in ['v', 'V']:
+                        probe = "v({})".format(roots.get(probe[2:-1], probe[2:-1]))
+                        if probe == 'v(0)':
+                            continue
+                    if probe not in probes:
+                        probes.append(probe)
+
+                if len(probes) == 0:
+                    continue
+                c = " ".join(tokens[:2] + probes)
+
+            reprocessed_output.append(c)
+
+        return "\n".join(reprocessed_output) + "\n"
+
+
+class KronReducer(NodeReducer):
+    """
+    A NodeReducer that also eliminates the internal nodes of the linear resistor network by Kron reduction,
+    i.e. the Schur complement of the conductance matrix with respect to the eliminated nodes.
+
+    Only the nodes that are connected to resistors alone can be eliminated, e.g. the metal nodes and the dangling
+    nodes outside the mesh. The reduction is done on the sparse conductance matrix in rounds. Every round eliminates
+    an independent set of the nodes with at most max_degree neighbours, preferring the nodes with fewer neighbours,
+    so that the block of the eliminated nodes is diagonal and its Schur complement is a sparse matrix product.
+    Eliminating a node of degree d adds at most d*(d-1)/2 resistors, so max_degree bounds the fill-in.
+    The default of 5 covers the metal nodes with a contact resistor and four metal neighbours
+    (see test_kron_reducer_benchmark).
+    The voltages of the eliminated nodes are rebuilt from their neighbours by reconstruct().
+
+    """
 
-                if len(dev_cmd.keys()) == 0:
-                    print("Error of parsing {}".format(c))
+    def __init__(self, max_degree=5):
+        super().__init__()
+        self.max_degree = max_degree
 
-                u = dev_cmd['p_node']
-                v = dev_cmd['n_node']
-                if u in shorted_node_g:
-                    dev_cmd['p_node'] = shorted_node_g.nodes[u]['root']
+        # the eliminated nodes in the order of elimination, with their neighbours and conductances at that time
+        self.eliminated = []
 
-                if v in shorted_node_g:
-                    dev_cmd['n_node'] = shorted_node_g.nodes[v]['root']
+    def process_spice_input(self, spice_input_contents: str):
+        """
+        Merge the nodes connected by zero-ohm resistors and eliminate the internal linear nodes.
 
-                new_cmd_str = "{name} {p_node} {n_node} {value}".format(**dev_cmd)
+        :param spice_input_contents: the SPICE input
+        :return: the processed SPICE input
+        """
 
-                reprocessed_output += (new_cmd_str + "\n")
+        return self.process_netlist(Netlist.from_spice(spice_input_contents)).to_spice()
 
-            elif parse_v_probe(c) is not None:
+    def process_netlist(self, netlist: Netlist) -> Netlist:
 
-                dev_cmd = parse_v_probe(c)
+        super().process_netlist(netlist)
 
-                u = dev_cmd['p_node']
-                v = dev_cmd['n_node']
+        kind, _, p_node, n_node, value, _ = netlist.elements()
 
-                if u in shorted_node_g:
-                    dev_cmd['p_node'] = shorted_node_g.nodes[u]['root']
+        names = netlist.node_names
+        node_num = len(names)
 
-                if v in shorted_node_g:
-                    dev_cmd['n_node'] = shorted_node_g.nodes[v]['root']
+        resistor = (kind == 'R') & np.isfinite(value) & (p_node != n_node)
+        eliminable = np.ones(node_num, dtype=bool)
+        eliminable[p_node[kind != 'R']] = False
+        eliminable[n_node[kind != 'R']] = False
+        eliminable[0] = False
 
-                if dev_cmd['n_node'] == '0':
-                    new_cmd_str = ".PRINT DC v({p_node})".format(**dev_cmd)
-                else:
+        eliminated, pairs, conductance = _kron_eliminate(p_node[resistor], n_node[resistor], 1 / value[resistor],
+                                                         node_num, eliminable, self.max_degree)
 
-                    new_cmd_str = ".PRINT DC v({p_node}) v({n_node})".format(**dev_cmd)
+        self.eliminated = [(names[node], dict(zip([names[k] for k in neighbors.tolist()], g.tolist())))
+                           for node, neighbors, g in eliminated]
+        if len(eliminated) == 0:
+            return netlist
 
-                reprocessed_output += (new_cmd_str + "\n")
+        is_eliminated = np.zeros(node_num, dtype=bool)
+        is_eliminated[[node for node, _, _ in eliminated]] = True
+
+        pair_id = np.minimum(p_node, n_node) * node_num + np.maximum(p_node, n_node)
+        changed_id = pairs[:, 0] * node_num + pairs[:, 1]
+        netlist.remove_elements((kind == 'R') & (is_eliminated[p_node] | is_eliminated[n_node] |
+                                                 np.isin(pair_id, changed_id)))
+        netlist.add_elements('R', pairs[:, 0], pairs[:, 1], 1 / conductance)
+
+        # the neighbours of the eliminated nodes are printed for reconstruct()
+        required = np.unique(np.concatenate([neighbors for _, neighbors, _ in eliminated]))
+        required = required[~is_eliminated[required]]
+        netlist.probes = netlist.probes[~is_eliminated[netlist.probes]]
+        netlist.add_probes(np.setdiff1d(required, netlist.probes))
+
+        return netlist
+
+    def reconstruct(self, results: dict) -> dict:
+        """
+        Add the voltages of the eliminated nodes to the parsed results.
+        The voltage of an eliminated node is the conductance-weighted mean of the voltages of its neighbours,
+        so the nodes are rebuilt in the reverse order of elimination.
 
-            else:
-                reprocessed_output += (c + "\n")
+        :param results: the dictionary of parsed results, see parse_spice_output.parse_output()
+        :return: the results with the eliminated nodes
+        """
+
+        for node, neighbors in reversed(self.eliminated):
+            keys = ['({})'.format(k) for k in neighbors if k != '0']
+            if not all(key in results for key in keys):
+                warnings.warn("Cannot reconstruct the voltage of node {}, because the voltages of its neighbours "
+                              "are not in the results".format(node))
+                continue
+
+            sweep = next(iter(results.values()))[0]
+            total = sum(neighbors.values())
+            voltage = np.zeros(sweep.size)
+            for k, g in neighbors.items():
+                if k != '0':
+                    voltage = voltage + g / total * results['({})'.format(k)][1]
+
+            results['({})'.format(node)] = (sweep, voltage)
+
+        return results
+
+
+def _kron_eliminate(p_node, n_node, conductance, node_num, eliminable, max_degree):
+    """
+    Kron reduction of a resistor network on its sparse conductance matrix.
+
+    Every round selects an independent set of the eliminable nodes with 1 to max_degree neighbours:
+    a node is selected if it has the lowest (degree, node id) among its eliminable neighbours.
+    Since the selected nodes are not connected to each other, their block of the conductance matrix is diagonal,
+    and the Schur complement adds the conductances A_KS diag(1/d_S) A_SK between their neighbours.
+    The rounds continue until no node can be eliminated.
+
+    :param p_node: array of the first nodes of the resistors
+    :param n_node: array of the second nodes of the resistors
+    :param conductance: array of the conductances of the resistors
+    :param node_num: the number of nodes, the node ids are 0 to node_num-1
+    :param eliminable: boolean array, True if the node can be eliminated
+    :param max_degree: the maximum number of neighbours of an eliminated node
+    :return: list of (eliminated node, array of its neighbours, array of their conductances) in the order of
+    elimination, the (k, 2) array of the node pairs whose conductances are changed (first node < second node),
+    and the conductances of these pairs in the reduced network
+    """
 
-        return reprocessed_output
+    adjacency = sp.coo_matrix((np.concatenate((conductance, conductance)),
+                               (np.concatenate((p_node, n_node)), np.concatenate((n_node, p_node)))),
+                              shape=(node_num, node_num)).tocsr()
+    changed = sp.csr_matrix((node_num, node_num), dtype=bool)
+    done = np.zeros(node_num, dtype=bool)
+    eliminated = []
+
+    while True:
+        adjacency.eliminate_zeros()
+        degree = np.diff(adjacency.indptr)
+        candidate = eliminable & ~done & (degree > 0) & (degree <= max_degree)
+        if not np.any(candidate):
+            break
+
+        priority = np.where(candidate, degree * node_num + np.arange(node_num), np.iinfo(np.int64).max)
+        min_neighbor = np.full(node_num, np.iinfo(np.int64).max)
+        has_neighbor = degree > 0
+        min_neighbor[has_neighbor] = np.minimum.reduceat(priority[adjacency.indices],
+                                                         adjacency.indptr[:-1][has_neighbor])
+        selected = np.flatnonzero(candidate & (priority < min_neighbor))
+
+        star = adjacency[selected]
+        total = np.asarray(star.sum(axis=1)).ravel()
+        for k, node in enumerate(selected.tolist()):
+            row = slice(star.indptr[k], star.indptr[k + 1])
+            eliminated.append((node, star.indices[row].copy(), star.data[row].copy()))
+
+        # the stars of the selected nodes are replaced by meshes between their neighbours
+        mesh = (star.T @ sp.diags(1 / total) @ star).tocsr()
+        mesh.setdiag(0)
+        mesh.eliminate_zeros()
+
+        done[selected] = True
+        keep = sp.diags((~done).astype(float))
+        adjacency = (keep @ (adjacency + mesh) @ keep).tocsr()
+        changed = changed + (mesh != 0)
+
+    changed = sp.triu(changed).tocoo()
+    survived = ~done[changed.row] & ~done[changed.col]
+    pairs = np.stack((changed.row[survived], changed.col[survived]), axis=1).astype(np.int64)
+    order = np.lexsort((pairs[:, 1], pairs[:, 0]))
+    pairs = pairs[order]
+
+    return eliminated, pairs, np.asarray(adjacency[pairs[:, 0], pairs[:, 1]]).ravel()
 
 
 def reprocess_spice_input(spice_input_content: str):
@@ -55,4 +55,97 @@ def parse_output(raw_results: str):
                     aq_flag = True
                     continue
 
-    return result
\ No newline at end of file
+    return result
+
+
+def normalize_vector_name(name: str):
+    """
+    Convert a vector name in a ngspice rawfile into the name used by the text output,
+    e.g. v(t_0_000_000) -> t_0_000_000, i(vdep) -> vdep#branch
+
+    :param name: the vector name in the header of the rawfile
+    :return: the normalized vector name
+    """
+    name = name.lower()
+    if name.startswith('v(') and name.endswith(')'):
+        return name[2:-1]
+    if name.startswith('i(') and name.endswith(')'):
+        return name[2:-1] + "#branch"
+    return name
+
+
+def parse_rawfile(raw_bytes: bytes):
+    """
+    Decode a ngspice rawfile (written by ngspice -r). Binary data blocks are read by np.frombuffer,
+    ASCII data blocks (filetype=ascii) are also supported.
+    If the file contains several plots, the last one is returned.
+
+    :param raw_bytes: the content of the rawfile
+    :return: a list of the vector names, and a 2D data array with the shape (number of points, number of vectors).
+    The first vector is the sweep variable.
+    """
+
+    pos = 0
+    names = []
+    data = None
+
+    while pos < len(raw_bytes):
+
+        # Read the header of a plot
+        header = dict()
+        names = []
+        reading_variables = False
+        data_format = None
+        while pos < len(raw_bytes):
+            line_end = raw_bytes.find(b'\n', pos)
+            if line_end < 0:
+                line_end = len(raw_bytes)
+            line = raw_bytes[pos:line_end].decode('ascii', errors='replace').rstrip('\r')
+            pos = line_end + 1
+
+            if line.startswith('Binary:'):
+                data_format = 'binary'
+                break
+            elif line.startswith('Values:'):
+                data_format = 'ascii'
+                break
+            elif reading_variables and line[:1] in ('\t', ' ') and len(line.split()) >= 3:
+                names.append(normalize_vector_name(line.split()[1]))
+            elif ':' in line:
+                key, value = line.split(':', 1)
+                header[key.strip()] = value.strip()
+                reading_variables = key.strip() == 'Variables'
+
+        if data_format is None:
+            break
+
+        n_vars = int(header['No. Variables'])
+        n_points = int(header['No. Points'])
+        assert len(names) == n_vars
+
+        values_per_var = 2 if 'complex' in header.get('Flags', 'real') else 1
+
+        if data_format == 'binary':
+            n_bytes = n_points * n_vars * values_per_var * 8
+            data = np.frombuffer(raw_bytes, dtype=np.float64, count=n_points * n_vars * values_per_var,
+                                 offset=pos)
+            pos += n_bytes
+        else:
+            # ASCII rawfiles: every point starts with its index, followed by one value per line
+            n_lines = n_points * n_vars
+            lines = raw_bytes[pos:].split(b'\n', n_lines)
+            pos += sum(len(l) + 1 for l in lines[:n_lines])
+            values = [l.split()[-1].split(b',') for l in lines[:n_lines]]
+            data = np.array([float(v) for vs in values for v in vs[:values_per_var]])
+
+        data = data.reshape(n_points, n_vars, values_per_var)
+        if values_per_var == 1:
+            data = data[:, :, 0]
+        else:
+            data = data[:, :, 0] + 1j * data[:, :, 1]
+
+        # skip the line break after the binary block
+        while pos < len(raw_bytes) and raw_bytes[pos:pos + 1] in (b'\n', b'\r'):
+            pos += 1
+
+    return names, data
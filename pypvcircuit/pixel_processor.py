@@ -2,13 +2,28 @@ import numpy as np
 from pypvcell.solarcell import SQCell, MJCell, SolarCell
 import yaml
 import os
+import functools
+import hashlib
+import collections
 
+from .netlist import Netlist
 
-def _load_solarcell_param(solarcell: SolarCell, param_name) -> np.array:
+
+@functools.lru_cache(maxsize=None)
+def _load_default_param() -> dict:
+    """
+    Load default_circuit_param.yaml. The file is only parsed once.
+
+    """
     this_dir = os.path.abspath(os.path.dirname(__file__))
-    file = open(os.path.join(this_dir, "./default_circuit_param.yaml"), 'r')
+    with open(os.path.join(this_dir, "./default_circuit_param.yaml"), 'r') as file:
+        default_param = yaml.safe_load(file)
+
+    return default_param
 
-    default_param = yaml.load(file)
+
+def _load_solarcell_param(solarcell: SolarCell, param_name) -> np.array:
+    default_param = _load_default_param()
     param = np.empty(len(solarcell.subcell))
 
     for i in range(len(solarcell.subcell)):
@@ -19,11 +34,71 @@ def _load_solarcell_param(solarcell: SolarCell, param_name) -> np.array:
         else:
             raise NotImplementedError("parameters not here")
 
-    file.close()
-
     return param
 
 
+class ConcentrationJscCache(object):
+    """
+    jsc of each subcell under a concentration of the input spectrum.
+    jsc is linear to the concentration, so the spectrum is only integrated once and then scaled.
+
+    """
+
+    def __init__(self, solarcell: SolarCell, spectrum):
+        self.solarcell = solarcell
+        self.solarcell.set_input_spectrum(spectrum)
+        self.unit_jsc = _load_solarcell_param(self.solarcell, 'jsc')
+
+    def get_jsc(self, concentration) -> np.ndarray:
+        """
+        Get jsc of the subcells
+
+        :param concentration: a scalar or an array of concentrations
+        :return: jsc with shape (subcells,) + concentration.shape
+        """
+        return np.multiply.outer(self.unit_jsc, concentration)
+
+
+class SpectrumJscCache(object):
+    """
+    A least-recently-used cache of jsc of each subcell, keyed on the hash of the spectral vector.
+
+    """
+
+    def __init__(self, solarcell: SolarCell, maxsize=4096):
+        self.solarcell = solarcell
+        self.maxsize = maxsize
+        self._cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_jsc(self, spectral_vector: np.ndarray, to_spectrum) -> np.ndarray:
+        """
+        Get jsc of the subcells
+
+        :param spectral_vector: the 1D spectral vector of a pixel
+        :param to_spectrum: a function that converts the spectral vector to the input spectrum of the solar cell
+        :return: jsc of each subcell
+        """
+
+        key = hashlib.sha1(np.ascontiguousarray(spectral_vector, dtype=float).tobytes()).digest()
+
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        self.misses += 1
+        self.solarcell.set_input_spectrum(to_spectrum(spectral_vector))
+        jsc = _load_solarcell_param(self.solarcell, 'jsc')
+
+        self._cache[key] = jsc
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+        return jsc
+
+
 class PixelProcessor(object):
 
     def __init__(self, solarcell: SQCell, lr, lc, h, lump_series_r=0, gn=1):
@@ -75,6 +150,9 @@ class PixelProcessor(object):
         # TODO threshold of metal value
         self.metal_threshold = 0
 
+        # TODO quick fix on distinguish bus bar and finger
+        self.bus_threshold = 250
+
         self.lump_series_r = self.lump_series_r / self.area_per_pixel / self.gn
 
     def header_string(self, pw):
@@ -124,7 +202,7 @@ class PixelProcessor(object):
         if metal_coverage > self.metal_threshold:
             agg_contact = self.r_contact / (merged_pixel_area * metal_coverage) / self.gn
             # TODO quick fix on distinguish bus bar and finger
-            if np.max(sub_image) > 250:
+            if np.max(sub_image) > self.bus_threshold:
                 type = 'Bus'
             else:
                 type = 'Finger'
@@ -139,6 +217,194 @@ class PixelProcessor(object):
 
         return diode_string + node_string
 
+    def network_netlist(self, coord_set, jsc, r_metal_row, r_metal_col, metal_coverage, is_bus) -> Netlist:
+        """
+        Generate the netlist of all the pixels as a Netlist. The circuit is the same as concatenating node_string()
+        of every pixel, except that the pixels with the same diode parameters share their diode models, and that
+        the resistors to the pixels outside the image are not added.
+
+        :param coord_set: the coordinate set of the sub-images, with shape (r_pixels, c_pixels, 4)
+        :param jsc: the jsc of every junction of every pixel, with shape (junctions, r_pixels, c_pixels)
+        :param r_metal_row: aggregated metal resistances, see MaskIndex.pixel_r()
+        :param r_metal_col: aggregated metal resistances, see MaskIndex.pixel_r()
+        :param metal_coverage: metal coverage ratio of every pixel
+        :param is_bus: boolean array, True if the maximum mask value of the pixel is larger than self.bus_threshold
+        :return: the Netlist
+        """
+
+        r_pixels, c_pixels, _ = coord_set.shape
+
+        id_r, id_c = np.meshgrid(np.arange(r_pixels), np.arange(c_pixels), indexing='ij')
+
+        sub_rw = (coord_set[:, :, 1].astype(np.int64) - coord_set[:, :, 0].astype(np.int64)).ravel()
+        sub_cw = (coord_set[:, :, 3].astype(np.int64) - coord_set[:, :, 2].astype(np.int64)).ravel()
+
+        netlist, nodes = self._pixel_netlist(id_r.ravel(), id_c.ravel(), sub_rw, sub_cw,
+                                             jsc.reshape((jsc.shape[0], -1)), np.ravel(metal_coverage),
+                                             np.ravel(is_bus))
+
+        # every pixel is connected to the next pixel in the row and column directions
+        index = np.arange(r_pixels * c_pixels).reshape((r_pixels, c_pixels))
+        a = np.concatenate((index[:-1, :].ravel(), index[:, :-1].ravel()))
+        b = np.concatenate((index[1:, :].ravel(), index[:, 1:].ravel()))
+        dim = np.concatenate((np.zeros(index[:-1, :].size, dtype=int), np.ones(index[:, :-1].size, dtype=int)))
+
+        s = (sub_cw * self.lc) / (sub_rw * self.lr)
+        ratio = np.where(dim == 0, 1 / s[a], s[a])
+        r_metal = np.where(dim == 0, np.ravel(r_metal_row)[a], np.ravel(r_metal_col)[a])
+
+        # as in node_string(), the metal line of a pixel runs to the metal node of the next pixel,
+        # which is created if that pixel has no metal
+        m = nodes[2]
+        r_metal = np.where(m[a] >= 0, r_metal, np.inf)
+        bare = np.unique(b[(m[a] >= 0) & (m[b] < 0)])
+        m[bare] = netlist.node_ids(["m_0_{0}_{1}".format(str(r).zfill(3), str(c).zfill(3))
+                                    for r, c in zip(id_r.ravel()[bare].tolist(), id_c.ravel()[bare].tolist())])
+
+        self._add_lateral_elements(netlist, nodes, a, b, ratio, r_metal)
+
+        return netlist
+
+    def cell_network_netlist(self, cells, jsc, r_metal_row, r_metal_col, metal_coverage, is_bus, edges) -> Netlist:
+        """
+        Generate the netlist of the cells of a non-tensor-product mesh, e.g. meshing.QuadtreeMesh.
+        The nodes of a cell are named after its first pixel (r0, c0), and the lateral resistors are added
+        along the edges between the cells, so that a cell can be connected to several smaller neighbours.
+
+        :param cells: array of the cells with shape (cells, 4), each row is (r0, r1, c0, c1)
+        :param jsc: the jsc of every junction of every cell, with shape (junctions, cells)
+        :param r_metal_row: aggregated metal resistances of every cell, see MaskIndex.pixel_r()
+        :param r_metal_col: aggregated metal resistances of every cell, see MaskIndex.pixel_r()
+        :param metal_coverage: metal coverage ratio of every cell
+        :param is_bus: boolean array, True if the maximum mask value of the cell is larger than self.bus_threshold
+        :param edges: the edges between the cells (a, b, dim, shared), see QuadtreeMesh.edges()
+        :return: the Netlist
+        """
+
+        cells = np.asarray(cells, dtype=np.int64)
+        sub_rw = cells[:, 1] - cells[:, 0]
+        sub_cw = cells[:, 3] - cells[:, 2]
+
+        netlist, nodes = self._pixel_netlist(cells[:, 0], cells[:, 2], sub_rw, sub_cw, jsc,
+                                             np.asarray(metal_coverage), np.asarray(is_bus))
+
+        a, b, dim, shared = edges
+
+        # the distance between the centers of the two cells over the width of their common edge
+        center = np.stack(((cells[:, 0] + cells[:, 1]) / 2, (cells[:, 2] + cells[:, 3]) / 2))
+        distance = (center[dim, b] - center[dim, a]) * np.where(dim == 0, self.lr, self.lc)
+        width = shared * np.where(dim == 0, self.lc, self.lr)
+
+        # the metal lines of each cell are narrowed to the common edge and connected in series
+        r_metal_row, r_metal_col = np.asarray(r_metal_row), np.asarray(r_metal_col)
+        r_metal_a = np.where(dim == 0, r_metal_row[a], r_metal_col[a]) * np.where(dim == 0, sub_cw[a], sub_rw[a])
+        r_metal_b = np.where(dim == 0, r_metal_row[b], r_metal_col[b]) * np.where(dim == 0, sub_cw[b], sub_rw[b])
+
+        is_metal = nodes[2] >= 0
+        with np.errstate(invalid='ignore'):
+            r_edge_metal = np.where(is_metal[a] & is_metal[b], 0.5 * (r_metal_a + r_metal_b) / shared, np.inf)
+
+        self._add_lateral_elements(netlist, nodes, a, b, distance / width, r_edge_metal)
+
+        return netlist
+
+    def _pixel_netlist(self, id_r, id_c, sub_rw, sub_cw, jsc, metal_coverage, is_bus):
+        """
+        Add the elements of every pixel itself: diodes, current sources, series resistors, contacts and bus bars.
+
+        :return: the Netlist, and the node ids (t, b, m). t and b have the shape (junctions, pixels),
+        m has the shape (pixels,) and is -1 for the pixels without metal
+        """
+
+        assert np.all(sub_rw * sub_cw > 0)
+
+        netlist = Netlist()
+
+        i01 = self.raw_i01[:, np.newaxis] * self.area_per_pixel * sub_rw * sub_cw * self.gn
+
+        names, unique_params, diode_model = _unique_diode_params(i01, self.n1, self.eg)
+        for name, (i0, n, eg) in zip(names.tolist(), unique_params.tolist()):
+            netlist.models[name] = {'is': i0, 'n': n, 'eg': eg}
+
+        isc = jsc * self.lc * self.lr * self.gn
+
+        merged_pixel_area = sub_cw * self.lc * sub_rw * self.lr
+
+        is_metal = metal_coverage > self.metal_threshold
+        with np.errstate(divide='ignore', invalid='ignore'):
+            agg_contact = self.r_contact / (merged_pixel_area * metal_coverage) / self.gn
+
+        junction_num = jsc.shape[0]
+        loc = ["{0}_{1}".format(str(r).zfill(3), str(c).zfill(3)) for r, c in zip(id_r.tolist(), id_c.tolist())]
+        t = np.stack([netlist.node_ids(["t_{0}_{1}".format(j, lc) for lc in loc]) for j in range(junction_num)])
+        b = np.stack([netlist.node_ids(["b_{0}_{1}".format(j, lc) for lc in loc]) for j in range(junction_num)])
+        m = np.full(len(loc), -1, dtype=np.int64)
+        m[is_metal] = netlist.node_ids(["m_0_{0}".format(loc[k]) for k in np.flatnonzero(is_metal)])
+
+        for j in range(junction_num):
+            netlist.add_elements('D', t[j], b[j], model=diode_model[j])
+            netlist.add_elements('I', b[j][isc[j] > 0], t[j][isc[j] > 0], isc[j][isc[j] > 0])
+
+            # TODO temperarily add total series resistance here
+            low = t[j + 1] if j + 1 < junction_num else 0
+            netlist.add_elements('R', b[j], low, self.lump_series_r if j == 0 else 0)
+
+        netlist.add_elements('R', t[0][is_metal], m[is_metal], agg_contact[is_metal])
+
+        is_bus = is_metal & is_bus
+        netlist.add_elements('R', np.repeat(netlist.node_ids(['in']), np.sum(is_bus)), m[is_bus], 0)
+
+        netlist.add_probes(np.concatenate((t.ravel(), b.ravel(), m[is_metal])))
+
+        return netlist, (t, b, m)
+
+    def _add_lateral_elements(self, netlist, nodes, a, b, ratio, r_metal):
+        """
+        Add the lateral resistors between pairs of pixels
+
+        :param netlist: the Netlist
+        :param nodes: node ids returned by _pixel_netlist()
+        :param a: the index of the first pixel of every pair
+        :param b: the index of the second pixel of every pair
+        :param ratio: the length over the width of the sheet between the pixels
+        :param r_metal: the metal resistance between the pixels. Infinite resistances are not added.
+        """
+
+        t, b_nodes, m = nodes
+
+        for j in range(t.shape[0]):
+            netlist.add_elements('R', t[j][a], t[j][b], self._cicuit_params['rs_top'][j] * ratio)
+            netlist.add_elements('R', b_nodes[j][a], b_nodes[j][b], self._cicuit_params['rs_bot'][j] * ratio)
+
+        r_metal = np.asarray(r_metal)
+        connected = np.isfinite(r_metal)
+        netlist.add_elements('R', m[a][connected], m[b][connected], r_metal[connected])
+
+
+def _unique_diode_params(i01, n1, eg):
+    """
+    Find the distinct (is, n, eg) of the diodes, so that the diodes with the same parameters share a model.
+    Only diode 1 is written in the netlist, so the models of diode 2 are not generated.
+
+    :param i01: the saturation currents of diode 1 with shape (junctions, pixels)
+    :param n1: the ideality factors of diode 1 of every junction
+    :param eg: the band gaps of every junction
+    :return: the model names, the parameters (is, n, eg) of each model, the model names of diode 1
+    with shape (junctions, pixels)
+    """
+
+    junction_num, pixel_num = i01.shape
+
+    params = np.column_stack((i01.ravel(), np.repeat(n1, pixel_num), np.repeat(eg, pixel_num)))
+
+    unique_params, inverse = np.unique(params, axis=0, return_inverse=True)
+
+    names = np.array(["diode_{}".format(k) for k in range(unique_params.shape[0])])
+
+    diode1_model = names[inverse.ravel()].reshape((junction_num, pixel_num))
+
+    return names, unique_params, diode1_model
+
 
 def create_node(type, idr, idc, l_r, l_c, isc, rs_top, rs_bot, r_shunt, r_series, r_metal_top_r, r_metal_top_c,
                 r_contact, boundary_r=False, boundary_c=False, lump_series_r=0):
@@ -0,0 +1,184 @@
+"""
+A content-addressed on-disk cache of solved circuits.
+The results are keyed on the hash of the final (post-reduction) netlist and the version of the circuit solver,
+and saved as uncompressed .npz files. The least recently used files are evicted when the size limit is exceeded.
+
+The default cache is configured in the configuration file:
+[Path_config] solve_cache_path = /path/to/cache (empty to disable the cache), solve_cache_size_mb = 1024
+
+"""
+
+import os
+import hashlib
+import functools
+import subprocess
+import tempfile
+import zipfile
+import numpy as np
+
+from .config_tool import user_config_data
+
+
+@functools.lru_cache(maxsize=None)
+def engine_version(backend: str, engine: str = '') -> str:
+    """
+    Identify the version of a circuit solver. Results solved by different versions are cached separately.
+
+    :param backend: 'ngspice', 'ngspice_shared' or 'sparse'
+    :param engine: the path of the ngspice executable or libngspice
+    :return: a string that identifies the solver
+    """
+
+    if backend == 'sparse':
+        # the sparse solver is identified by its source code
+        from . import sparse_solver
+        with open(sparse_solver.__file__, 'rb') as fp:
+            return 'sparse-' + hashlib.sha1(fp.read()).hexdigest()
+
+    if backend == 'ngspice':
+        try:
+            proc = subprocess.run([engine, '-v'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=30)
+            return 'ngspice-' + proc.stdout.decode('ascii', errors='replace').strip()
+        except (OSError, subprocess.SubprocessError):
+            return 'ngspice-' + engine
+
+    stat = os.stat(engine) if os.path.exists(engine) else None
+    return '{}-{}-{}'.format(backend, engine, None if stat is None else (stat.st_size, stat.st_mtime))
+
+
+class SolveCache(object):
+    """
+    A least-recently-used cache of solved circuits in a folder. Every entry is a dictionary of numpy arrays.
+
+    """
+
+    _default = None
+
+    def __init__(self, cache_path, max_size_mb=1024):
+        """
+
+        :param cache_path: the folder of the cache files. It is created if it does not exist.
+        :param max_size_mb: the maximum total size of the cache files in megabytes
+        """
+
+        os.makedirs(cache_path, exist_ok=True)
+        self.cache_path = cache_path
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def default(cls):
+        """
+        Return the cache set in the configuration file. The cache is created at the first call.
+
+        :return: the SolveCache, or None if solve_cache_path is not set
+        """
+
+        cache_path = user_config_data.get('Path_config', 'solve_cache_path', fallback='')
+        if cache_path == '':
+            return None
+
+        if cls._default is None or cls._default.cache_path != cache_path:
+            cls._default = cls(cache_path, user_config_data.getfloat('Path_config', 'solve_cache_size_mb',
+                                                                     fallback=1024))
+        return cls._default
+
+    @staticmethod
+    def key(*parts) -> str:
+        """
+        Hash the netlist and everything else that determines the results
+
+        :param parts: strings, e.g. the SPICE netlist, the solver version and the output settings
+        :return: the hex digest
+        """
+
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(str(part).encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def _file(self, key):
+
+        return os.path.join(self.cache_path, key + '.npz')
+
+    def get(self, key):
+        """
+        Load a cached entry
+
+        :param key: the key returned by SolveCache.key()
+        :return: the dictionary of arrays, or None if the entry is not cached
+        """
+
+        file_path = self._file(key)
+        try:
+            with np.load(file_path, allow_pickle=False) as data:
+                entry = {name: data[name] for name in data.files}
+        except (OSError, ValueError, zipfile.BadZipFile):
+            self.misses += 1
+            return None
+
+        # the modification time records the last use
+        os.utime(file_path)
+        self.hits += 1
+
+        return entry
+
+    def put(self, key, entry: dict):
+        """
+        Save an entry and evict the least recently used entries if the cache is too large
+
+        :param key: the key returned by SolveCache.key()
+        :param entry: a dictionary of numpy arrays
+        """
+
+        # write to a temporary file first, so that other processes never read a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fp:
+            np.savez(fp, **entry)
+        os.replace(tmp_path, self._file(key))
+
+        self._evict()
+
+    def _entries(self):
+
+        entries = []
+        for name in os.listdir(self.cache_path):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.cache_path, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        return sorted(entries)
+
+    def _evict(self):
+
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_path, name))
+                self.evictions += 1
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+
+        for _, _, name in self._entries():
+            os.remove(os.path.join(self.cache_path, name))
+
+    def stats(self) -> dict:
+        """
+        :return: the hit/miss statistics of this process and the current entries and size of the cache
+        """
+
+        entries = self._entries()
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(entries), 'size_bytes': sum(size for _, size, _ in entries)}
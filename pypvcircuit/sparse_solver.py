@@ -0,0 +1,413 @@
+"""
+A native solver backend that solves the solar cell network without spawning ngspice.
+
+The netlist is assembled into a sparse modified nodal-analysis system (resistors, current sources, diodes and
+DC voltage sources such as the sweep source ``vdep``) and the DC sweep is solved with a damped Newton iteration
+in scipy.sparse.
+The results are returned in the same dictionary format as parse_spice_output.parse_output(),
+so that SPICESolver can use either backend without changing its output parsing.
+
+"""
+
+import math
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+
+from .netlist import Netlist, parse_diode_model, GROUND
+from .parse_spice_input import merge_shorted_nodes
+
+# Physical constants used by ngspice
+BOLTZMANN = 1.38064852e-23
+CHARGE = 1.6021766208e-19
+CELSIUS_TO_KELVIN = 273.15
+
+
+class ConvergenceError(RuntimeError):
+    """
+    The Newton iteration of a point of the sweep does not converge
+
+    """
+    pass
+
+
+def sweep_values(start, stop, step):
+    """
+    Generate the sweep points of a .DC statement in the same way as ngspice, i.e. the end value is included.
+
+    :param start: the start value
+    :param stop: the stop value
+    :param step: the step
+    :return: a 1D array of sweep values
+    """
+    n = int(math.floor((stop - start) / step + 1e-9)) + 1
+    return start + step * np.arange(n)
+
+
+def _output_key(probe: str):
+    """
+    Convert a probe in .PRINT statement into the key of parse_output(),
+    e.g. v(t_0_000_000) -> (t_0_000_000) and i(vdep) -> dep#branch
+
+    """
+    if probe[0].lower() == 'i':
+        return probe[3:-1] + "#branch"
+    else:
+        return probe[1:]
+
+
+class SparseNetwork(object):
+    """
+    The nodal-analysis representation of a netlist.
+
+    Only the devices used by this package are supported: resistors, DC current sources, diodes and DC voltage sources.
+    Zero-ohm resistors are collapsed into single nodes and infinite resistors are ignored.
+    Grounded voltage sources fix the voltages of their positive nodes, the other voltage sources add
+    their branch currents to the unknowns of the nodal equations.
+
+    """
+
+    def __init__(self, spice_file_contents):
+        """
+
+        :param spice_file_contents: the netlist, either a string formated as a spice-readable file or a Netlist
+        """
+
+        self.roots = dict()
+        self.temperature = 27.0
+        self.nominal_temperature = 27.0
+        self.models = dict()
+        self.sweep = None
+        self.probes = []
+        self.nodeset = dict()
+        # total number of Newton iterations of the solved points
+        self.newton_iterations = 0
+
+        self._resistors = []
+        self._sources = []
+        self._diodes = []
+        self._vsources = dict()
+
+        if isinstance(spice_file_contents, str):
+            spice_file_contents = Netlist.from_spice(spice_file_contents)
+
+        self._read_netlist(spice_file_contents)
+        self._assemble()
+
+    def _read_netlist(self, netlist: Netlist):
+
+        kind, _, p_node, n_node, value, model = netlist.elements()
+        node_names = np.array(netlist.node_names, dtype=object)
+        p_names = node_names[p_node].tolist()
+        n_names = node_names[n_node].tolist()
+        element_names = netlist.element_names()
+
+        # {node name: name of the merged node} of the nodes connected by zero-ohm resistors
+        shorted = (kind == 'R') & (value == 0)
+        labels, set_names = merge_shorted_nodes(netlist.node_names, p_node[shorted], n_node[shorted])
+        if len(set(set_names)) < len(set_names):
+            raise ValueError("The names of the merged nodes clash with the node names of the netlist")
+        self.roots = dict(zip(netlist.node_names, np.array(set_names, dtype=object)[labels].tolist()))
+
+        for k, name, p, n, v, m in zip(kind.tolist(), element_names, p_names, n_names, value.tolist(), model):
+            if k == 'R':
+                if v != 0 and v != np.inf:
+                    self._resistors.append((p, n, 1.0 / v))
+            elif k == 'I':
+                self._sources.append((p, n, v))
+            elif k == 'D':
+                self._diodes.append((p, n, m))
+            elif k == 'V':
+                self._vsources[name.lower()] = (p, n, v)
+
+        for key, value in netlist.options.items():
+            if key.lower() == 'temp':
+                self.temperature = float(value)
+            elif key.lower() == 'tnom':
+                self.nominal_temperature = float(value)
+
+        self.models.update(netlist.models)
+
+        if netlist.dc is not None:
+            name, start, stop, step = netlist.dc
+            self.sweep = (name.lower(), start, stop, step)
+
+        self.probes = ["i({})".format(s) for s in netlist.current_probes] + \
+                      ["v({})".format(node_names[i]) for i in netlist.probes]
+        self.nodeset.update(netlist.nodeset)
+
+    def _find(self, node):
+        return self.roots.get(node, node)
+
+    def _node_index(self, nodes):
+        return np.array([self.node_id[self._find(n)] for n in nodes], dtype=np.int64)
+
+    def _assemble(self):
+
+        for name, (p, n, value) in self._vsources.items():
+            if self._find(p) == self._find(n):
+                raise ValueError("The voltage source {} is shorted".format(name))
+
+        grounded = {name: source for name, source in self._vsources.items()
+                    if self._find(source[1]) == GROUND}
+        floating = {name: source for name, source in self._vsources.items() if name not in grounded}
+
+        all_nodes = set()
+        for p, n, _ in self._resistors + self._sources + self._diodes + list(self._vsources.values()):
+            all_nodes.add(self._find(p))
+            all_nodes.add(self._find(n))
+        all_nodes.discard(GROUND)
+
+        fixed_nodes = {self._find(p) for p, _, _ in grounded.values()}
+        free_nodes = sorted(all_nodes - fixed_nodes)
+
+        # free nodes first, then the nodes fixed by voltage sources, ground is the last one
+        self.node_names = free_nodes + sorted(fixed_nodes - {GROUND}) + [GROUND]
+        self.node_id = {name: i for i, name in enumerate(self.node_names)}
+        self.free_num = len(free_nodes)
+        node_num = len(self.node_names)
+
+        # conductance matrix of the linear part
+        if len(self._resistors) > 0:
+            p, n, g = zip(*self._resistors)
+            pi = self._node_index(p)
+            ni = self._node_index(n)
+            g = np.array(g)
+        else:
+            pi = ni = np.empty(0, dtype=np.int64)
+            g = np.empty(0)
+        rows = np.concatenate((pi, ni, pi, ni))
+        cols = np.concatenate((pi, ni, ni, pi))
+        vals = np.concatenate((g, g, -g, -g))
+        self.G = sp.csr_matrix((vals, (rows, cols)), shape=(node_num, node_num))
+
+        # currents leaving the nodes through the current sources
+        self.source_current = np.zeros(node_num)
+        if len(self._sources) > 0:
+            p, n, isrc = zip(*self._sources)
+            isrc = np.array(isrc)
+            np.add.at(self.source_current, self._node_index(p), isrc)
+            np.add.at(self.source_current, self._node_index(n), -isrc)
+
+        # diode incidence matrix: +1 on anodes and -1 on cathodes
+        d_num = len(self._diodes)
+        if d_num > 0:
+            p, n, model_names = zip(*self._diodes)
+            anode = self._node_index(p)
+            cathode = self._node_index(n)
+        else:
+            anode = cathode = np.empty(0, dtype=np.int64)
+            model_names = []
+        d_index = np.arange(d_num)
+        self.D = sp.csr_matrix((np.concatenate((np.ones(d_num), -np.ones(d_num))),
+                                (np.concatenate((anode, cathode)), np.concatenate((d_index, d_index)))),
+                               shape=(node_num, d_num))
+
+        self._set_diode_params(model_names)
+
+        self._fixed_voltage = {name: (self.node_id[self._find(p)], value) for name, (p, _, value) in grounded.items()}
+
+        # branch incidence matrix of the floating voltage sources: +1 on positive nodes and -1 on negative nodes
+        b_num = len(floating)
+        self.branch_names = list(floating.keys())
+        self.branch_voltage = np.array([value for _, _, value in floating.values()], dtype=float)
+        b_index = np.arange(b_num)
+        self.B = sp.csr_matrix((np.concatenate((np.ones(b_num), -np.ones(b_num))),
+                                (np.concatenate((self._node_index([p for p, _, _ in floating.values()]),
+                                                 self._node_index([n for _, n, _ in floating.values()]))),
+                                 np.concatenate((b_index, b_index)))),
+                               shape=(node_num, b_num))
+
+    def _set_diode_params(self, model_names):
+
+        temp_k = self.temperature + CELSIUS_TO_KELVIN
+        tnom_k = self.nominal_temperature + CELSIUS_TO_KELVIN
+        vt = BOLTZMANN * temp_k / CHARGE
+        vt_nom = BOLTZMANN * tnom_k / CHARGE
+
+        i_s = np.empty(len(model_names))
+        n_vt = np.empty(len(model_names))
+        for i, name in enumerate(model_names):
+            model = self.models[name]
+            n = model.get('n', 1.0)
+            eg = model.get('eg', 1.11)
+            xti = model.get('xti', 3.0)
+            ratio = temp_k / tnom_k
+            # the temperature scaling of saturation current used by SPICE
+            i_s[i] = model.get('is', 1e-14) * math.exp((ratio - 1) * eg / (n * vt_nom) + xti / n * math.log(ratio))
+            n_vt[i] = n * vt
+
+        self.i_s = i_s
+        self.n_vt = n_vt
+        self.v_crit = n_vt * np.log(n_vt / (math.sqrt(2) * i_s))
+
+    def _diode_current(self, vd, gmin):
+
+        expv = np.exp(vd / self.n_vt)
+        i_d = self.i_s * (expv - 1) + gmin * vd
+        g_d = self.i_s * expv / self.n_vt + gmin
+
+        return i_d, g_d
+
+    def _limit_junction(self, v_new, v_old):
+        """
+        The junction voltage limiting (pnjlim) of SPICE, which avoids the overflow of exponential terms.
+
+        """
+
+        limit = (v_new > self.v_crit) & (np.abs(v_new - v_old) > 2 * self.n_vt)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            arg = 1 + (v_new - v_old) / self.n_vt
+            from_old = v_old + self.n_vt * np.log(np.where(arg > 0, arg, 1))
+            from_crit = self.n_vt * np.log(v_new / self.n_vt)
+        limited = np.where(v_old > 0, np.where(arg > 0, from_old, self.v_crit), from_crit)
+
+        return np.where(limit, limited, v_new)
+
+    def solve_point(self, v_fixed, v_init, v_branch=None, gmin=1e-12, reltol=1e-6, vntol=1e-9, max_iter=200):
+        """
+        Solve the DC operating point with Newton iteration
+
+        :param v_fixed: voltages of the nodes fixed by voltage sources (including ground)
+        :param v_init: the initial guess of the free node voltages
+        :param v_branch: voltages of the floating voltage sources. If None, the values of the netlist are used.
+        :param gmin: minimum conductance in parallel with every diode
+        :param reltol: relative tolerance of node voltages
+        :param vntol: absolute tolerance of node voltages
+        :param max_iter: maximum number of Newton iterations
+        :return: node voltages of all the nodes, currents through the floating voltage sources
+        """
+
+        f = self.free_num
+        G_ff = self.G[:f, :f]
+        G_fx = self.G[:f, f:]
+        D_f = self.D[:f, :]
+        D_x = self.D[f:, :]
+        B_f = self.B[:f, :]
+
+        if v_branch is None:
+            v_branch = self.branch_voltage
+
+        v_f = np.array(v_init, dtype=float)
+        vd_fixed = D_x.T @ v_fixed
+        rhs_linear = -G_fx @ v_fixed - self.source_current[:f]
+        rhs_branch = v_branch - self.B[f:, :].T @ v_fixed
+        vd = D_f.T @ v_f + vd_fixed
+
+        for it in range(max_iter):
+            self.newton_iterations += 1
+            i_d, g_d = self._diode_current(vd, gmin)
+
+            jac = G_ff + D_f @ sp.diags(g_d) @ D_f.T
+            rhs = rhs_linear - D_f @ (i_d - g_d * vd + g_d * vd_fixed)
+            if B_f.shape[1] > 0:
+                jac = sp.bmat([[jac, B_f], [B_f.T, None]])
+                rhs = np.concatenate((rhs, rhs_branch))
+
+            solution = spla.spsolve(jac.tocsc(), rhs)
+            v_new, i_branch = solution[:f], solution[f:]
+
+            converged = np.all(np.abs(v_new - v_f) <= reltol * np.maximum(np.abs(v_new), np.abs(v_f)) + vntol)
+
+            vd_new = D_f.T @ v_new + vd_fixed
+            vd_limited = self._limit_junction(vd_new, vd)
+
+            v_f = v_new
+            if converged and np.allclose(vd_limited, vd_new):
+                return np.concatenate((v_f, v_fixed)), i_branch
+            vd = vd_limited
+
+        raise ConvergenceError("Newton iteration does not converge after {} iterations".format(max_iter))
+
+    def branch_current(self, v_all, source_name, gmin=1e-12):
+        """
+        Calculate the current flowing into the positive node of a grounded voltage source, which is i(vsource) in SPICE.
+
+        """
+
+        node = self._fixed_voltage[source_name][0]
+
+        vd = self.D.T @ v_all
+        i_d, _ = self._diode_current(vd, gmin)
+        leaving_current = self.G[node, :].dot(v_all)[0] + self.D[node, :].dot(i_d)[0] + self.source_current[node]
+
+        return -leaving_current
+
+    def node_voltage(self, v_all, node):
+
+        return v_all[self.node_id[self._find(node)]]
+
+    def run_dc_sweep(self):
+        """
+        Run the .DC sweep defined in the netlist
+
+        :return: a dictionary with the same format as parse_spice_output.parse_output()
+        """
+
+        if self.sweep is None:
+            raise ValueError("The netlist does not have a .DC statement")
+
+        sweep_name, start, stop, step = self.sweep
+        sweep_v = sweep_values(start, stop, step)
+
+        fixed_id = np.arange(self.free_num, len(self.node_names))
+        v_fixed = np.zeros(fixed_id.size)
+        for name, (node, value) in self._fixed_voltage.items():
+            v_fixed[node - self.free_num] = value
+        v_branch = self.branch_voltage.copy()
+        if sweep_name in self._fixed_voltage:
+            sweep_node, sweep_branch = self._fixed_voltage[sweep_name][0] - self.free_num, None
+        else:
+            sweep_node, sweep_branch = None, self.branch_names.index(sweep_name)
+
+        v_sol = np.empty((sweep_v.size, len(self.node_names)))
+        current = dict()
+        v_init = np.zeros(self.free_num)
+
+        # .NODESET gives the initial guess of the first point
+        for node, value in self.nodeset.items():
+            node_id = self.node_id.get(self._find(node), self.free_num)
+            if node_id < self.free_num:
+                v_init[node_id] = value
+
+        for si, sv in enumerate(sweep_v):
+            if sweep_branch is None:
+                v_fixed[sweep_node] = sv
+            else:
+                v_branch[sweep_branch] = sv
+            v_sol[si, :], i_branch = self.solve_point(v_fixed, v_init, v_branch)
+            v_init = v_sol[si, :self.free_num]
+            for name in self._fixed_voltage.keys():
+                current.setdefault(name, np.empty(sweep_v.size))[si] = self.branch_current(v_sol[si, :], name)
+            for name, i in zip(self.branch_names, i_branch.tolist()):
+                current.setdefault(name, np.empty(sweep_v.size))[si] = i
+
+        results = dict()
+        for probe in self.probes:
+            key = _output_key(probe)
+            target = probe[2:-1]
+            if probe[0].lower() == 'i':
+                results[key] = (sweep_v.copy(), current[target.lower()])
+            elif self._find(target) == GROUND:
+                results[key] = (sweep_v.copy(), np.zeros(sweep_v.size))
+            else:
+                results[key] = (sweep_v.copy(), v_sol[:, self.node_id[self._find(target)]])
+
+        return results
+
+
+def solve_circuit_sparse(spice_file_contents, postprocess_input=None):
+    """
+    Solve the circuit with the sparse Newton solver instead of ngspice.
+
+    :param spice_file_contents: string formated as a spice-readable file, or a Netlist
+    :param postprocess_input: the function that post-processes the netlist, e.g. NodeReducer.process_spice_input
+    :return: dictionary of parsed results, same as parse_spice_output.parse_output()
+    """
+
+    if postprocess_input is not None:
+        spice_file_contents = postprocess_input(spice_file_contents)
+
+    network = SparseNetwork(spice_file_contents)
+
+    return network.run_dc_sweep()
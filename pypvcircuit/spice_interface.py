@@ -7,6 +7,12 @@ The code is adapted from solcore5 (https://github.com/dalonsoa/solcore5)
 
 import numpy
 import os
+import gzip
+import time
+import uuid
+import signal
+import asyncio
+import weakref
 import subprocess
 import tempfile
 from .parse_spice_input import reprocess_spice_input
@@ -17,9 +23,206 @@ class SpiceConfig:
     engine = user_config_data.get('External programs', 'spice')
     input_file = "current_spice.cir"
     output_file = "current_spice.out"
+    rawfile = "current_spice.raw"
 
+    # The policy of saving the netlists and outputs into spice_path:
+    # 'none': nothing is saved, 'failure': saved only when ngspice fails, 'all': saved for every run
+    artifacts = user_config_data.get('Path_config', 'spice_artifacts', fallback='none')
+    compress_artifacts = user_config_data.getboolean('Path_config', 'spice_artifacts_gzip', fallback=False)
 
-def solve_circuit(spice_file_contents, engine=SpiceConfig.engine, raw=True, postprocess_input=reprocess_spice_input):
+    # The maximum number of ngspice processes run concurrently by solve_circuit_async(). Defaults to the number of CPUs.
+    max_processes = int(user_config_data.get('External programs', 'spice_max_processes', fallback='') or
+                        os.cpu_count() or 1)
+
+    # The wall-clock time limit of every ngspice run in seconds. None for no limit.
+    timeout = float(user_config_data.get('External programs', 'spice_timeout', fallback='') or 0) or None
+
+
+class SpiceError(RuntimeError):
+    """
+    ngspice failed to solve the circuit: it exited with an error, or it did not write the output files.
+
+    """
+
+    def __init__(self, message, returncode=None, stderr=""):
+        """
+
+        :param message: the description of the failure
+        :param returncode: the exit code of ngspice, None if ngspice was killed
+        :param stderr: the standard error output of ngspice
+        """
+
+        # the last lines of stderr usually tell why ngspice fails
+        stderr_tail = "\n".join(stderr.strip().splitlines()[-10:])
+        super().__init__(message + ("\n" + stderr_tail if stderr_tail != "" else ""))
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+class SpiceTimeoutError(SpiceError):
+    """
+    ngspice did not finish within the time limit and was killed
+
+    """
+
+    def __init__(self, timeout, stderr=""):
+        super().__init__("ngspice did not finish in {} seconds".format(timeout), None, stderr)
+        self.timeout = timeout
+
+
+def _new_session_kwargs() -> dict:
+    """
+    The arguments of subprocess.Popen() that start ngspice in a new process group,
+    so that ngspice and its child processes can be killed together.
+
+    """
+
+    if os.name == 'posix':
+        return {'start_new_session': True}
+
+    return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+
+
+def _kill_process_group(process):
+
+    try:
+        if os.name == 'posix':
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except OSError:
+        # the process has already exited
+        pass
+
+
+# the semaphores that limit the concurrent ngspice processes of every event loop
+_process_semaphores = weakref.WeakKeyDictionary()
+
+
+def process_semaphore() -> asyncio.Semaphore:
+    """
+    Get the semaphore shared by all the solve_circuit_async() calls in the running event loop.
+    It allows SpiceConfig.max_processes concurrent ngspice processes.
+
+    """
+
+    loop = asyncio.get_running_loop()
+    if loop not in _process_semaphores:
+        _process_semaphores[loop] = asyncio.Semaphore(SpiceConfig.max_processes)
+
+    return _process_semaphores[loop]
+
+
+def save_artifacts(spice_path, files: dict, compress=False):
+    """
+    Save the netlists and outputs of a run into spice_path. Every run is given an unique prefix,
+    so that concurrent runs do not overwrite the files of each other.
+
+    :param spice_path: the folder of saved files
+    :param files: a dictionary of {file name: file content}
+    :param compress: compress the files with gzip
+    :return: the list of paths of saved files
+    """
+
+    run_id = "{}_{}_{}".format(time.strftime("%Y%m%d-%H%M%S"), os.getpid(), uuid.uuid4().hex[:8])
+
+    saved_files = []
+    for name, content in files.items():
+        file_path = os.path.join(spice_path, "{}_{}".format(run_id, name))
+        if compress:
+            file_path += ".gz"
+            with gzip.open(file_path, "wt") as f:
+                f.write(content)
+        else:
+            with open(file_path, "w") as f:
+                f.write(content)
+        saved_files.append(file_path)
+
+    return saved_files
+
+
+def _spice_command(engine, working_directory, spice_file_contents, rawfile):
+    """
+    Write the netlist into the working directory and make the ngspice command line
+
+    :return: the command, and the paths of the input file, the output file and the rawfile
+    """
+
+    spice_file_path = os.path.join(working_directory, SpiceConfig.input_file)
+    spice_output_path = os.path.join(working_directory, SpiceConfig.output_file)
+    spice_rawfile_path = os.path.join(working_directory, SpiceConfig.rawfile)
+
+    with open(spice_file_path, "w") as f:
+        f.write(spice_file_contents)
+
+    command = [engine, '-b', spice_file_path, '-o', spice_output_path]
+    if rawfile:
+        command += ['-r', spice_rawfile_path]
+
+    return command, spice_output_path, spice_rawfile_path
+
+
+def _collect_results(returncode, stderr, timeout, spice_output_path, spice_rawfile_path, raw_spice_file_contents,
+                     spice_file_contents, raw, rawfile, artifacts):
+    """
+    Read the results of a finished ngspice process
+
+    :param returncode: the exit code of ngspice, None if it was killed after the timeout
+    :param stderr: the standard error output of ngspice in bytes
+    """
+
+    stderr = stderr.decode('utf-8', errors='replace') if stderr else ""
+
+    failed = returncode != 0 or not os.path.exists(spice_output_path) or \
+             (rawfile and not os.path.exists(spice_rawfile_path))
+
+    raw_results = ""
+    if os.path.exists(spice_output_path):
+        with open(spice_output_path, "r") as f:
+            raw_results = f.read()
+
+    if artifacts == 'all' or (artifacts == 'failure' and failed):
+        save_artifacts(user_config_data.get('Path_config', 'spice_path'),
+                       {"spice_in_raw.txt": raw_spice_file_contents,
+                        "spice_in.txt": spice_file_contents,
+                        "spice_out.txt": raw_results,
+                        "spice_err.txt": stderr}, compress=SpiceConfig.compress_artifacts)
+
+    if returncode is None:
+        raise SpiceTimeoutError(timeout, stderr)
+
+    if returncode != 0:
+        raise SpiceError("ngspice exited with an error (exit code:{})".format(returncode), returncode, stderr)
+
+    if failed:
+        raise SpiceError("ngspice did not write the output file (exit code:{})".format(returncode), returncode, stderr)
+
+    if rawfile:
+        with open(spice_rawfile_path, "rb") as f:
+            return f.read()
+
+    if raw:
+        # We return all the output
+        return raw_results
+
+    else:
+        # We return just the lines starting with a number, which is OK in certain simple cases
+        lines = raw_results.split("\n")
+        data = []
+        for line in lines:
+            if len(line) == 0 or line[0] not in "1234567890.":
+                continue
+            # print (line)
+
+            i, *rest = line.split()
+            # print (len(rest))
+            data.append([float(element) for element in rest])
+
+        return numpy.array(data).transpose()
+
+
+def solve_circuit(spice_file_contents, engine=None, raw=True, postprocess_input=reprocess_spice_input,
+                  rawfile=False, artifacts=None, timeout=None):
     """
     Sends the spice-readable file to the spice engine which will run it and store the data in a temporary folder.
     Once the process is finished, it collects the data and returns it.
@@ -29,16 +232,26 @@ def solve_circuit(spice_file_contents, engine=SpiceConfig.engine, raw=True, post
     from spice and deal with it as convenient, depending on the application.
 
     :param spice_file_contents: string formated as a spice-readable file contaning the design of the circuit and the instructions
-    :param engine: the spice engine.
+    :param engine: the spice engine. If None, SpiceConfig.engine is used.
     :param raw: whether to produce the raw output or after some processing.
+    :param rawfile: if True, ngspice writes its results to a binary rawfile (ngspice -r), and the content of the rawfile is returned as bytes.
+    :param artifacts: the policy of saving the netlists and the output into spice_path: 'none', 'failure' or 'all'. If None, SpiceConfig.artifacts is used.
+    :param timeout: the time limit in seconds. ngspice and its child processes are killed if it is exceeded. If None, SpiceConfig.timeout is used.
     :return: depending of the value of raw, this might be all the output of spice or just an array of data
+    :raises SpiceError: if ngspice fails. SpiceTimeoutError if it is killed after the timeout.
     """
 
-    SpiceConfig.engine = engine
-    spice_path = user_config_data.get('Path_config', 'spice_path')
+    if engine is None:
+        engine = SpiceConfig.engine
 
-    with open(os.path.join(spice_path, "spice_in_raw.txt"), "w") as f:
-        f.write(spice_file_contents)
+    if timeout is None:
+        timeout = SpiceConfig.timeout
+
+    if artifacts is None:
+        artifacts = SpiceConfig.artifacts
+    assert artifacts in ('none', 'failure', 'all')
+
+    raw_spice_file_contents = spice_file_contents
 
     # post process the input script if necessary
     if postprocess_input is not None:
@@ -46,43 +259,89 @@ def solve_circuit(spice_file_contents, engine=SpiceConfig.engine, raw=True, post
 
     with tempfile.TemporaryDirectory(prefix="tmp", suffix="_sc3NGSPICE") as working_directory:
 
-        spice_file_path = os.path.join(working_directory, SpiceConfig.input_file)
-        spice_output_path = os.path.join(working_directory, SpiceConfig.output_file)
+        command, spice_output_path, spice_rawfile_path = _spice_command(engine, working_directory,
+                                                                        spice_file_contents, rawfile)
+
+        this_process = subprocess.Popen(command, stderr=subprocess.PIPE, **_new_session_kwargs())
+        returncode = None
+        try:
+            _, stderr = this_process.communicate(timeout=timeout)
+            returncode = this_process.returncode
+        except subprocess.TimeoutExpired:
+            _kill_process_group(this_process)
+            _, stderr = this_process.communicate()
+        except BaseException:
+            # e.g. KeyboardInterrupt, do not leave ngspice running
+            _kill_process_group(this_process)
+            this_process.wait()
+            raise
+
+        return _collect_results(returncode, stderr, timeout, spice_output_path, spice_rawfile_path,
+                                raw_spice_file_contents, spice_file_contents, raw, rawfile, artifacts)
+
+
+async def solve_circuit_async(spice_file_contents, engine=None, raw=True, postprocess_input=reprocess_spice_input,
+                              rawfile=False, artifacts=None, timeout=None, semaphore=None):
+    """
+    The asyncio version of solve_circuit(). The event loop keeps running other jobs while ngspice solves the circuit.
+    The number of concurrent ngspice processes is limited by the semaphore.
+
+    :param spice_file_contents: string formated as a spice-readable file contaning the design of the circuit and the instructions
+    :param engine: the spice engine. If None, SpiceConfig.engine is used.
+    :param raw: whether to produce the raw output or after some processing.
+    :param rawfile: if True, ngspice writes its results to a binary rawfile (ngspice -r), and the content of the rawfile is returned as bytes.
+    :param artifacts: the policy of saving the netlists and the output into spice_path: 'none', 'failure' or 'all'. If None, SpiceConfig.artifacts is used.
+    :param timeout: the time limit in seconds. The time waiting for the semaphore is not counted. If None, SpiceConfig.timeout is used.
+    :param semaphore: an asyncio.Semaphore. If None, the semaphore of the event loop (process_semaphore()) is used.
+    :return: the same as solve_circuit()
+    :raises SpiceError: if ngspice fails. SpiceTimeoutError if it is killed after the timeout.
+    If the task is cancelled, ngspice is killed and asyncio.CancelledError is raised.
+    """
 
-        with open(spice_file_path, "w") as f:
-            f.write(spice_file_contents)
+    if engine is None:
+        engine = SpiceConfig.engine
 
-        with open(os.path.join(spice_path, "spice_in.txt"), "w") as f:
-            f.write(spice_file_contents)
+    if timeout is None:
+        timeout = SpiceConfig.timeout
 
-        this_process = subprocess.Popen([SpiceConfig.engine, '-b', spice_file_path, '-o', spice_output_path])
-        this_process.wait()
+    if artifacts is None:
+        artifacts = SpiceConfig.artifacts
+    assert artifacts in ('none', 'failure', 'all')
 
-        # this_process = subprocess.run([spice.engine, '-b', spice_file_path, '-o', spice_output_path])
-        with open(spice_output_path, "r") as f:
-            raw_results = f.read()
+    if semaphore is None:
+        semaphore = process_semaphore()
 
-        with open(os.path.join(spice_path, "spice_out.txt"), "w") as f:
-            f.write(raw_results)
+    raw_spice_file_contents = spice_file_contents
 
-        if raw:
-            # We return all the output
-            return raw_results
+    # post process the input script if necessary
+    if postprocess_input is not None:
+        spice_file_contents = postprocess_input(spice_file_contents)
 
-        else:
-            # We return just the lines starting with a number, which is OK in certain simple cases
-            lines = raw_results.split("\n")
-            data = []
-            for line in lines:
-                if len(line) == 0 or line[0] not in "1234567890.":
-                    continue
-                # print (line)
-
-                i, *rest = line.split()
-                # print (len(rest))
-                data.append([float(element) for element in rest])
-
-            return numpy.array(data).transpose()
+    with tempfile.TemporaryDirectory(prefix="tmp", suffix="_sc3NGSPICE") as working_directory:
+
+        command, spice_output_path, spice_rawfile_path = _spice_command(engine, working_directory,
+                                                                        spice_file_contents, rawfile)
+
+        async with semaphore:
+            this_process = await asyncio.create_subprocess_exec(*command, stderr=asyncio.subprocess.PIPE,
+                                                                **_new_session_kwargs())
+            returncode = None
+            try:
+                _, stderr = await asyncio.wait_for(this_process.communicate(), timeout)
+                returncode = this_process.returncode
+            except asyncio.TimeoutError:
+                _kill_process_group(this_process)
+                stderr = await this_process.stderr.read()
+                await this_process.wait()
+            except BaseException:
+                # e.g. the task is cancelled, do not leave ngspice running. The wait is shielded from
+                # the cancellation, so that the killed process is reaped before the error propagates.
+                _kill_process_group(this_process)
+                await asyncio.shield(this_process.wait())
+                raise
+
+        return _collect_results(returncode, stderr, timeout, spice_output_path, spice_rawfile_path,
+                                raw_spice_file_contents, spice_file_contents, raw, rawfile, artifacts)
 
 
 def get_raw_from_spice(spice_file_contents, engine=SpiceConfig):
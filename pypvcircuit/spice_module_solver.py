@@ -8,34 +8,22 @@ from pypvcell.spectrum import Spectrum
 
 from .parse_spice_output import parse_output
 from .pixel_processor import PixelProcessor, create_header
-from .spice_interface import solve_circuit
 from .spice_solver import SPICESolver
 
 
 class SingleModuleStringSolver(SPICESolver):
 
+    solved_in_constructor = False
+
     def __init__(self, solarcell: SolarCell, illumination: float, v_start,
                  v_end, v_steps, l_r, l_c, cell_number, spice_preprocessor=None):
-        self.solarcell = solarcell
-
-        self.l_r = l_r
-        self.l_c = l_c
-        self.illumination = illumination
-
-        self.v_start = v_start
-        self.v_end = v_end
-        self.v_steps = v_steps
 
         self.cell_number = cell_number
 
-        self.V = None
-        self.I = None
-
-        self.spice_preprocessor = spice_preprocessor
-
-        self.gn = self._find_gn()
-
-        # self._solve_circuit()
+        # The module is solved without a mesh, and its illumination is a concentration
+        super().__init__(solarcell, illumination=illumination, metal_contact=np.zeros((1, 1)), rw=1, cw=1,
+                         v_start=v_start, v_end=v_end, v_steps=v_steps, l_r=l_r, l_c=l_c, h=0,
+                         spice_preprocessor=spice_preprocessor, cache=False)
 
     def _solve_circuit(self):
         # TODO add temperature as an object parameter
@@ -54,8 +42,7 @@ class SingleModuleStringSolver(SPICESolver):
         if self.spice_preprocessor is not None:
             postprocessor = self.spice_preprocessor.process_spice_input
 
-        raw_results = solve_circuit(spice_file_contents=self.spice_input,
-                                    postprocess_input=postprocessor)
+        raw_results = self._run_ngspice(self.spice_input, postprocess_input=postprocessor)
 
         return raw_results
 
@@ -127,27 +114,12 @@ class MultiStringModuleSolver(SingleModuleStringSolver):
 
     def __init__(self, solarcell: SolarCell, illumination: float, v_start,
                  v_end, v_steps, l_r, l_c, cell_number, string_number, isc_stdev=0, spice_preprocessor=None):
-        self.solarcell = solarcell
 
-        self.l_r = l_r
-        self.l_c = l_c
-        self.illumination = illumination
-
-        self.v_start = v_start
-        self.v_end = v_end
-        self.v_steps = v_steps
-
-        self.cell_number = cell_number
         self.string_number = string_number
-
-        self.V = None
-        self.I = None
-
         self.isc_stdev = isc_stdev
 
-        self.spice_preprocessor = spice_preprocessor
-
-        self.gn = self._find_gn()
+        super().__init__(solarcell, illumination, v_start, v_end, v_steps, l_r, l_c, cell_number,
+                         spice_preprocessor=spice_preprocessor)
 
     def _generate_network(self):
 
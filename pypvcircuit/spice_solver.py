@@ -1,16 +1,32 @@
 import typing
 import math
+import time
+import asyncio
+import copy
+import tempfile
+import threading
+import warnings
 import numpy as np
+from scipy.optimize import brentq
 
 from .meshing import iterate_sub_image, resize_illumination, \
-    MeshGenerator, resize_illumination_3d
-from .pixel_processor import PixelProcessor, create_header
-from .spice_interface import solve_circuit
-from .parse_spice_output import parse_output
+    MeshGenerator, resize_illumination_3d, MaskIndex, find_mirror_axes, reduce_by_symmetry, expand_by_symmetry, \
+    interpolate_node_map, cell_jump_indicator, bisect_cells, QuadtreeMesh, PreprocessingCache
+from .pixel_processor import PixelProcessor, create_header, \
+    ConcentrationJscCache, SpectrumJscCache
+from .spice_interface import solve_circuit, solve_circuit_async
+from .parse_spice_output import parse_output, parse_rawfile
+from .netlist import Netlist
+from .sparse_solver import solve_circuit_sparse, sweep_values, ConvergenceError
+from .ngspice_shared import solve_circuit_shared, find_libngspice, SharedSolveError
+from .spice_interface import SpiceConfig, SpiceError
+from .solve_cache import SolveCache, engine_version
+from .config_tool import user_config_data
 
 from pypvcell.solarcell import SolarCell
 from pypvcell.illumination import load_astm
 from pypvcell.spectrum import Spectrum
+from pypvcell.fom import isc, ff
 
 
 def _get_steps(start_val, end_val, step):
@@ -32,17 +48,214 @@ def _get_steps(start_val, end_val, step):
     return arr.size + 1
 
 
+def _match_sweep(V, points):
+    """
+    Find the points of a voltage sweep in a sweep with smaller steps
+
+    :param V: the voltages of the sweep with smaller steps
+    :param points: the voltages of the requested sweep
+    :return: the indices of the points in V
+    """
+
+    matched = np.isclose(np.subtract.outer(points, V), 0, atol=1e-9)
+    assert np.all(matched.sum(axis=1) == 1), "The solved sweep does not contain the points of the requested sweep"
+
+    return np.argmax(matched, axis=1)
+
+
+# The event loop that runs ngspice for the solver being created by SPICESolver.create() in this worker thread
+_create_context = threading.local()
+
+
+def find_refine_windows(V, I, v_start, v_step):
+    """
+    Find the voltage ranges that need to be resolved with finer steps after a coarse IV sweep,
+    i.e. the neighbourhood of the maximum power point and the open-circuit voltage.
+
+    :param V: voltages of the coarse sweep
+    :param I: currents of the coarse sweep
+    :param v_start: the starting voltage of the fine sweep. The windows are aligned to the fine voltage grid.
+    :param v_step: the voltage step of the fine sweep
+    :return: a list of (start, end) of the windows, sorted and non-overlapping
+    """
+
+    # The output power V*I has the same sign as the generated current at the beginning of the sweep
+    sign = np.sign(I[0]) if I[0] != 0 else 1
+
+    windows = []
+
+    # The maximum power point lies between the neighbouring points of the coarse maximum
+    mpp_idx = np.argmax(sign * V * I)
+    windows.append((V[max(mpp_idx - 1, 0)], V[min(mpp_idx + 1, V.size - 1)]))
+
+    # Voc lies between the points where the current changes its sign
+    crossing = np.nonzero(np.diff(np.sign(I)) != 0)[0]
+    if crossing.size > 0:
+        windows.append((V[crossing[0]], V[crossing[0] + 1]))
+
+    # align the windows to the fine voltage grid and merge the overlapped windows
+    windows = sorted((round(v_start + np.floor((start - v_start) / v_step + 1e-9) * v_step, 9),
+                      round(v_start + np.ceil((end - v_start) / v_step - 1e-9) * v_step, 9))
+                     for start, end in windows)
+
+    merged = [windows[0]]
+    for start, end in windows[1:]:
+        if start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    return merged
+
+
+def _warn_missing_nodes(layer, missing):
+    """
+    Warn that the voltages of some nodes of a layer are not in the output. Their voltages are set to nan.
+
+    :param layer: the layer of nodes, e.g. 't_0'
+    :param missing: the names of the missing nodes
+    """
+
+    if len(missing) > 0:
+        warnings.warn("{} nodes of the layer {} are not in the output, e.g. {}. Their voltages are set to nan."
+                      .format(len(missing), layer, missing[0]), RuntimeWarning)
+
+
+class OutputSelection(object):
+    """
+    Select the node voltages recorded by SPICESolver. Only the selected nodes are printed or saved by the circuit
+    solver, and only the selected points of the voltage sweep are kept in memory.
+
+    """
+
+    def __init__(self, layers=('t_0',), decimation=1, steps=None, voltages=None):
+        """
+
+        :param layers: the layers of nodes. 't_j' and 'b_j' are the top and the bottom of the j-th junction, 'm_0' is the metal
+        :param decimation: only every decimation-th row and column of the mesh are recorded. It can be an integer or a tuple of (row, column) decimations.
+        :param steps: the indices of the recorded points of the voltage sweep, e.g. [0, -1]
+        :param voltages: the voltages of the recorded points of the voltage sweep. The nearest points are recorded.
+        If both steps and voltages are None, all the points are recorded.
+        """
+
+        for layer in layers:
+            assert layer == 'm_0' or (layer[:2] in ('t_', 'b_') and layer[2:].isdigit())
+        self.layers = list(layers)
+
+        self.decimation = tuple(np.broadcast_to(np.asarray(decimation, dtype=int), (2,)).tolist())
+        assert min(self.decimation) >= 1
+
+        self.steps = steps
+        self.voltages = voltages
+
+    def grid(self, r_node_num, c_node_num):
+        """
+        :return: the indices of the recorded rows and columns of the mesh
+        """
+
+        return np.arange(0, r_node_num, self.decimation[0]), np.arange(0, c_node_num, self.decimation[1])
+
+    def step_index(self, V):
+        """
+        :param V: the voltages of the sweep
+        :return: the sorted indices of the recorded points of the sweep
+        """
+
+        V = np.asarray(V)
+        if self.steps is None and self.voltages is None:
+            return np.arange(V.size)
+
+        idx = []
+        if self.steps is not None:
+            idx.append(np.arange(V.size)[np.asarray(self.steps, dtype=int)])
+        if self.voltages is not None:
+            idx.append(np.argmin(np.abs(np.subtract.outer(np.asarray(self.voltages, dtype=float), V)), axis=1))
+
+        return np.unique(np.concatenate(idx))
+
+
+class RetryPolicy(object):
+    """
+    The escalation of convergence aids when the circuit solver fails or times out.
+    Every retry adds the next set of ngspice options to the previous ones, e.g. gmin stepping and then source stepping.
+    The remaining retries keep all the options and divide v_steps. The points of the original sweep are kept
+    from the finer sweep, so the results have the same shape.
+
+    """
+
+    def __init__(self, options=({'gminsteps': 100, 'itl1': 500}, {'srcsteps': 100, 'itl2': 200}), step_divisions=(2, 4)):
+        """
+
+        :param options: the ngspice .OPTIONS added by the retries in turn. They are ignored by the sparse backend.
+        :param step_divisions: the integer divisions of v_steps of the last retries
+        """
+
+        self.options = [dict(o) for o in options]
+        for division in step_divisions:
+            assert int(division) == division and division >= 1
+        self.step_divisions = [int(d) for d in step_divisions]
+
+    def attempts(self):
+        """
+        :return: list of (ngspice options, division of v_steps) of the first solve and the retries
+        """
+
+        attempts = [(dict(), 1)]
+        options = dict()
+        for o in self.options:
+            options = dict(options, **o)
+            attempts.append((options, 1))
+        attempts.extend((options, division) for division in self.step_divisions)
+
+        return attempts
+
+
+class SolveOptions(object):
+    """
+    The options of running the circuit solver of SPICESolver, which do not change the solved circuit.
+
+    """
+
+    def __init__(self, output_format='text', retry_policy=None, timeout=None):
+        """
+
+        :param output_format: The format of ngspice results. It can either be 'text' (parse the .PRINT tables) or 'raw' (binary rawfile)
+        :param retry_policy: a RetryPolicy. If the circuit solver fails or times out, the sweep is solved again with escalated convergence options and smaller voltage steps. Every attempt is recorded in solve_log with its options, v_steps, time and error.
+        :param timeout: the wall-clock time limit of every ngspice run in seconds. ngspice is killed and SpiceTimeoutError is raised if it is exceeded. If None, [External programs] spice_timeout of the configuration file is used. It does not apply to the sparse and ngspice_shared backends.
+        """
+
+        assert output_format == 'text' or output_format == 'raw'
+        self.output_format = output_format
+        self.retry_policy = retry_policy
+        self.timeout = timeout
+
+
 class SPICESolver(object):
     """
     Base class of SPICE solver. The solver is launched in the contructor (__init__()).
 
     """
 
+    # In adaptive sweep, the ratio of the coarse voltage step to v_steps
+    adaptive_coarse_factor = 5
+
+    # In operating point mode, the voltage tolerance of Voc and the voltage step of the sweep around the maximum power point
+    operating_point_tol = 1e-3
+
+    # In operating point mode, the maximum number of iterations of the root finding of Voc,
+    # and the maximum number of the sweeps around the maximum power point
+    operating_point_maxiter = 20
+
+    # Whether the constructor solves the circuit. If False, _solve_circuit() is called later, e.g. by create().
+    solved_in_constructor = True
+
     def __init__(self, solarcell: SolarCell, illumination: np.ndarray, metal_contact: np.ndarray, rw: int, cw: int,
                  v_start, v_end, v_steps, l_r, l_c, h, spice_preprocessor=None,
                  illumination_spectrum: typing.Optional[Spectrum] = None,
                  illumination_wavelength: typing.Optional[np.ndarray] = None, illumination_unit='x',
-                 lump_series_r=0):
+                 lump_series_r=0, backend='ngspice', sweep='uniform', mirror_symmetry=False, initial_guess=None,
+                 output=None, storage='memory', cache=None, preprocessing_cache=None,
+                 solve_options: typing.Optional[SolveOptions] = None):
         """
         This function initialize the mesh and runs the network simulation.
 
@@ -62,15 +275,50 @@ class SPICESolver(object):
         :param illumination_spectrum:
         :param illumination_wavelength: a 1D wavelenght array. The size should be identical t
         :param illumination_unit: The unit of illumination matrix. It can either be 'x' (concentration) or 'W' (watt)
+        :param backend: The circuit solver. It can be 'ngspice' (external ngspice process), 'ngspice_shared' (in-process libngspice session) or 'sparse' (native sparse Newton solver)
+        :param sweep: The voltage sweep. 'uniform': a sweep with the step of v_steps. 'adaptive': a coarse sweep followed by sweeps with the step of v_steps around the maximum power point and Voc. 'operating_point': only solve the circuit at short circuit, the maximum power point and Voc, which are found by single-point solves in [0, v_end] and a short sweep around the maximum power point
+        :param mirror_symmetry: If True, the mirror symmetry of metal_contact and illumination is detected, and only the irreducible sub-domain (bottom and/or right half) is solved. I is rescaled and v_junc is rebuilt by reflection to the full domain.
+        :param initial_guess: a solved SPICESolver of the same device, typically with a coarser mesh. Its node voltages are interpolated onto this mesh and used as .NODESET initial guesses.
+        :param output: an OutputSelection of the recorded layers, pixels and sweep points. The voltages of every layer are saved in node_maps with the shape (rows, columns, points), and v_junc is node_maps['t_0']. output_steps gives the indices of the recorded points in V. If None, only t_0 is recorded, for all the pixels and points. Note that only the selected nodes are available to node_voltage_maps().
+        :param storage: The storage of node_maps and v_junc. 'memory': float64 arrays. 'compact': float32 arrays. 'memmap': float32 arrays memory-mapped to temporary files in [Path_config] scratch_path of the configuration file, or in the system temporary folder if it is not set. With 'compact' and 'memmap', spice_input, raw_results and spice_network are dropped once they are parsed.
+        :param cache: a SolveCache. The parsed results of every sweep are cached, keyed on the processed netlist and the version of the backend, and the backend is not launched if the sweep is cached. If None, the cache of the configuration file (SolveCache.default()) is used. If False, nothing is cached.
+        :param preprocessing_cache: a PreprocessingCache shared by the solvers of the same mask and illumination, e.g. the solvers of a parameter scan. The resized illumination, the metal coverage and the aggregated metal resistances of the mesh are taken from the cache instead of being computed from the images again.
+        :param solve_options: the SolveOptions of the output format, the retry policy and the timeout of the circuit solver. If None, the default SolveOptions() is used.
         """
 
+        if mirror_symmetry and output is not None and output.decimation != (1, 1):
+            raise ValueError("An output with decimation cannot be used with mirror_symmetry=True")
+
         self.solarcell = solarcell
-        self.metal_contact = metal_contact
         self.rw = rw
         self.cw = cw
         if illumination is None:
             illumination = np.ones_like(metal_contact, dtype=np.float)
+
+        # The mirror planes are free boundaries of the sub-domain because no current flows across them
+        self.symmetry_axes = find_mirror_axes(metal_contact, illumination) if mirror_symmetry else ()
+        metal_contact = reduce_by_symmetry(metal_contact, self.symmetry_axes)
+        illumination = reduce_by_symmetry(illumination, self.symmetry_axes)
+
+        self.metal_contact = metal_contact
         self.illumination = illumination
+
+        self.output = output
+
+        assert storage in ('memory', 'compact', 'memmap')
+        self.storage = storage
+
+        self.cache = SolveCache.default() if cache is None else (cache or None)
+
+        self.preprocessing_cache = preprocessing_cache
+        self._image_key = None
+
+        self.solve_options = SolveOptions() if solve_options is None else solve_options
+        self.solve_log = []
+
+        if initial_guess is not None:
+            assert initial_guess.symmetry_axes == self.symmetry_axes
+        self.initial_guess = initial_guess
         self.illumination_wavelength = illumination_wavelength
 
         assert illumination_unit == 'x' or illumination_unit == 'W'
@@ -91,28 +339,289 @@ class SPICESolver(object):
         self.V = None
         self.I = None
         self.v_junc = None
+        self.node_maps = None
+        self.output_steps = None
         self.steps = _get_steps(self.v_start, self.v_end, self.v_steps)
         self.lump_series_r = lump_series_r
 
         self.spice_preprocessor = spice_preprocessor
 
+        assert backend in ('ngspice', 'ngspice_shared', 'sparse')
+        self.backend = backend
+
+        assert sweep in ('uniform', 'adaptive', 'operating_point')
+        self.sweep = sweep
+        self.operating_point = None
+
+        # the voltages of the requested sweep, which is solved with smaller steps if it is retried
+        self._requested_sweep = None
+        self.node_voltages = None
+        self.spice_network = None
+        self.spice_input = None
+        self.raw_results = None
+
+        # the event loop that runs ngspice if the solver is being created by create()
+        self._event_loop = getattr(_create_context, 'event_loop', None)
+
         self.mg = MeshGenerator(image_shape=metal_contact.shape, rw=rw, cw=cw)
 
+        # integral-image index of the metal mask, which is reused when the circuit is remeshed
+        self.mask_index = None
+
         # TODO temporarily add gn here
         self.gn = self._find_gn()
 
-        self._solve_circuit()
+        if self.solved_in_constructor:
+            self._solve_circuit()
+
+    @classmethod
+    async def create(cls, solarcell, *args, spice_preprocessor=None, executor=None, **kwargs):
+        """
+        Create and solve a solver without blocking the event loop, e.g.
+
+        solvers = await asyncio.gather(*[SPICESolver.create(lump_series_r=r, **params) for r in r_range])
+
+        The netlists are prepared in a worker thread of the executor, and ngspice is run by solve_circuit_async()
+        in this event loop, so that the number of concurrent ngspice processes is limited by its semaphore.
+        The arguments are the same as the constructor, and spice_preprocessor has to be given as a keyword.
+
+        :param solarcell: the solar cell. The solver gets its own copy, because its input spectrum is set while solving.
+        :param spice_preprocessor: the preprocessor of the netlist. The solver gets its own copy, because it keeps
+        the merged or eliminated nodes of the circuit being solved.
+        :param executor: the concurrent.futures executor of the worker threads. If None, the default executor of the event loop is used.
+        :return: the solved solver
+        """
+
+        loop = asyncio.get_running_loop()
+
+        solarcell = copy.deepcopy(solarcell)
+        spice_preprocessor = copy.deepcopy(spice_preprocessor)
+
+        def create_solver():
+            _create_context.event_loop = loop
+            try:
+                solver = cls(solarcell, *args, spice_preprocessor=spice_preprocessor, **kwargs)
+                if not solver.solved_in_constructor:
+                    solver._solve_circuit()
+            finally:
+                _create_context.event_loop = None
+            # later solves, e.g. AdaptiveMeshSolver.resolve(), are called from the event loop and run ngspice directly
+            solver._event_loop = None
+            return solver
+
+        return await loop.run_in_executor(executor, create_solver)
+
+    def _run_ngspice(self, spice_file_contents, **kwargs):
+        """
+        Run ngspice by solve_circuit(), or by solve_circuit_async() in the event loop if the solver is created by create()
+
+        :param spice_file_contents: the SPICE netlist
+        :param kwargs: the other arguments of solve_circuit()
+        :return: the results of solve_circuit()
+        """
+
+        kwargs.setdefault('timeout', self.solve_options.timeout)
+
+        if self._event_loop is None:
+            return solve_circuit(spice_file_contents, **kwargs)
+
+        return asyncio.run_coroutine_threadsafe(solve_circuit_async(spice_file_contents, **kwargs),
+                                                self._event_loop).result()
 
     def _solve_circuit(self):
         # TODO add temperature as an object parameter
-        header = self._generate_header(temperature=20)
-        nodes = self._generate_network()
-        exec = self._generate_exec()
-        spice_footer = ".end"
-        self.spice_input = header + nodes + exec + spice_footer
-        self.raw_results = self._send_command()
-        self._parse_output()
+        self.spice_network = Netlist.from_spice(self._generate_header(temperature=20))
+        self.spice_network.extend(self._generate_network())
+        self.node_voltages = None
+        if self.sweep == 'adaptive':
+            self._solve_adaptive_sweep()
+        elif self.sweep == 'operating_point':
+            self._solve_operating_points()
+        else:
+            self._solve_sweep(self.v_start, self.v_end, self.v_steps)
+
+        # the uniform sweep keeps only the selected points when the output is parsed
+        if self.output is not None and self.sweep != 'uniform':
+            self.output_steps = self.output.step_index(self.V)
+            self._set_node_maps({layer: self._store_node_map(node_map[:, :, self.output_steps])
+                                 for layer, node_map in self.node_maps.items()})
+
         self._renormalize_output()
+        self._expand_symmetry()
+
+        if self.storage != 'memory':
+            self.spice_network = None
+
+        if self.sweep == 'operating_point':
+            self.operating_point = {'isc': self.I[0], 'vmp': self.V[1], 'imp': self.I[1], 'voc': self.V[2],
+                                    'pmax': np.abs(self.V[1] * self.I[1]), 'solves': self.operating_point['solves']}
+
+    def _solve_sweep(self, v_start, v_end, v_steps):
+
+        self.spice_input = self._postprocess_netlist(
+            self._generate_exec(self.spice_network.copy(), v_start, v_end, v_steps))
+        self._requested_sweep = sweep_values(v_start, v_end, v_steps)
+
+        key = self._cache_key()
+        if key is None or not self._load_cached_sweep(key):
+            self._send_with_retries(v_start, v_end, v_steps)
+            self._parse_output()
+            # a retry may solve the sweep with smaller steps, and only the points of the requested sweep are kept
+            if self.V.size > self._requested_sweep.size:
+                kept = _match_sweep(self.V, self._requested_sweep)
+                self.V = self.V[kept]
+                self.I = self.I[kept]
+                if self.output_steps is not None:
+                    self.output_steps = np.searchsorted(kept, self.output_steps)
+            if key is not None:
+                self._save_cached_sweep(key)
+
+        if self.storage != 'memory':
+            self.spice_input = None
+            self.raw_results = None
+
+    def _send_with_retries(self, v_start, v_end, v_steps):
+        """
+        Send spice_input to the circuit solver. If it fails, the netlist is rebuilt and sent again following
+        the retry policy. Every attempt is appended to solve_log.
+
+        """
+
+        retry_policy = self.solve_options.retry_policy
+        attempts = [(dict(), 1)] if retry_policy is None else retry_policy.attempts()
+
+        for index, (options, division) in enumerate(attempts):
+            if index > 0:
+                netlist = self._generate_exec(self.spice_network.copy(), v_start, v_end, v_steps / division)
+                netlist.options.update(options)
+                self.spice_input = self._postprocess_netlist(netlist)
+
+            start_time = time.time()
+            try:
+                self.raw_results = self._send_command()
+                error = None
+            except (SpiceError, SharedSolveError, ConvergenceError) as e:
+                error = e
+
+            self.solve_log.append({'v_start': v_start, 'v_end': v_end, 'v_steps': v_steps / division,
+                                   'options': options, 'time': time.time() - start_time,
+                                   'error': None if error is None else "{}: {}".format(type(error).__name__, error)})
+
+            if error is None:
+                return
+
+            if index == len(attempts) - 1:
+                raise error
+
+            message = "Solving the sweep from {} to {} failed ({}), retrying with options {} and v_steps {}".format(
+                v_start, v_end, type(error).__name__, attempts[index + 1][0], v_steps / attempts[index + 1][1])
+            warnings.warn(message, RuntimeWarning)
+
+    @property
+    def retries(self):
+        """
+        :return: the number of retried solves of the circuit
+        """
+
+        return sum(1 for entry in self.solve_log if entry['error'] is not None)
+
+    def _solve_operating_points(self):
+        """
+        Find Isc, Voc and the maximum power point with a few solves, without sweeping the whole IV.
+        Voc is found by Brent's root finding of log(Isc-I) between the zero of the IV chord and v_end,
+        and the maximum power point by a sweep with the step of operating_point_tol around its estimate from Voc.
+        V, I and v_junc are set to the results at (0, Vmp, Voc).
+
+        """
+
+        solved = dict()
+
+        def solve_at(v):
+            v = float(v)
+            if v not in solved:
+                self._solve_sweep(v, v, self.v_steps)
+                solved[v] = (self.I[0], self.node_maps)
+            return solved[v][0]
+
+        i_sc = solve_at(0.0)
+        if i_sc == 0:
+            raise ValueError("The short-circuit current is zero")
+
+        # The output power V*I has the same sign as the short-circuit current
+        sign = np.sign(i_sc)
+
+        i_end = solve_at(self.v_end)
+        if np.sign(i_end) == sign:
+            raise ValueError("Voc is larger than v_end ({})".format(self.v_end))
+
+        # I(V) is concave in the direction of i_sc, so the zero of the chord between short circuit and v_end
+        # is below Voc, and it brackets Voc with v_end
+        v_low = self.v_end * i_sc / (i_sc - i_end)
+
+        # The diode current i_sc-I grows exponentially with V, so its logarithm is almost linear around Voc
+        # and the root finding converges in a few solves
+        def log_diode_current(v):
+            return np.log(max(sign * (i_sc - solve_at(v)), np.finfo(float).tiny) / (sign * i_sc))
+
+        voc = brentq(log_diode_current, v_low, self.v_end, xtol=self.operating_point_tol,
+                     maxiter=self.operating_point_maxiter)
+        solve_at(voc)
+
+        # Around Voc, I = i_sc*(1-exp((V-Voc)/b)), where 1/b is the slope of log_diode_current between the two solves
+        # next to Voc. The maximum power point of this model, V = Voc-b*ln(1+V/b), centers the sweep.
+        v_near = sorted((v for v in solved.keys() if v != voc), key=lambda v: abs(v - voc))[:2]
+        b = abs((v_near[0] - v_near[1]) / (log_diode_current(v_near[0]) - log_diode_current(v_near[1])))
+        vmp = voc
+        for _ in range(10):
+            vmp = voc - b * np.log(1 + vmp / b)
+
+        # The sweep is moved until the largest power is not on its boundary
+        sweeps = 0
+        for _ in range(self.operating_point_maxiter):
+            start, end = max(vmp - 2 * b, 0.0), min(vmp + 2 * b, voc)
+            self._solve_sweep(start, end, self.operating_point_tol)
+            sweeps += 1
+            k = int(np.argmax(sign * self.V * self.I))
+            vmp = float(self.V[k])
+            if (0 < k < self.V.size - 1) or (k == 0 and start == 0.0) or (k == self.V.size - 1 and end == voc):
+                break
+        solved[vmp] = (self.I[k], None if self.node_maps is None else
+                       {layer: node_map[:, :, k:k + 1] for layer, node_map in self.node_maps.items()})
+
+        self.V = np.array([0.0, vmp, voc])
+        self.I = np.array([solve_at(v) for v in self.V])
+        if self.node_maps is not None:
+            self._set_node_maps({layer: self._store_node_map(
+                np.concatenate([solved[float(v)][1][layer] for v in self.V], axis=2)) for layer in self.node_maps})
+        self.steps = self.V.size
+
+        self.operating_point = {'solves': len(solved) - 1 + sweeps}
+
+    def _solve_adaptive_sweep(self):
+        """
+        Solve the circuit with a coarse sweep, and then resolve the maximum power point and Voc with the step of v_steps.
+        The results of all the sweeps are merged and sorted by voltage.
+
+        """
+
+        self._solve_sweep(self.v_start, self.v_end, self.v_steps * self.adaptive_coarse_factor)
+
+        V, I, node_maps = [self.V], [self.I], [self.node_maps]
+        for start, end in find_refine_windows(self.V, self.I, self.v_start, self.v_steps):
+            self._solve_sweep(start, end, self.v_steps)
+            V.append(self.V)
+            I.append(self.I)
+            node_maps.append(self.node_maps)
+
+        V = np.concatenate(V)
+        _, idx = np.unique(np.round(V, 9), return_index=True)
+
+        self.V = V[idx]
+        self.I = np.concatenate(I)[idx]
+        if self.node_maps is not None:
+            self._set_node_maps({layer: self._store_node_map(
+                np.concatenate([m[layer] for m in node_maps], axis=2)[:, :, idx]) for layer in self.node_maps})
+        self.steps = self.V.size
 
     def _find_gn(self):
         """
@@ -121,18 +630,53 @@ class SPICESolver(object):
         :return:
         """
 
-        coord_set = iterate_sub_image(self.metal_contact, self.rw, self.cw)
-
-        r_pixels, c_pixels, _ = coord_set.shape
-
-        new_illumination = resize_illumination(self.illumination, self.metal_contact, coord_set, 0)
+        def max_illumination():
+            coord_set = iterate_sub_image(self.metal_contact, self.rw, self.cw)
+            new_illumination = resize_illumination(self.illumination, self.metal_contact, coord_set, 0)
+            return np.max(new_illumination, keepdims=True),
 
         sample_isc = 340
 
-        isc = np.max(new_illumination) * sample_isc * self.l_r * self.l_c
+        isc = self._preprocess(max_illumination, 'max_illumination', self.rw, self.cw)[0][0] * \
+              sample_isc * self.l_r * self.l_c
 
         return 1 / isc * 100
 
+    def _preprocess(self, compute, *key_parts):
+        """
+        Run an image-level preprocessing step, or get its result from the preprocessing cache
+
+        :param compute: a function without arguments that runs the step
+        :param key_parts: the inputs of the step other than metal_contact and illumination
+        :return: the result of compute()
+        """
+
+        if self.preprocessing_cache is None:
+            return compute()
+
+        if self._image_key is None:
+            self._image_key = PreprocessingCache.key(self.metal_contact, self.illumination)
+
+        return self.preprocessing_cache.get(PreprocessingCache.key(self._image_key, *key_parts), compute)
+
+    def _metal_map(self, px: PixelProcessor, coord_set):
+        """
+        Aggregate the metal mask on the mesh
+
+        :return: arrays of the aggregated resistances in x and y, metal coverage and whether a pixel has bus bar
+        """
+
+        def metal_map():
+            if self.mask_index is None:
+                self.mask_index = self._preprocess(
+                    lambda: MaskIndex(self.metal_contact, threshold=px.metal_threshold, bus_threshold=px.bus_threshold),
+                    'mask_index', px.metal_threshold, px.bus_threshold)
+
+            return self.mask_index.pixel_r(coord_set, r_row=px.r_line, r_col=px.r_line) + \
+                   (self.mask_index.is_bus(coord_set),)
+
+        return self._preprocess(metal_map, 'metal_map', coord_set, px.r_line, px.metal_threshold, px.bus_threshold)
+
     def _generate_header(self, temperature):
 
         return create_header(T=temperature)
@@ -140,72 +684,414 @@ class SPICESolver(object):
     def _generate_network(self):
 
         coord_set = self.mg.to_coordset()
+        self.coord_set = coord_set
 
         return self._write_nodes(coord_set)
 
     def _write_nodes(self, coord_set):
-        spice_body = ""
         r_pixels, c_pixels, _ = coord_set.shape
-        new_illumination = resize_illumination(self.illumination, self.metal_contact, coord_set)
+        new_illumination = self._preprocess(
+            lambda: (resize_illumination(self.illumination, self.metal_contact, coord_set),),
+            'illumination', coord_set)[0]
         assert new_illumination.shape == (r_pixels, c_pixels)
         self.r_node_num = r_pixels
         self.c_node_num = c_pixels
-        for c_index in range(c_pixels):
-            for r_index in range(r_pixels):
-                illumination_value = new_illumination[r_index, c_index]
 
-                sub_image = self.metal_contact[coord_set[r_index, c_index, 0]:coord_set[r_index, c_index, 1],
-                            coord_set[r_index, c_index, 2]:coord_set[r_index, c_index, 3]]
+        # jsc is linear to concentration, so it is calculated once and then scaled for every pixel
+        jsc = ConcentrationJscCache(self.solarcell, self.spectrum).get_jsc(new_illumination)
 
-                # set concentration
-                self.solarcell.set_input_spectrum(illumination_value * self.spectrum)
-                px = PixelProcessor(self.solarcell, self.l_r, self.l_c, h=self.finger_h,
-                                    gn=self.gn, lump_series_r=self.lump_series_r)
+        px = PixelProcessor(self.solarcell, self.l_r, self.l_c, h=self.finger_h,
+                            gn=self.gn, lump_series_r=self.lump_series_r)
+
+        return self._write_pixels(px, coord_set, jsc)
+
+    def _write_pixels(self, px: PixelProcessor, coord_set, jsc):
+        """
+        Write the netlist of all the pixels in one batch
+
+        :param px: the pixel processor that holds the circuit parameters
+        :param coord_set: the coordinate set of the mesh
+        :param jsc: jsc of every junction of every pixel, with shape (junctions, r_pixels, c_pixels)
+        :return: the Netlist
+        """
 
-                spice_body += px.node_string(r_index, c_index, sub_image=sub_image)
-        return spice_body
+        r_metal_row, r_metal_col, metal_coverage, is_bus = self._metal_map(px, coord_set)
 
-    def _generate_exec(self):
+        return px.network_netlist(coord_set, jsc, r_metal_row, r_metal_col, metal_coverage, is_bus)
+
+    def _generate_exec(self, netlist: Netlist, v_start=None, v_end=None, v_steps=None):
+
+        if v_start is None:
+            v_start, v_end, v_steps = self.v_start, self.v_end, self.v_steps
 
         # We prepare the SPICE execution
-        return ".PRINT DC i(vdep)\n.DC vdep {0} {1} {2}\n".format(self.v_start, self.v_end, self.v_steps)
+        netlist.current_probes.append('vdep')
+        netlist.dc = ('vdep', v_start, v_end, v_steps)
+
+        return netlist
 
     def _send_command(self):
 
-        raw_results = solve_circuit(spice_file_contents=self.spice_input,
-                                    postprocess_input=self.spice_preprocessor.process_spice_input)
+        netlist = self.spice_input
+
+        # the sparse backend reads the netlist arrays directly. Other backends get the SPICE text written once here.
+        if self.backend == 'sparse':
+            return solve_circuit_sparse(spice_file_contents=netlist)
+
+        if self.backend == 'ngspice_shared':
+            return solve_circuit_shared(spice_file_contents=netlist.to_spice())
+
+        if self.solve_options.output_format == 'raw':
+            return self._run_ngspice(netlist.to_spice(), postprocess_input=None, rawfile=True)
+
+        raw_results = self._run_ngspice(netlist.to_spice(), postprocess_input=None)
 
         return raw_results
 
+    def _cache_key(self):
+        """
+        The key of the current sweep in the solve cache. Besides the processed netlist, the key includes everything
+        that changes the parsed results: the backend and its version, the output format and the recorded nodes.
+
+        :return: the key, or None if there is no cache
+        """
+
+        if self.cache is None:
+            return None
+
+        if self.backend == 'ngspice':
+            engine = SpiceConfig.engine
+        elif self.backend == 'ngspice_shared':
+            engine = find_libngspice()
+        else:
+            engine = ''
+
+        output = None
+        if self.output is not None:
+            output = (self.output.layers, self.output.decimation, self.output.steps, self.output.voltages)
+
+        return SolveCache.key(self.spice_input.to_spice(), type(self).__name__, self.r_node_num, self.c_node_num,
+                              self.backend, engine_version(self.backend, engine), self.solve_options.output_format,
+                              self.sweep, output, self.storage)
+
+    def _load_cached_sweep(self, key):
+        """
+        Load the parsed results of the current sweep from the solve cache
+
+        :return: True if the sweep is cached
+        """
+
+        entry = self.cache.get(key)
+        if entry is None:
+            return False
+
+        self.raw_results = None
+        self.V, self.I = entry['V'], entry['I']
+        if 'output_steps' in entry:
+            self.output_steps = entry['output_steps']
+            self._set_node_maps({name[4:]: self._store_node_map(value) for name, value in entry.items()
+                                 if name.startswith('map_')})
+        if self.node_voltages is None:
+            self.node_voltages = dict(zip(entry['node_names'].tolist(), entry['node_values'].tolist()))
+
+        return True
+
+    def _save_cached_sweep(self, key):
+
+        entry = {'V': self.V, 'I': self.I,
+                 'node_names': np.array(list(self.node_voltages.keys()), dtype=str),
+                 'node_values': np.array(list(self.node_voltages.values()), dtype=float)}
+        if self.node_maps is not None:
+            entry['output_steps'] = self.output_steps
+            entry.update({'map_' + layer: np.asarray(node_map) for layer, node_map in self.node_maps.items()})
+
+        self.cache.put(key, entry)
+
+    def _reduced_node_name(self, node):
+        """
+        Find the name of a node after the netlist is processed by the spice preprocessor
+
+        :param node: the node name in the original netlist
+        :return: the node name in the processed netlist
+        """
+        try:
+            return self.spice_preprocessor.find_root(node)
+        except KeyError:
+            return node
+
+    def _output_layers(self):
+
+        return ['t_0'] if self.output is None else self.output.layers
+
+    def _node_names(self, layer):
+        """
+        The names of the recorded nodes of a layer in the original netlist
+
+        :param layer: the layer of nodes, e.g. 't_0'
+        :return: an array of node names with the shape (rows, columns)
+        """
+        rows, cols = np.arange(self.r_node_num), np.arange(self.c_node_num)
+        if self.output is not None:
+            rows, cols = self.output.grid(self.r_node_num, self.c_node_num)
+
+        nodes = np.empty((rows.size, cols.size), dtype=object)
+        for row_idx, col_idx in np.ndindex(nodes.shape):
+            nodes[row_idx, col_idx] = '{}_{:03d}_{:03d}'.format(layer, rows[row_idx], cols[col_idx])
+        return nodes
+
+    def _junction_nodes(self, layer='t_0'):
+        """
+        The names of the recorded nodes of a layer, after the netlist is processed by the spice preprocessor
+
+        :param layer: the layer of nodes. The default t_0 gives v_junc.
+        :return: an array of node names with the shape (rows, columns)
+        """
+        names = self._node_names(layer)
+        return np.array([self._reduced_node_name(n) for n in names.ravel()], dtype=object).reshape(names.shape)
+
+    def _postprocess_netlist(self, netlist: Netlist):
+        """
+        Run the spice preprocessor on the netlist, and add the initial guesses and the saved vectors.
+        Preprocessors without process_netlist(), i.e. those only work with SPICE text, are run on the text.
+
+        :param netlist: the Netlist of the circuit
+        :return: the processed Netlist
+        """
+
+        if self.output is not None:
+            netlist.select_probes([n for layer in self.output.layers for n in self._node_names(layer).ravel()])
+
+        if hasattr(self.spice_preprocessor, 'process_netlist'):
+            netlist = self.spice_preprocessor.process_netlist(netlist)
+        else:
+            netlist = Netlist.from_spice(self.spice_preprocessor.process_spice_input(netlist.to_spice()))
+
+        # the nodes that still exist after the preprocessor, e.g. KronReducer eliminates nodes
+        nodes = netlist.connected_node_names() - {'0'}
+
+        if self.initial_guess is not None:
+            netlist.nodeset.update({n: v for n, v in self._nodeset_voltages().items() if n in nodes})
+
+        output_format = self.solve_options.output_format
+        if self.backend == 'ngspice_shared' or (self.backend == 'ngspice' and output_format == 'raw'):
+            netlist.save = ['i(vdep)'] + ['v({})'.format(n) for n in np.unique(np.concatenate(
+                [self._junction_nodes(layer).ravel() for layer in self._output_layers()])) if n in nodes]
+
+        return netlist
+
+    def node_voltage_maps(self):
+        """
+        Get the maps of node voltages at the first point of the voltage sweep.
+        The voltages of the metal nodes (m_0) of non-metal pixels are filled by the voltages of top nodes (t_0).
+        Only t_0 is available if the results are read from a rawfile or libngspice.
+
+        :return: dictionary of {node prefix, e.g. 't_0': 2D map with shape (r_node_num, c_node_num)}
+        """
+
+        prefixes = ['t_{}'.format(j) for j in range(len(self.solarcell.subcell))] + \
+                   ['b_{}'.format(j) for j in range(len(self.solarcell.subcell))] + ['m_0']
+
+        maps = dict()
+        for prefix in prefixes:
+            node_map = np.full((self.r_node_num, self.c_node_num), np.nan)
+            for row_idx, col_idx in np.ndindex(node_map.shape):
+                node = self._reduced_node_name('{}_{:03d}_{:03d}'.format(prefix, row_idx, col_idx))
+                node_map[row_idx, col_idx] = 0 if node == '0' else self.node_voltages.get(node.lower(), np.nan)
+            if prefix == 'm_0':
+                node_map = np.where(np.isnan(node_map), maps['t_0'], node_map)
+            if not np.all(np.isnan(node_map)):
+                maps[prefix] = node_map
+
+        return maps
+
+    def _nodeset_voltages(self):
+        """
+        Interpolate the node voltages of initial_guess onto the mesh of this solver
+
+        :return: dictionary of {node name: voltage}
+        """
+
+        fixed_node = self._reduced_node_name('in')
+
+        nodeset = dict()
+        for prefix, node_map in self.initial_guess.node_voltage_maps().items():
+            fine_map = interpolate_node_map(node_map, self.initial_guess.coord_set, self.coord_set)
+            for row_idx, col_idx in np.ndindex(fine_map.shape):
+                node = self._reduced_node_name('{}_{:03d}_{:03d}'.format(prefix, row_idx, col_idx))
+                if node != '0' and node != fixed_node and np.isfinite(fine_map[row_idx, col_idx]):
+                    nodeset[node] = fine_map[row_idx, col_idx]
+
+        return nodeset
+
+    def _parse_vector_output(self, names, data):
+        """
+        Gather the vectors of the solved circuit into v_junc without going through the text tables
+
+        :param names: the list of vector names
+        :param data: 2D array with the shape (number of points, number of vectors)
+        """
+
+        column = {n: i for i, n in enumerate(names)}
+
+        if self.node_voltages is None:
+            self.node_voltages = {n: data[0, i] for i, n in enumerate(names[1:], 1) if not n.endswith('#branch')}
+
+        self.V = data[:, 0]
+        self.I = data[:, column['vdep#branch']]
+
+        # the ground node is not saved in the rawfile. It is mapped to an extra column of zeros,
+        # and the missing metal nodes are mapped to an extra column of nan
+        self.output_steps = self._parsed_steps()
+        data = np.concatenate((data[self.output_steps], np.zeros((self.output_steps.size, 1)),
+                               np.full((self.output_steps.size, 1), np.nan)), axis=1)
+
+        node_maps = dict()
+        for layer in self._output_layers():
+            nodes = self._junction_nodes(layer)
+            col_idx = np.empty(nodes.size, dtype=int)
+            missing = []
+            for idx, node in enumerate(nodes.ravel()):
+                if node == '0':
+                    col_idx[idx] = -2
+                elif node.lower() in column:
+                    col_idx[idx] = column[node.lower()]
+                else:
+                    # the metal nodes only exist on the pixels with metal
+                    if layer != 'm_0':
+                        missing.append(node)
+                    col_idx[idx] = -1
+            _warn_missing_nodes(layer, missing)
+            node_maps[layer] = self._new_node_map(nodes.shape + (data.shape[0],))
+            node_maps[layer][...] = data[:, col_idx].T.reshape(nodes.shape + (data.shape[0],))
+
+        self._set_node_maps(node_maps)
+
+    def _parsed_results(self):
+
+        # The sparse backend returns the parsed results directly
+        if self.backend == 'sparse':
+            results = self.raw_results
+        else:
+            results = parse_output(self.raw_results)
+
+        # the voltages of the nodes eliminated by the preprocessor, e.g. KronReducer
+        if hasattr(self.spice_preprocessor, 'reconstruct'):
+            results = self.spice_preprocessor.reconstruct(results)
+
+        return results
+
     def _parse_output(self):
 
-        results = parse_output(self.raw_results)
+        if self.backend == 'ngspice_shared':
+            self._parse_vector_output(*self.raw_results)
+            return
 
-        self.V, self.I = results['dep#branch']
+        if self.backend == 'ngspice' and self.solve_options.output_format == 'raw':
+            self._parse_vector_output(*parse_rawfile(self.raw_results))
+            return
+
+        results = self._parsed_results()
 
-        V_junc = np.empty((self.r_node_num, self.c_node_num, self.steps))
+        if self.node_voltages is None:
+            self.node_voltages = {k[1:-1]: v[0] for k, (_, v) in results.items() if k != 'dep#branch'}
 
-        for col_idx in np.arange(self.c_node_num):
-            for row_idx in np.arange(self.r_node_num):
-                key_name = '(t_0_{:03d}_{:03d})'.format(row_idx, col_idx)
-                if key_name not in results.keys():
-                    key_name = self.spice_preprocessor.find_root(key_name[1:-1])
-                    key_name = "(" + key_name + ")"
+        self.V, self.I = results['dep#branch']
+        self.output_steps = self._parsed_steps()
+
+        node_maps = dict()
+        for layer in self._output_layers():
+            nodes = self._junction_nodes(layer)
+            node_map = self._new_node_map(nodes.shape + (self.output_steps.size,))
+            missing = []
+            for row_idx, col_idx in np.ndindex(nodes.shape):
+                key_name = "(" + nodes[row_idx, col_idx] + ")"
                 try:
                     tempV, tempV2 = results[key_name]
-                    assert tempV2.size == V_junc[row_idx, col_idx, :].size
-                    V_junc[row_idx, col_idx, :] = tempV2
+                    assert tempV2.size == self.V.size
+                    node_map[row_idx, col_idx, :] = tempV2[self.output_steps]
                 except KeyError:
-                    print("Key error when parsing output (keyname:{})".format(key_name))
-                    V_junc[row_idx, col_idx, :] = 0
+                    if key_name == '(0)':
+                        node_map[row_idx, col_idx, :] = 0
+                        continue
+                    # the metal nodes only exist on the pixels with metal
+                    if layer != 'm_0':
+                        missing.append(nodes[row_idx, col_idx])
+                    node_map[row_idx, col_idx, :] = np.nan
+            _warn_missing_nodes(layer, missing)
+            node_maps[layer] = node_map
+
+        self._set_node_maps(node_maps)
+
+    def _parsed_steps(self):
+        """
+        The indices of the points of the voltage sweep kept by the parsers. The points of adaptive and operating point
+        sweeps are selected after all the sweeps are merged.
+
+        """
+
+        # the points of the requested sweep if the sweep is solved with smaller steps
+        steps = _match_sweep(self.V, self._requested_sweep)
+
+        if self.output is None or self.sweep != 'uniform':
+            return steps
+
+        return steps[self.output.step_index(self.V[steps])]
+
+    def _set_node_maps(self, node_maps):
+
+        self.node_maps = node_maps
+        self.v_junc = node_maps.get('t_0')
+
+    def _new_node_map(self, shape):
+        """
+        Allocate an array of node voltages in the storage of this solver
+
+        :param shape: the shape of the array
+        :return: an uninitialized array
+        """
+
+        if self.storage == 'memory':
+            return np.empty(shape)
+
+        if self.storage == 'compact':
+            return np.empty(shape, dtype=np.float32)
+
+        # the temporary file is deleted when it is closed, and its space is released when the array is freed
+        scratch_path = user_config_data.get('Path_config', 'scratch_path', fallback='')
+        with tempfile.TemporaryFile(dir=scratch_path if scratch_path != '' else None) as fp:
+            return np.memmap(fp, dtype=np.float32, mode='w+', shape=shape)
+
+    def _store_node_map(self, node_map):
+        """
+        Copy an array of node voltages into the storage of this solver
+
+        """
+
+        if self.storage == 'memory':
+            return node_map
 
-        self.v_junc = V_junc
+        stored = self._new_node_map(node_map.shape)
+        stored[...] = node_map
+        return stored
 
     def _renormalize_output(self):
 
         # self.v_junc=self.v_junc*gn
         self.I = -self.I / self.gn
 
+    def _expand_symmetry(self):
+        """
+        Rescale the current and reflect v_junc of the irreducible sub-domain to the full domain
+
+        """
+
+        if len(self.symmetry_axes) == 0:
+            return
+
+        self.I = self.I * 2 ** len(self.symmetry_axes)
+        self._set_node_maps({layer: self._store_node_map(expand_by_symmetry(node_map, self.symmetry_axes))
+                             for layer, node_map in self.node_maps.items()})
+
     def get_end_voltage_map(self):
 
         return self.v_junc[:, :, -1]
@@ -213,6 +1099,9 @@ class SPICESolver(object):
 
 class SPICESolver3D(SPICESolver):
 
+    # maximum number of distinct pixel spectra whose jsc are cached
+    jsc_cache_size = 4096
+
     def _check_illumination_wavelength(self):
 
         assert self.illumination_wavelength.size == self.illumination.shape[2]
@@ -224,80 +1113,76 @@ class SPICESolver3D(SPICESolver):
         :return:
         """
 
-        coord_set = iterate_sub_image(self.metal_contact, self.rw, self.cw)
+        def max_illumination():
+            coord_set = iterate_sub_image(self.metal_contact, self.rw, self.cw)
+            nz = self.illumination.shape[2]
+            new_illumination = resize_illumination(self.illumination[:, :, int(nz / 2)], self.metal_contact,
+                                                   coord_set, 0)
+            return np.max(new_illumination, keepdims=True),
 
-        r_pixels, c_pixels, _ = coord_set.shape
+        sample_isc = 340
 
-        nz = self.illumination.shape[2]
+        isc = self._preprocess(max_illumination, 'max_illumination_3d', self.rw, self.cw)[0][0] * \
+              sample_isc * self.l_r * self.l_c
 
-        new_illumination = resize_illumination(self.illumination[:, :, int(nz / 2)], self.metal_contact, coord_set, 0)
+        return 1 / isc * 100
 
-        sample_isc = 340
+    def _input_spectrum(self, illumination_value):
+        """
+        Convert the illumination of a pixel into the input spectrum of the solar cell
 
-        isc = np.max(new_illumination) * sample_isc * self.l_r * self.l_c
+        :param illumination_value: 1D array of the illumination of a pixel at each wavelength
+        :return: the input spectrum
+        """
 
-        return 1 / isc * 100
+        # set concentration
+        if self.illumination_unit == 'x':
+            sp = Spectrum(self.illumination_wavelength, illumination_value, x_unit='nm')
+
+            return self.spectrum * sp
+        elif self.illumination_unit == 'W':
+            # TODO setting y_unit here is not very robust.
+            return Spectrum(self.illumination_wavelength, illumination_value, x_unit='nm',
+                            y_unit='mm**-2')
 
     def _write_nodes(self, coord_set):
 
         self._check_illumination_wavelength()
 
-        spice_body = ""
         r_pixels, c_pixels, _ = coord_set.shape
-        new_illumination = resize_illumination_3d(self.illumination, self.metal_contact, coord_set, 0)
+        new_illumination = self._preprocess(
+            lambda: (resize_illumination_3d(self.illumination, self.metal_contact, coord_set, 0),),
+            'illumination_3d', coord_set)[0]
         assert new_illumination.shape == (r_pixels, c_pixels, self.illumination.shape[2])
 
         self.r_node_num = r_pixels
         self.c_node_num = c_pixels
 
+        jsc = np.empty((len(self.solarcell.subcell), r_pixels, c_pixels))
+
+        # pixels with identical spectra share the same jsc
+        jsc_cache = SpectrumJscCache(self.solarcell, maxsize=self.jsc_cache_size)
+
         # procedures: run thought all x and y pixels
         for c_index in range(c_pixels):
             for r_index in range(r_pixels):
-                illumination_value = new_illumination[r_index, c_index, :]
+                jsc[:, r_index, c_index] = jsc_cache.get_jsc(new_illumination[r_index, c_index, :],
+                                                             self._input_spectrum)
 
-                sub_image = self.metal_contact[coord_set[r_index, c_index, 0]:coord_set[r_index, c_index, 1],
-                            coord_set[r_index, c_index, 2]:coord_set[r_index, c_index, 3]]
-
-                # set concentration
-                if self.illumination_unit == 'x':
-                    sp = Spectrum(self.illumination_wavelength, illumination_value, x_unit='nm')
-
-                    self.solarcell.set_input_spectrum(self.spectrum * sp)
-                elif self.illumination_unit == 'W':
-                    sp = Spectrum(self.illumination_wavelength, illumination_value, x_unit='nm',
-                                  y_unit='mm**-2')
-                    # TODO setting y_unit here is not very robust.
-                    self.solarcell.set_input_spectrum(sp)
-
-                px = PixelProcessor(self.solarcell, self.l_r, self.l_c, h=self.finger_h, gn=self.gn)
+        px = PixelProcessor(self.solarcell, self.l_r, self.l_c, h=self.finger_h, gn=self.gn)
 
-                spice_body += px.node_string(r_index, c_index, sub_image=sub_image)
-        return spice_body
+        return self._write_pixels(px, coord_set, jsc)
 
 
 class SinglePixelSolver(SPICESolver):
 
     def __init__(self, solarcell: SolarCell, illumination: float, v_start,
-                 v_end, v_steps, l_r, l_c, h, spice_preprocessor=None):
-        self.solarcell = solarcell
+                 v_end, v_steps, l_r, l_c, h, spice_preprocessor=None, backend='ngspice'):
 
-        self.l_r = l_r
-        self.l_c = l_c
-        self.finger_h = h
-        self.illumination = illumination
-
-        self.v_start = v_start
-        self.v_end = v_end
-        self.v_steps = v_steps
-
-        self.V = None
-        self.I = None
-
-        self.spice_preprocessor = spice_preprocessor
-
-        self.gn = self._find_gn()
-
-        self._solve_circuit()
+        # The pixel is solved without a mesh, and its illumination is a concentration
+        super().__init__(solarcell, illumination=illumination, metal_contact=np.array([[255]]), rw=1, cw=1,
+                         v_start=v_start, v_end=v_end, v_steps=v_steps, l_r=l_r, l_c=l_c, h=h,
+                         spice_preprocessor=spice_preprocessor, backend=backend, cache=False)
 
     def _find_gn(self):
         sample_isc = 340
@@ -313,10 +1198,11 @@ class SinglePixelSolver(SPICESolver):
 
         px = PixelProcessor(self.solarcell, self.l_r, self.l_c, h=self.finger_h, gn=self.gn)
 
-        return px.node_string(id_r=0, id_c=0, sub_image=dummy_image, is_boundary_r=True, is_boundary_c=True)
+        return Netlist.from_spice(px.node_string(id_r=0, id_c=0, sub_image=dummy_image,
+                                                 is_boundary_r=True, is_boundary_c=True))
 
     def _parse_output(self):
-        results = parse_output(self.raw_results)
+        results = self._parsed_results()
 
         self.V, self.I = results['dep#branch']
 
@@ -329,14 +1215,21 @@ class AdaptiveMeshSolver(SPICESolver):
     This class is still in experimental phase.
     This solver inherits everything from SPICESolver,
     except that it has a resolve() method to remesh and then solve the circuit again.
-    In other words, the iterative solving process is not yet implemented.
-    The user has to manually write a loop and perform resolve() to get satisfactory results.
+    auto_refine() repeats the remeshing in rows and columns until Isc and the fill factor converge.
 
 
     """
 
+    def __init__(self, *args, **kwargs):
+        output = kwargs.get('output')
+        if output is not None and (output.decimation != (1, 1) or 't_0' not in output.layers):
+            raise ValueError("The output of AdaptiveMeshSolver has to include the layer t_0 without decimation, "
+                             "because the mesh refinement needs v_junc of all the pixels")
+        super().__init__(*args, **kwargs)
+
     def _remesh(self, voltage_threshold=0.0):
-        voltage_map = self.v_junc[:, :, -1]
+        # the mesh covers only the irreducible sub-domain if the mirror symmetry is used
+        voltage_map = reduce_by_symmetry(self.v_junc[:, :, -1], self.symmetry_axes)
 
         middle_r = math.ceil(voltage_map.shape[0] / 2)
 
@@ -347,3 +1240,131 @@ class AdaptiveMeshSolver(SPICESolver):
     def resolve(self, voltage_threshold):
         self._remesh(voltage_threshold=voltage_threshold)
         self._solve_circuit()
+
+    def auto_refine(self, isc_tol=1e-3, ff_tol=1e-3, max_nodes=None, refine_fraction=0.5, max_iter=10):
+        """
+        Refine the mesh and solve the circuit again until Isc and the fill factor converge.
+        In every iteration, the cells whose voltage jumps to the neighbouring cells (cell_jump_indicator()) are larger
+        than refine_fraction times the largest jump are bisected, in rows and in columns.
+        The previous meshes are saved in self.mg.r_hist and self.mg.c_hist.
+
+        :param isc_tol: the tolerance of the relative change of Isc between two iterations
+        :param ff_tol: the tolerance of the change of fill factor between two iterations
+        :param max_nodes: the maximum number of pixels of the mesh. The refinement stops before it is exceeded.
+        :param refine_fraction: the fraction of the largest jump above which the cells are refined
+        :param max_iter: maximum number of iterations
+        :return: the history of the refinement: a list of (number of pixels, Isc, fill factor)
+        """
+
+        last_isc, last_ff = isc(self.V, self.I), ff(self.V, self.I)
+        history = [(self.r_node_num * self.c_node_num, last_isc, last_ff)]
+
+        for _ in range(max_iter):
+
+            # the mesh covers only the irreducible sub-domain if the mirror symmetry is used
+            voltage_map = reduce_by_symmetry(self.v_junc[:, :, -1], self.symmetry_axes)
+
+            indicators = [cell_jump_indicator(voltage_map, dim) for dim in (0, 1)]
+
+            # cells of one pixel wide cannot be refined further
+            indicators[0][np.diff(np.append(self.mg.ri(), self.mg.raw_image_shape[0])) <= 1] = 0
+            indicators[1][np.diff(np.append(self.mg.ci(), self.mg.raw_image_shape[1])) <= 1] = 0
+
+            threshold = refine_fraction * max(np.max(indicators[0]), np.max(indicators[1]))
+            if threshold == 0:
+                break
+
+            new_ri = bisect_cells(self.mg.ri(), indicators[0] >= threshold, self.mg.raw_image_shape[0])
+            new_ci = bisect_cells(self.mg.ci(), indicators[1] >= threshold, self.mg.raw_image_shape[1])
+
+            if new_ri.size == self.mg.ri().size and new_ci.size == self.mg.ci().size:
+                break
+
+            if max_nodes is not None and new_ri.size * new_ci.size > max_nodes:
+                break
+
+            self.mg.refine_cells(indicators[0], threshold, dim=0)
+            self.mg.refine_cells(indicators[1], threshold, dim=1)
+
+            self._solve_circuit()
+
+            new_isc, new_ff = isc(self.V, self.I), ff(self.V, self.I)
+            history.append((self.r_node_num * self.c_node_num, new_isc, new_ff))
+
+            converged = abs(new_isc - last_isc) <= isc_tol * abs(last_isc) and abs(new_ff - last_ff) <= ff_tol
+            last_isc, last_ff = new_isc, new_ff
+
+            if converged:
+                break
+
+        return history
+
+
+class QuadtreeSolver(SPICESolver):
+    """
+    A solver on a quadtree mesh (meshing.QuadtreeMesh). rw and cw are the sizes of the root cells.
+    The cells are merged in the uniform open-emitter regions and split along the edges of the fingers and bus bars,
+    down to min_cell pixels.
+
+    v_junc has the shape (cells, 1, steps). Use get_voltage_map() or get_end_voltage_map() to map it back to
+    the image.
+
+    """
+
+    # Cells that are not larger than min_cell are not split
+    min_cell = 1
+
+    def __init__(self, *args, min_cell=1, **kwargs):
+        if kwargs.get('initial_guess') is not None:
+            raise ValueError("initial_guess cannot be used with QuadtreeSolver")
+        if kwargs.get('output') is not None and kwargs['output'].decimation != (1, 1):
+            raise ValueError("An output with decimation cannot be used with QuadtreeSolver")
+
+        self.min_cell = min_cell
+        self.mesh = None
+
+        super().__init__(*args, **kwargs)
+
+    def _generate_network(self):
+
+        self.mesh = self._preprocess(
+            lambda: QuadtreeMesh(self.metal_contact, self.rw, self.cw, min_cell=self.min_cell,
+                                 illumination=self.illumination),
+            'quadtree_mesh', self.rw, self.cw, self.min_cell)
+        self.coord_set = self.mesh.to_coordset()
+
+        return self._write_nodes(self.coord_set)
+
+    def _write_pixels(self, px: PixelProcessor, coord_set, jsc):
+
+        r_metal_row, r_metal_col, metal_coverage, is_bus = self._metal_map(px, coord_set)
+
+        return px.cell_network_netlist(self.mesh.cells, jsc[:, :, 0], r_metal_row[:, 0], r_metal_col[:, 0],
+                                       metal_coverage[:, 0], is_bus[:, 0],
+                                       self.mesh.edges())
+
+    def _node_names(self, layer):
+
+        nodes = np.empty((self.r_node_num, self.c_node_num), dtype=object)
+        for idx, (r0, _, c0, _) in enumerate(self.mesh.cells.tolist()):
+            nodes[idx, 0] = '{}_{:03d}_{:03d}'.format(layer, r0, c0)
+        return nodes
+
+    def _expand_symmetry(self):
+
+        # v_junc stays on the cells of the sub-domain. It is reflected in get_voltage_map()
+        self.I = self.I * 2 ** len(self.symmetry_axes)
+
+    def get_voltage_map(self, step):
+        """
+        Get the image-shaped junction voltage map
+
+        :param step: the index of the voltage sweep
+        :return: 2D voltage map with the shape of the full image
+        """
+
+        return expand_by_symmetry(self.mesh.to_image(self.v_junc[:, 0, step]), self.symmetry_axes)
+
+    def get_end_voltage_map(self):
+
+        return self.get_voltage_map(-1)
@@ -1,4 +1,6 @@
 import os
+import sys
+import stat
 import numpy as np
 import matplotlib.pyplot as plt
 
@@ -130,3 +132,38 @@ def contact_ratio(mask_image: np.ndarray, threshold):
     m = np.sum(np.where(mask_image > threshold, 1, 0))
 
     return float(m) / float(n)
+
+
+# a fake ngspice that writes the number of fake ngspice processes running at its start into the output file.
+# Every process keeps a file in the folder 'running' next to the engine while it runs.
+# It fails if the netlist has the line 'fail' or if the name of the engine ends with '_fail',
+# and hangs if the netlist has the line 'hang' or if the name of the engine ends with '_hang'.
+FAKE_ENGINE = """#!{}
+import os, sys, time
+with open(sys.argv[2]) as f:
+    netlist = f.read().split() + os.path.basename(sys.argv[0]).split('_')
+if 'fail' in netlist:
+    sys.stderr.write('Error: no convergence')
+    sys.exit(3)
+running = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), 'running')
+os.makedirs(running, exist_ok=True)
+token = os.path.join(running, str(os.getpid()))
+open(token, 'w').close()
+count = len(os.listdir(running))
+time.sleep(60 if 'hang' in netlist else 0.3)
+with open(sys.argv[sys.argv.index('-o') + 1], 'w') as f:
+    f.write(str(count))
+os.remove(token)
+"""
+
+
+def write_fake_engine(engine):
+    """
+    Write FAKE_ENGINE into an executable file
+
+    :param engine: the path of the fake ngspice
+    """
+
+    with open(engine, 'w') as f:
+        f.write(FAKE_ENGINE.format(sys.executable))
+    os.chmod(engine, os.stat(engine).st_mode | stat.S_IEXEC)
@@ -6,7 +6,7 @@ import numpy as np
 
 import matplotlib.pyplot as plt
 
-from pypvcircuit.spice_solver import AdaptiveMeshSolver
+from pypvcircuit.spice_solver import AdaptiveMeshSolver, OutputSelection
 
 from pypvcircuit.parse_spice_input import NodeReducer
 from pypvcircuit.util import default_mask
@@ -135,6 +135,40 @@ class AdaptiveMeshSolverTestCase(unittest.TestCase):
         fig.savefig(os.path.join(self.output_data_path, "mesh_on_less_grids.png"), dpi=300)
         iv_fig.savefig(os.path.join(self.output_data_path, "mesh_on_less_grids_iv.png"), dpi=300)
 
+    def test_auto_refine(self):
+        pw = 10
+
+        metal_mask = get_quater_image(self.default_contactsMask)
+        illumination_mask = np.ones_like(metal_mask)
+
+        self.gaas_1j.set_input_spectrum(load_astm("AM1.5g"))
+
+        adp_solver = AdaptiveMeshSolver(solarcell=self.gaas_1j, illumination=illumination_mask,
+                                        metal_contact=metal_mask, rw=pw, cw=pw, v_start=self.vini, v_end=self.vfin,
+                                        v_steps=self.step,
+                                        l_r=self.lr, l_c=self.lc, h=self.h, spice_preprocessor=NodeReducer())
+
+        max_nodes = metal_mask.size // 4
+        history = adp_solver.auto_refine(isc_tol=1e-4, ff_tol=1e-4, max_nodes=max_nodes)
+
+        for nodes, solver_isc, solver_ff in history:
+            print("nodes: {}, isc: {}, ff: {}".format(nodes, solver_isc, solver_ff))
+
+        self.assertLessEqual(history[-1][0], max_nodes)
+        self.assertEqual(len(adp_solver.mg.r_hist), len(history) - 1)
+        self.assertEqual(adp_solver.v_junc.shape[0:2], (adp_solver.mg.ri().size, adp_solver.mg.ci().size))
+
+    def test_output_validation(self):
+        metal_mask = get_quater_image(self.default_contactsMask)
+        illumination_mask = np.ones_like(metal_mask)
+
+        # the mesh refinement needs v_junc of all the pixels
+        for output in [OutputSelection(decimation=2), OutputSelection(layers=['m_0'])]:
+            with self.assertRaises(ValueError):
+                AdaptiveMeshSolver(solarcell=self.gaas_1j, illumination=illumination_mask, metal_contact=metal_mask,
+                                   rw=10, cw=10, v_start=self.vini, v_end=self.vfin, v_steps=self.step,
+                                   l_r=self.lr, l_c=self.lc, h=self.h, output=output)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -8,7 +8,7 @@ import matplotlib.pyplot as plt
 from skimage.io import imread
 
 from pypvcircuit.meshing import single_step_remeshing, \
-    middle_point_ceil, middle_point, MeshGenerator
+    middle_point_ceil, middle_point, MeshGenerator, cell_jump_indicator, bisect_cells, QuadtreeMesh
 from .helper import get_quater_image
 
 
@@ -27,6 +27,52 @@ class AdaptiveMeshTestCase(unittest.TestCase):
 
         self.output_data_path = os.path.join(self.file_path, 'test_output_data')
 
+    def test_refine_cells(self):
+
+        value_map = np.zeros((3, 4))
+        value_map[:, 2:] = 1.0
+        value_map[2, :] += 0.1
+
+        np.testing.assert_allclose(cell_jump_indicator(value_map, 0), [0, 0.1, 0.1])
+        np.testing.assert_allclose(cell_jump_indicator(value_map, 1), [0, 1, 1, 0])
+
+        # the last cell ends at the image boundary, cells of one pixel wide are not split
+        np.testing.assert_array_equal(bisect_cells(np.array([0, 4, 5, 8]), np.array([True, True, False, True]), 12),
+                                      [0, 2, 4, 5, 8, 10])
+
+        mg = MeshGenerator((12, 12), rw=4, cw=4)
+        added = mg.refine_cells(np.array([0, 1, 0]), delta_y=0.5, dim=1)
+        self.assertEqual(added, 1)
+        np.testing.assert_array_equal(mg.ci(), [0, 4, 6, 8])
+        np.testing.assert_array_equal(mg.c_hist[-1], [0, 4, 8])
+
+    def test_quadtree_mesh(self):
+
+        mask = np.zeros((8, 8))
+        mask[:, 3] = 255
+
+        qm = QuadtreeMesh(mask, rw=8, cw=8)
+
+        # the cells tile the image without overlaps and are uniform
+        area = (qm.cells[:, 1] - qm.cells[:, 0]) * (qm.cells[:, 3] - qm.cells[:, 2])
+        self.assertEqual(np.sum(area), mask.size)
+        for r0, r1, c0, c1 in qm.cells:
+            self.assertEqual(np.ptp(mask[r0:r1, c0:c1]), 0)
+
+        # the right half is merged into two cells, the finger column is refined down to single pixels
+        self.assertIn([0, 4, 4, 8], qm.cells.tolist())
+        self.assertEqual(np.sum(area == 1), 16)
+
+        # one-to-many edges: the large cell on the right is connected to four pixels on its left
+        big = qm.cells.tolist().index([0, 4, 4, 8])
+        a, b, dim, shared = qm.edges()
+        left_neighbors = a[(b == big) & (dim == 1)]
+        self.assertEqual(left_neighbors.size, 4)
+        np.testing.assert_array_equal(shared[(b == big) & (dim == 1)], 1)
+
+        np.testing.assert_array_equal(qm.to_image(np.arange(qm.cell_num())), qm.labels)
+        self.assertEqual(qm.to_coordset().shape, (qm.cell_num(), 1, 4))
+
     def test_np_insert(self):
         """
         Convince myself the np.insert() is doing what I expect
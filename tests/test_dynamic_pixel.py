@@ -1,5 +1,7 @@
 import unittest
-from pypvcircuit.meshing import iterate_sub_image, get_merged_r_image, resize_illumination
+from pypvcircuit.meshing import iterate_sub_image, get_merged_r_image, get_merged_r_image_from_coordset, \
+    resize_illumination, resize_illumination_3d, MeshGenerator, MaskIndex, find_mirror_axes, reduce_by_symmetry, \
+    expand_by_symmetry
 from pypvcircuit.pixel_processor import get_pixel_r
 from skimage.io import imread, imsave
 import numpy as np
@@ -115,6 +117,93 @@ class MyTestCase(unittest.TestCase):
 
         self.assertEqual(np.sum(illumination) - 2, np.sum(rill))
 
+    def test_mask_index(self):
+        """
+        Test if MaskIndex gives the same metal statistics as get_pixel_r() on every sub-image
+
+        """
+
+        mask_image = np.zeros((60, 45), dtype=np.uint8)
+        mask_image[3:8, 2:40] = 255
+        mask_image[10:55, 5:7] = 124
+        mask_image[10:55, 20:23] = 124
+        mask_image[30, 10:30] = 124
+
+        mask_index = MaskIndex(mask_image, threshold=0, bus_threshold=250)
+
+        mg = MeshGenerator(mask_image.shape, rw=4, cw=6)
+        mg.refine(y=np.arange(mg.ci().size) % 2, delta_y=1, dim=1)
+
+        for coord_set in [mg.to_coordset(), mg.to_coordset()[1:, :-1]]:
+            agg_r_col, agg_r_row, metal_coverage = mask_index.pixel_r(coord_set, r_row=2, r_col=3)
+            is_bus = mask_index.is_bus(coord_set)
+
+            for r_index, c_index in np.ndindex(coord_set.shape[0:2]):
+                a, b, c, d = coord_set[r_index, c_index, :]
+                sub_image = mask_image[a:b, c:d]
+                expected = get_pixel_r(sub_image, r_row=2, r_col=3, threshold=0)
+
+                self.assertAlmostEqual(agg_r_col[r_index, c_index], expected[0])
+                self.assertAlmostEqual(agg_r_row[r_index, c_index], expected[1])
+                self.assertAlmostEqual(metal_coverage[r_index, c_index], expected[2])
+                self.assertEqual(is_bus[r_index, c_index], np.max(sub_image) > 250)
+
+            # reusing the index gives the same merged image as building a new one
+            self.assertTrue(np.allclose(get_merged_r_image_from_coordset(mask_image, coord_set, mask_index=mask_index),
+                                        get_merged_r_image_from_coordset(mask_image, coord_set)))
+
+    def test_resize_illumination_nonuniform_mesh(self):
+        """
+        Test the vectorized resize_illumination() and resize_illumination_3d() against summing every sub-image,
+        on a non-uniform mesh and on sub-images that do not tile the whole image
+
+        """
+
+        contact_mask = np.zeros((50, 40), dtype=np.uint8)
+        contact_mask[10:12, :] = 255
+        contact_mask[:, 30:33] = 124
+
+        illumination = np.arange(contact_mask.size * 3, dtype=float).reshape(contact_mask.shape + (3,))
+
+        mg = MeshGenerator(contact_mask.shape, rw=7, cw=6)
+        mg.refine(y=np.arange(mg.ci().size) % 2, delta_y=1, dim=1)
+
+        for coord_set in [mg.to_coordset(), mg.to_coordset()[1:-1, 1:]]:
+            rill_3d = resize_illumination_3d(illumination, contact_mask, coord_set)
+            self.assertEqual(rill_3d.shape, coord_set.shape[0:2] + (3,))
+
+            for zi in range(illumination.shape[2]):
+                rill = resize_illumination(illumination[:, :, zi], contact_mask, coord_set)
+
+                for r_index, c_index in np.ndindex(coord_set.shape[0:2]):
+                    a, b, c, d = coord_set[r_index, c_index, :]
+                    expected = np.sum(illumination[a:b, c:d, zi] * (contact_mask[a:b, c:d] == 0))
+
+                    self.assertAlmostEqual(rill[r_index, c_index], expected)
+                    self.assertAlmostEqual(rill_3d[r_index, c_index, zi], expected)
+
+    def test_mirror_symmetry(self):
+
+        contact_mask = np.zeros((20, 16), dtype=np.uint8)
+        contact_mask[:, 7:9] = 255
+        contact_mask[3, :] = 100
+        contact_mask[16, :] = 100
+
+        illumination = np.ones(contact_mask.shape + (3,))
+
+        self.assertEqual(find_mirror_axes(contact_mask, illumination), (0, 1))
+
+        # break the symmetry of illumination along the rows
+        illumination[0, :, 1] = 2
+        self.assertEqual(find_mirror_axes(contact_mask, illumination), (1,))
+
+        # axes of odd length are not reduced
+        self.assertEqual(find_mirror_axes(contact_mask[:, 1:-2]), (0,))
+
+        sub_image = reduce_by_symmetry(contact_mask, (0, 1))
+        self.assertEqual(sub_image.shape, (10, 8))
+        self.assertTrue(np.array_equal(expand_by_symmetry(sub_image, (0, 1)), contact_mask))
+
 
 if __name__ == '__main__':
     unittest.main()
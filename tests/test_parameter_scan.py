@@ -0,0 +1,48 @@
+import unittest
+import warnings
+import numpy as np
+from pypvcircuit import parameter_scan
+from pypvcircuit.parameter_scan import run_search_to_numpy
+
+
+def scan_func(a, b):
+    if a == 2 and b == 4:
+        raise ValueError("failed point")
+    return a * 10 + b
+
+
+class ParameterScanTestCase(unittest.TestCase):
+
+    def test_parallel_scan(self):
+        param_grid = [{'a': [1, 2, 3], 'b': [4, 5]}]
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            names, param_array, serial_results = run_search_to_numpy(scan_func, param_grid, errors='ignore')
+        self.assertEqual(len([w for w in caught if issubclass(w.category, RuntimeWarning)]), 1)
+
+        _, parallel_param_array, parallel_results = run_search_to_numpy(scan_func, param_grid, n_workers=2,
+                                                                        chunksize=2, errors='ignore')
+
+        # the failed point is recorded as nan
+        self.assertListEqual(names, ['a', 'b'])
+        self.assertTrue(np.allclose(serial_results, [14, 15, np.nan, 25, 34, 35], equal_nan=True))
+        self.assertTrue(np.allclose(parallel_results, serial_results, equal_nan=True))
+        self.assertTrue((param_array == parallel_param_array).all())
+
+        with self.assertRaises(ValueError):
+            run_search_to_numpy(scan_func, param_grid, n_workers=2)
+
+    def test_parallel_scan_tuples(self):
+        # the demo scan of the module, in which func returns a tuple
+        func, param_grid = parameter_scan.testfunc2, parameter_scan.test_param2
+        _, param_array, serial_results = run_search_to_numpy(func, param_grid)
+        _, parallel_param_array, parallel_results = run_search_to_numpy(func, param_grid, n_workers=2)
+
+        self.assertListEqual(serial_results, [(1, 3), (1, 4), (2, 3), (2, 4)])
+        self.assertListEqual(parallel_results, serial_results)
+        self.assertTrue((param_array == parallel_param_array).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
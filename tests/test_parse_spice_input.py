@@ -1,5 +1,5 @@
 import unittest
-from pypvcircuit.parse_spice_input import parse_spice_command
+from pypvcircuit.parse_spice_input import parse_spice_command, NodeReducer
 
 
 class InputParsingTestCase(unittest.TestCase):
@@ -34,6 +34,46 @@ class InputParsingTestCase(unittest.TestCase):
         self.assertEqual(cmd_atoms['name'], 'i0_000_000')
         self.assertAlmostEqual(cmd_atoms['value'], 320.4295763908701)
 
+        cmd_atoms = parse_spice_command("Rm_0_000_001 m_0_000_001 m_0_000_002 inf")
+
+        self.assertEqual(cmd_atoms['value'], float('inf'))
+
+    def test_node_reducer(self):
+        circuit = """*** A test circuit
+vdep in 0 DC 0
+R1 in a 0
+R2 a b 0
+R3 b c 2
+R4 c d 0
+R5 d 0 0
+D1 b e dm
+I1 e c DC 0.1
+.PRINT DC v(a) v(c) v(e)
+.PRINT DC v(d)
+.end
+"""
+
+        nr = NodeReducer()
+        output = nr.process_spice_input(circuit).splitlines()
+
+        self.assertEqual(nr.find_root('a'), 'sn1')
+        self.assertEqual(nr.find_root('in'), 'sn1')
+        self.assertEqual(nr.find_root('d'), '0')
+        self.assertRaises(KeyError, nr.find_root, 'e')
+
+        self.assertIn("vdep sn1 0 DC 0", output)
+        self.assertIn("R3 sn1 0 2", output)
+        self.assertIn("D1 sn1 e dm", output)
+        self.assertIn("I1 e 0 DC 0.1", output)
+        self.assertIn(".PRINT DC v(sn1) v(e)", output)
+        self.assertNotIn(".PRINT DC v(0)", output)
+        self.assertEqual(len([c for c in output if c.startswith('R')]), 1)
+
+        # the mapping of the previous netlist is not kept
+        nr.process_spice_input("R1 a b 0\n.end\n")
+        self.assertRaises(KeyError, nr.find_root, 'in')
+        self.assertEqual(nr.find_root('b'), 'sn1')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,25 @@
 import unittest
-from pypvcircuit.parse_spice_output import parse_output
+import numpy as np
+from pypvcircuit.parse_spice_output import parse_output, parse_rawfile
+from pypvcircuit.parse_spice_input import replace_print_with_save, add_nodeset
+
+
+def make_rawfile(data: np.ndarray, names, binary=True):
+    header = "Title: test\nDate: today\nPlotname: DC transfer characteristic\nFlags: real\n" \
+             "No. Variables: {}\nNo. Points: {}\nVariables:\n".format(data.shape[1], data.shape[0])
+    for i, n in enumerate(names):
+        header += "\t{}\t{}\tvoltage\n".format(i, n)
+
+    if binary:
+        return (header + "Binary:\n").encode('ascii') + data.astype(np.float64).tobytes()
+
+    values = ""
+    for p in range(data.shape[0]):
+        values += " {}".format(p)
+        for v in data[p]:
+            values += "\t{:e}\n".format(v)
+    return (header + "Values:\n" + values).encode('ascii')
+
 
 class MyTestCase(unittest.TestCase):
     def test_parse(self):
@@ -17,5 +37,31 @@ class MyTestCase(unittest.TestCase):
         plt.plot(V2, V2p)
         plt.show()
 
+    def test_parse_rawfile(self):
+        data = np.arange(15, dtype=np.float64).reshape(5, 3) / 7
+        names_in_file = ['v(v-sweep)', 'v(t_0_000_001)', 'i(vdep)']
+
+        for binary in [True, False]:
+            names, parsed = parse_rawfile(make_rawfile(data, names_in_file, binary=binary))
+            self.assertListEqual(names, ['v-sweep', 't_0_000_001', 'vdep#branch'])
+            np.testing.assert_allclose(parsed, data, rtol=1e-6)
+
+        # the last plot is returned if the rawfile contains several plots
+        op_plot = make_rawfile(np.ones((1, 2)), ['v(in)', 'i(vdep)'])
+        names, parsed = parse_rawfile(op_plot + make_rawfile(data, names_in_file))
+        np.testing.assert_array_equal(parsed, data)
+
+    def test_replace_print_with_save(self):
+        spice_input = "title\nR1 in 0 1\n.PRINT DC v(in) v(0)\n.DC vdep 0 1 0.1\n.end\n"
+        output = replace_print_with_save(spice_input, ['i(vdep)', 'v(in)'])
+        self.assertEqual(output, "title\nR1 in 0 1\n.DC vdep 0 1 0.1\n.save i(vdep) v(in)\n.end\n")
+
+    def test_add_nodeset(self):
+        spice_input = "title\nR1 in a 1\nR2 a b 1\n.DC vdep 0 1 0.1\n.end\n"
+        output = add_nodeset(spice_input, {'a': 0.5, 'b': 0.25}, nodes_per_line=1)
+        self.assertEqual(output, "title\nR1 in a 1\nR2 a b 1\n.DC vdep 0 1 0.1\n"
+                                 ".NODESET v(a)=0.5\n.NODESET v(b)=0.25\n.end\n")
+
+
 if __name__ == '__main__':
     unittest.main()
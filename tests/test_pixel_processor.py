@@ -1,6 +1,6 @@
 import unittest
-from pypvcell.solarcell import SQCell
-from pypvcircuit.pixel_processor import PixelProcessor
+from pypvcell.solarcell import SQCell, MJCell
+from pypvcircuit.pixel_processor import PixelProcessor, ConcentrationJscCache, SpectrumJscCache
 from pypvcircuit.spice_solver import SPICESolver, SinglePixelSolver
 from pypvcircuit.parse_spice_input import reprocess_spice_input, NodeReducer
 import os
@@ -49,6 +49,47 @@ class PixelProcessorTestCase(unittest.TestCase):
         sq.set_input_spectrum(ill)
         px = PixelProcessor(sq, lr=1e-6, lc=1e-6)
 
+    def test_concentration_jsc_cache(self):
+        """
+        Test if scaling jsc by concentration gives the same jsc as setting the concentrated spectrum
+
+        """
+
+        mj_cell = MJCell([SQCell(1.87, 300, 1), SQCell(1.42, 300, 1)])
+        ill = load_astm("AM1.5g")
+
+        jsc_cache = ConcentrationJscCache(mj_cell, ill)
+        concentration = np.array([[0, 1.5], [20, 500]])
+        jsc = jsc_cache.get_jsc(concentration)
+
+        self.assertEqual(jsc.shape, (2, 2, 2))
+
+        for idx in np.ndindex(concentration.shape):
+            mj_cell.set_input_spectrum(ill * concentration[idx])
+            self.assertTrue(np.isclose(jsc[(0,) + idx], mj_cell.subcell[0].jsc))
+            self.assertTrue(np.isclose(jsc[(1,) + idx], mj_cell.subcell[1].jsc))
+
+    def test_spectrum_jsc_cache(self):
+        sq = SQCell(1.42, 300, 1)
+        ill = load_astm("AM1.5g")
+
+        jsc_cache = SpectrumJscCache(sq, maxsize=2)
+
+        def to_spectrum(vector):
+            return ill * vector[0]
+
+        jsc_1 = jsc_cache.get_jsc(np.array([1.0, 1.0]), to_spectrum)
+        jsc_2 = jsc_cache.get_jsc(np.array([2.0, 1.0]), to_spectrum)
+        self.assertTrue(np.allclose(jsc_cache.get_jsc(np.array([1.0, 1.0]), to_spectrum), jsc_1))
+        self.assertTrue(np.allclose(jsc_2, 2 * jsc_1))
+        self.assertEqual(jsc_cache.hits, 1)
+        self.assertEqual(jsc_cache.misses, 2)
+
+        # the least recently used spectrum [2, 1] is discarded
+        jsc_cache.get_jsc(np.array([3.0, 1.0]), to_spectrum)
+        jsc_cache.get_jsc(np.array([2.0, 1.0]), to_spectrum)
+        self.assertEqual(jsc_cache.misses, 4)
+
     def test_2(self):
         sq = SQCell(1.42, 300, 1)
 
@@ -76,7 +117,7 @@ class PixelProcessorTestCase(unittest.TestCase):
 
         nd = NodeReducer()
 
-        sps = SinglePixelSolver(solarcell=sq, illumination=1, metal_contact=, rw=, cw=, v_start=0, v_end=1.1,
+        sps = SinglePixelSolver(solarcell=sq, illumination=1, v_start=0, v_end=1.1,
                                 v_steps=0.01, l_r=1, l_c=1, h=self.h, spice_preprocessor=nd)
 
         print(sq.j01)
@@ -108,7 +149,7 @@ class PixelProcessorTestCase(unittest.TestCase):
 
             nd = NodeReducer()
 
-            sps = SinglePixelSolver(solarcell=sq, illumination=1, metal_contact=, rw=, cw=, v_start=0, v_end=1.1,
+            sps = SinglePixelSolver(solarcell=sq, illumination=1, v_start=0, v_end=1.1,
                                     v_steps=0.01, l_r=1, l_c=1, h=self.h, spice_preprocessor=nd)
 
             voc_array[idx] = voc(v, i)
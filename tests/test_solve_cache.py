@@ -0,0 +1,97 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+
+from pypvcircuit.solve_cache import SolveCache
+from pypvcircuit.meshing import PreprocessingCache, MaskIndex, convert_boundary_to_coordset
+
+
+class SolveCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_get_put(self):
+        cache = SolveCache(self.cache_dir.name)
+
+        key = SolveCache.key("R1 in 0 1\n.end\n", 'sparse')
+        self.assertNotEqual(key, SolveCache.key("R1 in 0 2\n.end\n", 'sparse'))
+        self.assertNotEqual(key, SolveCache.key("R1 in 0 1\n.end\n", 'ngspice'))
+
+        self.assertIsNone(cache.get(key))
+
+        entry = {'V': np.linspace(0, 1, 11), 'I': np.ones(11), 'map_t_0': np.ones((2, 3, 11), dtype=np.float32)}
+        cache.put(key, entry)
+
+        loaded = cache.get(key)
+        for name, value in entry.items():
+            self.assertTrue(np.array_equal(loaded[name], value))
+            self.assertEqual(loaded[name].dtype, value.dtype)
+
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+
+    def test_lru_eviction(self):
+        # every entry is about 80 kB, so that the cache holds two entries
+        cache = SolveCache(self.cache_dir.name, max_size_mb=0.2)
+
+        keys = [SolveCache.key(k) for k in range(3)]
+        cache.put(keys[0], {'V': np.zeros(10000)})
+        cache.put(keys[1], {'V': np.zeros(10000)})
+        for k, t in [(0, 1000), (1, 2000)]:
+            os.utime(os.path.join(self.cache_dir.name, keys[k] + '.npz'), (t, t))
+
+        # make the first entry the most recently used
+        self.assertIsNotNone(cache.get(keys[0]))
+        cache.put(keys[2], {'V': np.zeros(10000)})
+
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertIsNotNone(cache.get(keys[0]))
+        self.assertIsNotNone(cache.get(keys[2]))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+
+class PreprocessingCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_get(self):
+        mask = np.zeros((20, 30))
+        mask[:, 10:12] = 255
+        coord_set = convert_boundary_to_coordset(mask.shape, np.arange(0, 20, 5), np.arange(0, 30, 5))
+
+        self.assertNotEqual(PreprocessingCache.key(mask, coord_set), PreprocessingCache.key(mask, coord_set[:2]))
+        self.assertNotEqual(PreprocessingCache.key(mask), PreprocessingCache.key(mask.astype(np.float32)))
+
+        def metal_map():
+            return MaskIndex(mask).pixel_r(coord_set, r_row=1.0, r_col=1.0)
+
+        key = PreprocessingCache.key(mask, coord_set, 1.0)
+        cache = PreprocessingCache(cache_path=self.cache_dir.name)
+        first = cache.get(key, metal_map)
+        second = cache.get(key, metal_map)
+        self.assertIs(first, second)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # a new cache loads the entry from the folder
+        cache = PreprocessingCache(cache_path=self.cache_dir.name)
+        loaded = cache.get(key, lambda: self.fail("the entry should be loaded"))
+        for a, b in zip(first, loaded):
+            self.assertTrue(np.array_equal(a, b))
+
+        # entries that are not arrays are only kept in memory
+        index = cache.get(PreprocessingCache.key(mask, 'mask_index'), lambda: MaskIndex(mask))
+        self.assertIsInstance(index, MaskIndex)
+        self.assertEqual(len(os.listdir(self.cache_dir.name)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import unittest
+import numpy as np
+from scipy.optimize import brentq
+
+from pypvcircuit.sparse_solver import solve_circuit_sparse, sweep_values, BOLTZMANN, CHARGE, CELSIUS_TO_KELVIN
+from pypvcircuit.parse_spice_input import NodeReducer, KronReducer
+from pypvcircuit.netlist import Netlist
+
+
+class SparseSolverTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.test_circuit = """*** A test circuit
+.OPTIONS TNOM=20 TEMP=20
+vdep in 0 DC 0
+.model dm d(is=1e-12,n=1.5,eg=1.42)
+i1 0 a 0.1
+d1 a 0 dm
+r1 a b 2
+r2 b in 0
+r3 b 0 inf
+.PRINT DC i(vdep)
+.PRINT DC v(a) v(b)
+.DC vdep 0 1.0 0.1
+.end
+"""
+
+        self.metal_circuit = """*** A test circuit with a metal line
+.OPTIONS TNOM=20 TEMP=20
+vdep in 0 DC 0
+.model dm d(is=1e-12,n=1.5,eg=1.42)
+i1 0 a 0.1
+d1 a 0 dm
+i2 0 c 0.1
+d2 c 0 dm
+ra a m1 1
+rm m1 m2 0.5
+rc c m2 1
+rbus m2 mb 0.2
+rext mb in 0
+rx a x 3
+.PRINT DC i(vdep)
+.PRINT DC v(a)
+.PRINT DC v(m1)
+.PRINT DC v(x)
+.DC vdep 0 1.0 0.1
+.end
+"""
+
+    def test_sweep_values(self):
+        self.assertEqual(sweep_values(0, 3.0, 0.05).size, 61)
+        self.assertEqual(sweep_values(0, 1.1, 0.01).size, 111)
+
+    def test_diode_circuit(self):
+        """
+        Compare the results of the sparse solver with the analytical solution of a diode circuit
+
+        """
+
+        results = solve_circuit_sparse(self.test_circuit)
+
+        V, I = results['dep#branch']
+        _, va = results['(a)']
+
+        self.assertEqual(V.size, 11)
+
+        vt = BOLTZMANN * (20 + CELSIUS_TO_KELVIN) / CHARGE
+
+        for i in range(V.size):
+            def kcl(x):
+                return 0.1 - 1e-12 * (np.exp(x / (1.5 * vt)) - 1) - 1e-12 * x - (x - V[i]) / 2
+
+            expected_va = brentq(kcl, -5, 5)
+
+            self.assertTrue(np.isclose(va[i], expected_va))
+            self.assertTrue(np.isclose(I[i], (expected_va - V[i]) / 2))
+
+    def test_floating_voltage_source(self):
+        """
+        Test if a voltage source that is not grounded gives the same results as the grounded one
+
+        """
+
+        expected = solve_circuit_sparse(self.test_circuit)
+
+        floating_circuit = self.test_circuit.replace("vdep in 0 DC 0", "vdep in g DC 0\nvg g 0 DC 0")
+        results = solve_circuit_sparse(floating_circuit)
+
+        for key in ['dep#branch', '(a)', '(b)']:
+            self.assertTrue(np.allclose(expected[key][1], results[key][1]))
+
+    def test_kron_reduction(self):
+        """
+        Test if eliminating the metal nodes keeps the terminal behaviour and the reconstructed node voltages
+
+        """
+
+        full = solve_circuit_sparse(self.metal_circuit)
+
+        kr = KronReducer()
+        reduced = solve_circuit_sparse(self.metal_circuit, postprocess_input=kr.process_spice_input)
+
+        eliminated = [node for node, _ in kr.eliminated]
+        self.assertIn('m1', eliminated)
+        self.assertIn('x', eliminated)
+
+        reduced = kr.reconstruct(reduced)
+
+        for key in ['dep#branch', '(a)', '(m1)', '(x)']:
+            self.assertTrue(np.allclose(full[key][1], reduced[key][1]))
+
+        # the eliminated nodes cannot be rebuilt without the voltages of their neighbours
+        with self.assertWarns(UserWarning):
+            kr.reconstruct({'dep#branch': full['dep#branch']})
+
+    def test_netlist(self):
+        """
+        Test if processing the Netlist gives the same results as processing the SPICE text
+
+        """
+
+        netlist = Netlist.from_spice(self.metal_circuit)
+        self.assertEqual(len(netlist), 11)
+
+        # writing and reading again keeps the circuit
+        self.assertEqual(Netlist.from_spice(netlist.to_spice()).to_spice(), netlist.to_spice())
+
+        for reducer in [NodeReducer(), KronReducer()]:
+            expected = solve_circuit_sparse(self.metal_circuit, postprocess_input=reducer.process_spice_input)
+
+            processed = netlist.copy()
+            reducer.process_netlist(processed)
+            results = solve_circuit_sparse(processed)
+
+            self.assertEqual(reducer.find_root('mb'), reducer.find_root('in'))
+            for key in ['dep#branch', '(a)']:
+                self.assertTrue(np.allclose(expected[key][1], results[key][1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
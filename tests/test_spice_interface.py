@@ -0,0 +1,75 @@
+import unittest
+import os
+import gzip
+import time
+import asyncio
+import tempfile
+from pypvcircuit.spice_interface import save_artifacts, solve_circuit, solve_circuit_async, \
+    SpiceError, SpiceTimeoutError, SpiceConfig
+
+from .helper import write_fake_engine
+
+
+class ArtifactTestCase(unittest.TestCase):
+
+    def test_save_artifacts(self):
+        with tempfile.TemporaryDirectory() as spice_path:
+            files_1 = save_artifacts(spice_path, {"spice_in.txt": "netlist", "spice_out.txt": "output"})
+            files_2 = save_artifacts(spice_path, {"spice_in.txt": "netlist 2"}, compress=True)
+
+            # every run is saved with an unique prefix
+            self.assertEqual(len(os.listdir(spice_path)), 3)
+            self.assertTrue(files_1[0].endswith("_spice_in.txt"))
+
+            with open(files_1[1], "r") as f:
+                self.assertEqual(f.read(), "output")
+
+            with gzip.open(files_2[0], "rt") as f:
+                self.assertEqual(f.read(), "netlist 2")
+
+
+class FakeEngineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.engine_dir = tempfile.TemporaryDirectory()
+        self.engine = os.path.join(self.engine_dir.name, 'ngspice')
+        write_fake_engine(self.engine)
+
+    def tearDown(self):
+        self.engine_dir.cleanup()
+
+    def test_semaphore(self):
+        async def solve_all():
+            semaphore = asyncio.Semaphore(2)
+            return await asyncio.gather(*[solve_circuit_async("* test\n.end\n", engine=self.engine,
+                                                              postprocess_input=None, semaphore=semaphore)
+                                          for _ in range(5)])
+
+        results = asyncio.run(solve_all())
+
+        # at most two fake ngspice processes run at the same time
+        concurrency = [int(r) for r in results]
+        self.assertEqual(len(concurrency), 5)
+        self.assertLessEqual(max(concurrency), 2)
+
+    def test_errors(self):
+        with self.assertRaises(SpiceError) as cm:
+            solve_circuit("* test\nfail\n.end\n", engine=self.engine, postprocess_input=None, artifacts='none')
+        self.assertEqual(cm.exception.returncode, 3)
+        self.assertIn("no convergence", cm.exception.stderr)
+
+        start = time.time()
+        with self.assertRaises(SpiceTimeoutError):
+            solve_circuit("* test\nhang\n.end\n", engine=self.engine, postprocess_input=None, artifacts='none',
+                          timeout=0.5)
+        with self.assertRaises(SpiceTimeoutError):
+            asyncio.run(solve_circuit_async("* test\nhang\n.end\n", engine=self.engine, postprocess_input=None,
+                                            artifacts='none', timeout=0.5))
+        self.assertLess(time.time() - start, 10)
+
+        # the engine argument does not change the configured engine
+        self.assertNotEqual(SpiceConfig.engine, self.engine)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,11 @@
 import unittest
-from pypvcircuit.pixel_processor import create_node
+import numpy as np
+from pypvcell.solarcell import SQCell, MJCell
+from pypvcell.illumination import load_astm
+from pypvcircuit.pixel_processor import create_node, PixelProcessor, _load_solarcell_param, create_header
+from pypvcircuit.sparse_solver import solve_circuit_sparse
+from pypvcircuit.meshing import iterate_sub_image, MaskIndex
+from pypvcircuit.netlist import Netlist
 
 
 class MyTestCase(unittest.TestCase):
@@ -21,6 +27,54 @@ class MyTestCase(unittest.TestCase):
         print(node_str)
         # self.assertEqual(True, False)
 
+    def test_network_netlist(self):
+        """
+        Test if the batched Netlist writer gives the same circuit as writing the pixels one by one,
+        and if the pixels with the same diode parameters share the diode models
+
+        """
+
+        image = np.zeros((40, 38), dtype=np.uint8)
+        image[4:36:6, :] = 124
+        image[0:5, :] = 255
+
+        coord_set = iterate_sub_image(image, 3, 4)
+        illumination = np.linspace(1, 20, coord_set.shape[0] * coord_set.shape[1]).reshape(coord_set.shape[:2])
+
+        solarcell = MJCell([SQCell(1.87, 300, 1), SQCell(1.42, 300, 1)])
+
+        netlist = ""
+        jsc = np.empty((2,) + coord_set.shape[:2])
+        for c_index in range(coord_set.shape[1]):
+            for r_index in range(coord_set.shape[0]):
+                solarcell.set_input_spectrum(illumination[r_index, c_index] * load_astm("AM1.5g"))
+                jsc[:, r_index, c_index] = _load_solarcell_param(solarcell, 'jsc')
+                px = PixelProcessor(solarcell, 1e-5, 1e-5, h=2e-6, gn=0.1, lump_series_r=1e-3)
+                sub_image = image[coord_set[r_index, c_index, 0]:coord_set[r_index, c_index, 1],
+                            coord_set[r_index, c_index, 2]:coord_set[r_index, c_index, 3]]
+                netlist += px.node_string(r_index, c_index, sub_image=sub_image)
+
+        px = PixelProcessor(solarcell, 1e-5, 1e-5, h=2e-6, gn=0.1, lump_series_r=1e-3)
+        mask_index = MaskIndex(image, threshold=px.metal_threshold, bus_threshold=px.bus_threshold)
+        r_metal_row, r_metal_col, metal_coverage = mask_index.pixel_r(coord_set, r_row=px.r_line, r_col=px.r_line)
+
+        batched_netlist = Netlist.from_spice(create_header(T=20))
+        batched_netlist.extend(px.network_netlist(coord_set, jsc, r_metal_row, r_metal_col, metal_coverage,
+                                                  mask_index.is_bus(coord_set)))
+        batched_netlist.current_probes.append('vdep')
+        batched_netlist.dc = ('vdep', 0, 1.2, 0.1)
+
+        # pixels in the last row and the last column are smaller, so there are 4 different pixel areas
+        # in each of the 2 junctions
+        self.assertEqual(len(batched_netlist.models), 2 * 4)
+
+        footer = ".PRINT DC i(vdep)\n.DC vdep 0 1.2 0.1\n.end"
+        expected = solve_circuit_sparse(create_header(T=20) + netlist + footer)
+        results = solve_circuit_sparse(batched_netlist)
+
+        for key in results.keys():
+            self.assertTrue(np.allclose(expected[key][1], results[key][1]))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -7,6 +7,9 @@ This set tests the full solar cell equivalent circuit simulation, using the dyna
 import unittest
 import timeit
 import os
+import tempfile
+import asyncio
+import warnings
 import numpy as np
 import matplotlib.pyplot as plt
 import typing
@@ -14,15 +17,23 @@ from skimage.io import imread, imsave
 
 from pypvcell.solarcell import SQCell, MJCell
 from pypvcell.illumination import load_astm
-from pypvcell.fom import isc, ff
+from pypvcell.fom import isc, ff, voc
 
 from .helper import draw_contact_and_voltage_map, draw_merged_contact_images, \
-    get_quater_image, contact_ratio, draw_illumination_3d
+    get_quater_image, contact_ratio, draw_illumination_3d, write_fake_engine
 
-from pypvcircuit.parse_spice_input import NodeReducer
-from pypvcircuit.spice_solver import SPICESolver, SPICESolver3D
-from pypvcircuit.util import make_3d_illumination, gen_profile, HighResGrid, MetalGrid
+from pypvcircuit.parse_spice_input import NodeReducer, KronReducer
+from pypvcircuit.spice_solver import SPICESolver, SPICESolver3D, QuadtreeSolver, OutputSelection, RetryPolicy, \
+    SolveOptions
+from pypvcircuit.util import make_3d_illumination, gen_profile, HighResGrid, MetalGrid, HighResTriangGrid
 from pypvcircuit.import_tool import RayData
+from pypvcircuit.pixel_processor import PixelProcessor, create_header
+from pypvcircuit.meshing import iterate_sub_image, MaskIndex, PreprocessingCache
+from pypvcircuit.netlist import Netlist
+from pypvcircuit.spice_interface import solve_circuit, SpiceConfig, SpiceError, SpiceTimeoutError
+from pypvcircuit.solve_cache import SolveCache
+from pypvcircuit.parse_spice_output import parse_output
+from pypvcircuit.sparse_solver import sweep_values, SparseNetwork
 
 import yaml
 
@@ -66,6 +77,25 @@ class SpiceSolverTest(unittest.TestCase):
         self.ingap_1j = SQCell(1.87, 300, 1)
         self.ge_1j = SQCell(0.7, 300, 1)
 
+    def _solve(self, solver=SPICESolver, **overrides):
+        """
+        Solve the quarter of the default contact mask under uniform illumination with the sparse backend
+
+        :param solver: the solver class, or a function that creates the solver, e.g. SPICESolver.create
+        :param overrides: the arguments of the solver that replace the default ones
+        :return: the solver
+        """
+
+        self.gaas_1j.set_input_spectrum(load_astm("AM1.5g"))
+
+        params = dict(solarcell=self.gaas_1j, metal_contact=get_quater_image(self.default_contactsMask), rw=5, cw=5,
+                      v_start=self.vini, v_end=1.1, v_steps=self.step, l_r=self.lr, l_c=self.lc, h=self.h,
+                      spice_preprocessor=NodeReducer(), backend='sparse')
+        params.update(overrides)
+        params.setdefault('illumination', np.ones_like(params['metal_contact']))
+
+        return solver(**params)
+
     def test_jsc(self):
 
         self.test_jsc_consistency(pw=5)
@@ -104,6 +134,362 @@ class SpiceSolverTest(unittest.TestCase):
         print("diff: {}".format(estimated_isc - solver_isc))
         self.assertTrue(np.isclose(float(solver_isc), estimated_isc))
 
+    def test_sparse_backend(self):
+        """
+        Test if the sparse Newton backend gives the same result as ngspice
+
+        :return:
+        """
+
+        results = [self._solve(backend=backend) for backend in ['ngspice', 'sparse']]
+
+        self.assertTrue(np.allclose(results[0].V, results[1].V))
+        self.assertTrue(np.allclose(results[0].I, results[1].I, rtol=1e-3))
+        self.assertTrue(np.allclose(results[0].v_junc, results[1].v_junc, rtol=1e-3, atol=1e-4))
+
+    def test_quadtree_solver(self):
+        """
+        Test if the quadtree mesh gives a result close to the pixel-by-pixel mesh with fewer nodes
+
+        :return:
+        """
+
+        fine = self._solve(rw=1, cw=1)
+        quadtree = self._solve(solver=QuadtreeSolver, rw=16, cw=16)
+
+        self.assertLess(quadtree.mesh.cell_num(), fine.metal_contact.size)
+        self.assertEqual(quadtree.get_end_voltage_map().shape, fine.metal_contact.shape)
+        self.assertAlmostEqual(isc(fine.V, fine.I) / isc(quadtree.V, quadtree.I), 1, places=3)
+        self.assertAlmostEqual(voc(fine.V, fine.I), voc(quadtree.V, quadtree.I), places=3)
+        self.assertAlmostEqual(ff(fine.V, fine.I), ff(quadtree.V, quadtree.I), places=2)
+
+        with self.assertRaises(ValueError):
+            self._solve(solver=QuadtreeSolver, rw=16, cw=16, initial_guess=fine)
+        with self.assertRaises(ValueError):
+            self._solve(solver=QuadtreeSolver, rw=16, cw=16, output=OutputSelection(decimation=2))
+
+    def test_adaptive_sweep(self):
+        """
+        Test if the adaptive voltage sweep gives the same fill factor and voc as the uniform sweep with fewer points
+
+        :return:
+        """
+
+        uniform, adaptive = [self._solve(v_steps=0.005, sweep=sweep) for sweep in ['uniform', 'adaptive']]
+
+        self.assertLess(adaptive.V.size * 2, uniform.V.size)
+        self.assertEqual(adaptive.v_junc.shape[2], adaptive.V.size)
+        self.assertAlmostEqual(ff(adaptive.V, adaptive.I), ff(uniform.V, uniform.I), places=3)
+        self.assertAlmostEqual(voc(adaptive.V, adaptive.I), voc(uniform.V, uniform.I), places=3)
+
+    def test_operating_point(self):
+        """
+        Test if the operating-point mode gives the same isc, voc and fill factor as the full IV sweep
+        with a few single-point solves
+
+        :return:
+        """
+
+        uniform, op = [self._solve(v_steps=0.002, sweep=sweep) for sweep in ['uniform', 'operating_point']]
+
+        print("number of solves: {}".format(op.operating_point['solves']))
+        self.assertLessEqual(op.operating_point['solves'], 10)
+        self.assertEqual(op.v_junc.shape[2], 3)
+        self.assertAlmostEqual(op.operating_point['isc'], isc(uniform.V, uniform.I), places=6)
+        self.assertAlmostEqual(op.operating_point['voc'], voc(uniform.V, uniform.I), places=2)
+        self.assertAlmostEqual(ff(op.V, op.I), ff(uniform.V, uniform.I), places=3)
+
+    def test_mirror_symmetry(self):
+        """
+        Test if solving the irreducible sub-domain of a symmetric mask gives the same result as the full domain
+
+        :return:
+        """
+
+        results = [self._solve(metal_contact=self.default_contactsMask, mirror_symmetry=mirror_symmetry)
+                   for mirror_symmetry in [False, True]]
+
+        self.assertEqual(results[1].symmetry_axes, (0,))
+        self.assertEqual(results[0].v_junc.shape, results[1].v_junc.shape)
+        self.assertTrue(np.allclose(results[0].I, results[1].I, rtol=1e-3))
+        self.assertTrue(np.allclose(results[0].v_junc, results[1].v_junc, rtol=1e-3, atol=1e-4))
+
+        with self.assertRaises(ValueError):
+            self._solve(metal_contact=self.default_contactsMask, mirror_symmetry=True,
+                        output=OutputSelection(decimation=2))
+
+    def test_output_selection(self):
+        """
+        Test if the selected layers, pixels and sweep points are the same as the full output
+
+        :return:
+        """
+
+        output = OutputSelection(layers=['t_0', 'm_0'], decimation=(2, 3), steps=[-1], voltages=[0.5])
+
+        full, selected = [self._solve(output=out) for out in [None, output]]
+
+        self.assertEqual(selected.output_steps.tolist(), [10, full.V.size - 1])
+        self.assertTrue(np.allclose(full.I, selected.I))
+        self.assertTrue(np.allclose(full.v_junc[::2, ::3, selected.output_steps], selected.v_junc))
+        self.assertEqual(selected.node_maps['m_0'].shape, selected.v_junc.shape)
+        self.assertTrue(np.allclose(full.get_end_voltage_map()[::2, ::3], selected.get_end_voltage_map()))
+
+    def test_missing_output_nodes(self):
+        """
+        Test if the nodes missing in the parsed output are warned and their voltages are set to nan
+
+        :return:
+        """
+
+        sps = self._solve(cache=False)
+        expected = sps.v_junc.copy()
+
+        nodes = sps._junction_nodes()
+        del sps.raw_results['(' + nodes[0, 1] + ')']
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            sps._parse_output()
+
+        self.assertEqual(len([w for w in caught if issubclass(w.category, RuntimeWarning)]), 1)
+        self.assertTrue(np.all(np.isnan(sps.v_junc[nodes == nodes[0, 1]])))
+        self.assertTrue(np.allclose(expected[nodes != nodes[0, 1]], sps.v_junc[nodes != nodes[0, 1]]))
+
+    def test_storage(self):
+        """
+        Test if the compact and memory-mapped storages give the same voltage maps as the default storage
+
+        :return:
+        """
+
+        memory, compact, memmap = [self._solve(storage=storage) for storage in ['memory', 'compact', 'memmap']]
+
+        self.assertEqual(compact.v_junc.dtype, np.float32)
+        self.assertIsInstance(memmap.v_junc, np.memmap)
+        self.assertIsNone(memmap.raw_results)
+        for sps in [compact, memmap]:
+            self.assertTrue(np.allclose(memory.I, sps.I))
+            self.assertTrue(np.allclose(memory.get_end_voltage_map(), sps.get_end_voltage_map(), atol=1e-6))
+
+    def test_solve_cache(self):
+        """
+        Test if a repeated solve is loaded from the solve cache without running the backend, and if the cache key
+        changes with the circuit parameters, the engine and the output selection
+
+        :return:
+        """
+
+        with tempfile.TemporaryDirectory() as cache_path:
+            cache = SolveCache(cache_path)
+
+            def solve(lump_series_r=0, output=None):
+                return self._solve(lump_series_r=lump_series_r, output=output, cache=cache)
+
+            first = solve()
+            second = solve()
+
+            stats = cache.stats()
+            self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+            self.assertIsNotNone(first.raw_results)
+            self.assertIsNone(second.raw_results)
+
+            self.assertTrue(np.array_equal(first.V, second.V))
+            self.assertTrue(np.array_equal(first.I, second.I))
+            self.assertEqual(first.node_maps.keys(), second.node_maps.keys())
+            for layer in first.node_maps.keys():
+                self.assertTrue(np.array_equal(first.node_maps[layer], second.node_maps[layer]))
+            self.assertEqual(first.node_voltages, second.node_voltages)
+
+            key = first._cache_key()
+            self.assertEqual(key, second._cache_key())
+            self.assertNotEqual(key, solve(lump_series_r=1e-3)._cache_key())
+            self.assertNotEqual(key, solve(output=OutputSelection(layers=['t_0'], steps=[-1]))._cache_key())
+            self.assertEqual(cache.stats()['misses'], 3)
+
+            engine = SpiceConfig.engine
+            try:
+                first.backend = 'ngspice'
+                SpiceConfig.engine = os.path.join(cache_path, 'ngspice_a')
+                ngspice_key = first._cache_key()
+                SpiceConfig.engine = os.path.join(cache_path, 'ngspice_b')
+                self.assertNotEqual(ngspice_key, first._cache_key())
+            finally:
+                SpiceConfig.engine = engine
+
+            self.assertNotEqual(key, ngspice_key)
+
+    def test_preprocessing_cache(self):
+        """
+        Test if the solvers of the same images reuse the preprocessing of the first solver, and if a different
+        mesh or image misses the cache
+
+        :return:
+        """
+
+        metal_mask = get_quater_image(self.default_contactsMask)
+
+        cache = PreprocessingCache()
+
+        def solve(metal_contact, pw=5):
+            return self._solve(metal_contact=metal_contact, rw=pw, cw=pw, preprocessing_cache=cache, cache=False)
+
+        first = solve(metal_mask)
+        misses = cache.misses
+        self.assertEqual(cache.hits, 0)
+
+        second = solve(metal_mask)
+        self.assertEqual(cache.misses, misses)
+        self.assertGreater(cache.hits, 0)
+        self.assertTrue(np.allclose(first.I, second.I))
+        self.assertTrue(np.allclose(first.v_junc, second.v_junc))
+
+        # a different mesh of the same images only reuses the index of the metal mask
+        hits = cache.hits
+        solve(metal_mask, pw=4)
+        self.assertEqual(cache.hits, hits + 1)
+        self.assertGreater(cache.misses, misses)
+
+        # nothing is shared with another image
+        hits, misses = cache.hits, cache.misses
+        solve(np.fliplr(metal_mask))
+        self.assertEqual(cache.hits, hits)
+        self.assertGreater(cache.misses, misses)
+
+    def test_create(self):
+        """
+        Test if the solvers created concurrently by create() with a shared solar cell and spice preprocessor
+        give the same results as the solvers created one by one
+
+        :return:
+        """
+
+        metal_mask = get_quater_image(self.default_contactsMask)
+        preprocessor = NodeReducer()
+        meshes = [(metal_mask, 5), (metal_mask.T, 3), (np.fliplr(metal_mask), 4)]
+
+        serial = [self._solve(metal_contact=mask, rw=pw, cw=pw, spice_preprocessor=preprocessor, cache=False)
+                  for mask, pw in meshes]
+
+        async def create_all():
+            return await asyncio.gather(*[self._solve(solver=SPICESolver.create, metal_contact=mask, rw=pw, cw=pw,
+                                                      spice_preprocessor=preprocessor, cache=False)
+                                          for mask, pw in meshes])
+
+        concurrent = asyncio.run(create_all())
+
+        for expected, sps in zip(serial, concurrent):
+            self.assertTrue(np.allclose(expected.I, sps.I))
+            self.assertTrue(np.allclose(expected.v_junc, sps.v_junc))
+            self.assertIsNot(sps.spice_preprocessor, preprocessor)
+            self.assertIsNot(sps.solarcell, self.gaas_1j)
+
+    def test_retry_policy(self):
+        """
+        Test if a failed solve is retried with the escalating options and the divided voltage steps of the retry
+        policy, and if every attempt is recorded in solve_log
+
+        :return:
+        """
+
+        class FinestStepSolver(SPICESolver):
+            # the circuit solver only converges with a quarter of the voltage steps
+            def _send_command(solver):
+                if not np.isclose(solver.spice_input.dc[3], self.step / 4):
+                    raise SpiceError("no convergence", returncode=1)
+                return SPICESolver._send_command(solver)
+
+        with self.assertRaises(SpiceError):
+            self._solve(solver=FinestStepSolver, cache=False)
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            sps = self._solve(solver=FinestStepSolver, cache=False,
+                              solve_options=SolveOptions(retry_policy=RetryPolicy()))
+        self.assertEqual(len([w for w in caught if issubclass(w.category, RuntimeWarning)]), 4)
+
+        self.assertEqual(sps.retries, 4)
+        self.assertEqual([entry['options'] for entry in sps.solve_log],
+                         [{}, {'gminsteps': 100, 'itl1': 500}] +
+                         [{'gminsteps': 100, 'itl1': 500, 'srcsteps': 100, 'itl2': 200}] * 3)
+        self.assertTrue(np.allclose([entry['v_steps'] for entry in sps.solve_log],
+                                    self.step / np.array([1, 1, 1, 2, 4])))
+        self.assertTrue(all(entry['error'].startswith('SpiceError') for entry in sps.solve_log[:-1]))
+        self.assertIsNone(sps.solve_log[-1]['error'])
+
+        # the points of the original sweep are kept from the finer sweep
+        reference = self._solve(cache=False)
+        self.assertTrue(np.allclose(reference.V, sps.V))
+        self.assertTrue(np.allclose(reference.I, sps.I))
+        self.assertTrue(np.allclose(reference.v_junc, sps.v_junc))
+
+    def test_timeout(self):
+        """
+        Test if the timeout of SPICESolver is passed on to ngspice, and if a timeout is retried
+
+        :return:
+        """
+
+        solve_options = SolveOptions(timeout=0.5, retry_policy=RetryPolicy(options=(), step_divisions=(2,)))
+
+        default_engine = SpiceConfig.engine
+        with tempfile.TemporaryDirectory() as engine_dir:
+            # a fake ngspice that never finishes
+            SpiceConfig.engine = os.path.join(engine_dir, 'ngspice_hang')
+            write_fake_engine(SpiceConfig.engine)
+
+            start_time = timeit.default_timer()
+            try:
+                with warnings.catch_warnings(record=True) as caught:
+                    warnings.simplefilter('always')
+                    with self.assertRaises(SpiceTimeoutError) as cm:
+                        self._solve(backend='ngspice', cache=False, solve_options=solve_options)
+            finally:
+                SpiceConfig.engine = default_engine
+            elapsed_time = timeit.default_timer() - start_time
+
+        self.assertEqual(cm.exception.timeout, 0.5)
+        self.assertEqual(len([w for w in caught if issubclass(w.category, RuntimeWarning)]), 1)
+        self.assertLess(elapsed_time, 10)
+
+    def test_ngspice_result_paths(self):
+        """
+        Test if the text output, the binary rawfile and the in-process libngspice session give the same result
+
+        :return:
+        """
+
+        results = [self._solve(backend=backend, solve_options=SolveOptions(output_format=output_format))
+                   for backend, output_format in [('ngspice', 'text'), ('ngspice', 'raw'), ('ngspice_shared', 'text')]]
+
+        for sps in results[1:]:
+            self.assertTrue(np.allclose(results[0].V, sps.V))
+            self.assertTrue(np.allclose(results[0].I, sps.I, rtol=1e-4))
+            self.assertTrue(np.allclose(results[0].v_junc, sps.v_junc, rtol=1e-4, atol=1e-5))
+
+    def test_missing_rawfile_nodes(self):
+        """
+        Test if the nodes missing in the vectors of a rawfile are warned and their voltages are set to nan
+
+        :return:
+        """
+
+        sps = self._solve(cache=False)
+        expected = sps.v_junc.copy()
+
+        nodes = sps._junction_nodes()
+        names = ['v-sweep', 'vdep#branch'] + [k[1:-1].lower() for k in sps.raw_results.keys()
+                                              if k != 'dep#branch' and k[1:-1] != nodes[0, 1]]
+        data = np.column_stack([sps.V, sps.I] + [sps.raw_results['(' + n + ')'][1] for n in names[2:]])
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            sps._parse_vector_output(names, data)
+
+        self.assertEqual(len([w for w in caught if issubclass(w.category, RuntimeWarning)]), 1)
+        self.assertTrue(np.all(np.isnan(sps.v_junc[nodes == nodes[0, 1]])))
+        self.assertTrue(np.allclose(expected[nodes != nodes[0, 1]], sps.v_junc[nodes != nodes[0, 1]]))
+
     def test_3d_illumination_naive(self):
 
         """
@@ -427,6 +813,182 @@ class SpiceSolverTest(unittest.TestCase):
                               contacts_mask_obj=hrg,
                               test_pixel_width=[40, 20, 15, 10], illumination_mask=illumination_mask)
 
+    def test_shared_diode_model_benchmark(self):
+        """
+        Benchmark the netlist size and solving time of the batched Netlist writer, in which the pixels with
+        the same diode parameters share the diode models
+
+        :return:
+        """
+
+        hrg = HighResGrid()
+
+        self.gaas_1j.set_input_spectrum(load_astm("AM1.5g"))
+
+        for pw in [20, 10]:
+            coord_set = iterate_sub_image(hrg.metal_image, pw, pw)
+            jsc = np.ones((1,) + coord_set.shape[:2]) * self.gaas_1j.jsc * pw * pw
+
+            start_time = timeit.default_timer()
+            px = PixelProcessor(self.gaas_1j, hrg.lr, hrg.lc, h=self.h, gn=1)
+            mask_index = MaskIndex(hrg.metal_image, threshold=px.metal_threshold, bus_threshold=px.bus_threshold)
+            r_metal_row, r_metal_col, metal_coverage = \
+                mask_index.pixel_r(coord_set, r_row=px.r_line, r_col=px.r_line)
+
+            netlist = Netlist.from_spice(create_header(T=20))
+            netlist.extend(px.network_netlist(coord_set, jsc, r_metal_row, r_metal_col, metal_coverage,
+                                              mask_index.is_bus(coord_set)))
+            netlist.current_probes.append('vdep')
+            netlist.dc = ('vdep', self.vini, 1.1, self.step)
+            spice_input = netlist.to_spice()
+            write_time = timeit.default_timer() - start_time
+
+            start_time = timeit.default_timer()
+            raw_results = solve_circuit(spice_input, postprocess_input=NodeReducer().process_spice_input)
+            elapsed_time = timeit.default_timer() - start_time
+
+            pixels = coord_set.shape[0] * coord_set.shape[1]
+            print("pw: {}, pixels: {}, netlist size: {} bytes, models: {}, write time: {:.2f} s, "
+                  "solve time: {:.2f} s".format(pw, pixels, len(spice_input), len(netlist.models), write_time,
+                                                elapsed_time))
+
+            # the pixels in the last row and the last column may be smaller, so there are at most 4 pixel areas
+            self.assertLessEqual(len(netlist.models), 4)
+            self.assertLess(len(netlist.models) * 100, pixels)
+            self.assertEqual(parse_output(raw_results)['dep#branch'][1].size,
+                             sweep_values(self.vini, 1.1, self.step).size)
+
+    def test_node_reducer_benchmark(self):
+        """
+        Benchmark the merging of shorted nodes of HighResGrid netlists, and check the merged sets against
+        the connected components found by networkx
+
+        :return:
+        """
+
+        import networkx
+
+        hrg = HighResGrid()
+
+        self.gaas_1j.set_input_spectrum(load_astm("AM1.5g"))
+
+        for pw in [10, 5, 2]:
+            coord_set = iterate_sub_image(hrg.metal_image, pw, pw)
+            jsc = np.ones((1,) + coord_set.shape[:2]) * self.gaas_1j.jsc * pw * pw
+
+            px = PixelProcessor(self.gaas_1j, hrg.lr, hrg.lc, h=self.h, gn=1)
+            mask_index = MaskIndex(hrg.metal_image, threshold=px.metal_threshold, bus_threshold=px.bus_threshold)
+            r_metal_row, r_metal_col, metal_coverage = \
+                mask_index.pixel_r(coord_set, r_row=px.r_line, r_col=px.r_line)
+
+            netlist = Netlist.from_spice(create_header(T=20))
+            netlist.extend(px.network_netlist(coord_set, jsc, r_metal_row, r_metal_col, metal_coverage,
+                                              mask_index.is_bus(coord_set)))
+
+            start_time = timeit.default_timer()
+            nr = NodeReducer()
+            processed = nr.process_netlist(netlist.copy())
+            elapsed_time = timeit.default_timer() - start_time
+
+            start_time = timeit.default_timer()
+            kind, _, p_node, n_node, value, _ = netlist.elements()
+            shorted = (kind == 'R') & (value == 0)
+            graph = networkx.Graph()
+            graph.add_edges_from((netlist.node_names[p], netlist.node_names[n])
+                                 for p, n in zip(p_node[shorted].tolist(), n_node[shorted].tolist()))
+            components = list(networkx.connected_components(graph))
+            networkx_time = timeit.default_timer() - start_time
+
+            nodes, reduced_nodes = len(netlist.connected_node_names()), len(processed.connected_node_names())
+            print("pw: {}, elements: {}, nodes: {} -> {}, NodeReducer: {:.2f} s, networkx components: {:.2f} s".format(
+                pw, len(netlist), nodes, reduced_nodes, elapsed_time, networkx_time))
+
+            # every set of shorted nodes becomes a single node
+            self.assertLess(reduced_nodes, nodes)
+            self.assertEqual(nodes - reduced_nodes, graph.number_of_nodes() - len(components))
+
+            self.assertEqual(len(nr.roots), graph.number_of_nodes())
+            self.assertEqual(len(set(nr.roots.values())), len(components))
+            for cset in components:
+                self.assertEqual(len({nr.find_root(node) for node in cset}), 1)
+
+    def test_kron_reducer_benchmark(self):
+        """
+        Benchmark the node count and solving time of HighResGrid circuits reduced by NodeReducer and by KronReducer
+        with different max_degree, and check that the .NODESET initial guesses only name the remaining nodes
+
+        :return:
+        """
+
+        hrg = HighResGrid()
+        illumination_mask = np.ones_like(hrg.metal_image)
+
+        # a nonzero contact resistance keeps the metal nodes apart from the top nodes, so that they can be eliminated
+        self.gaas_1j.r_contact = self.Rcontact
+        self.gaas_1j.set_input_spectrum(load_astm("AM1.5g"))
+
+        def solve(pw, preprocessor, initial_guess=None):
+            start_time = timeit.default_timer()
+            sps = SPICESolver(solarcell=self.gaas_1j, illumination=illumination_mask, metal_contact=hrg.metal_image,
+                              rw=pw, cw=pw, v_start=self.vini, v_end=1.1, v_steps=self.step, l_r=hrg.lr,
+                              l_c=hrg.lc, h=self.h, spice_preprocessor=preprocessor, backend='sparse',
+                              initial_guess=initial_guess, cache=False)
+            return sps, timeit.default_timer() - start_time
+
+        coarse, _ = solve(20, NodeReducer())
+
+        for pw in [10, 5]:
+            reference, reference_time = solve(pw, NodeReducer(), initial_guess=coarse)
+            reference_nodes = reference.spice_input.connected_node_names()
+            print("pw: {}, NodeReducer, nodes: {}, solve time: {:.2f} s".format(
+                pw, len(reference_nodes), reference_time))
+
+            for max_degree in [3, 5, 8]:
+                sps, elapsed_time = solve(pw, KronReducer(max_degree=max_degree), initial_guess=coarse)
+                nodes = sps.spice_input.connected_node_names()
+                print("pw: {}, KronReducer(max_degree={}), nodes: {}, solve time: {:.2f} s".format(
+                    pw, max_degree, len(nodes), elapsed_time))
+
+                self.assertLess(len(nodes), len(reference_nodes))
+                self.assertTrue(set(sps.spice_input.nodeset.keys()) <= nodes)
+                self.assertTrue(np.allclose(reference.I, sps.I, rtol=1e-4))
+                self.assertTrue(np.allclose(reference.v_junc, sps.v_junc, rtol=1e-4, atol=1e-5))
+
+    def test_nodeset_warm_start_benchmark(self):
+        """
+        Benchmark the solving time of fine meshes with and without the .NODESET initial guesses from a coarse mesh
+
+        :return:
+        """
+
+        hrg = HighResTriangGrid()
+
+        # The initial guesses are the node voltages of the first point. They matter when the sweep starts near Voc.
+        def solve(pw, initial_guess=None):
+            start_time = timeit.default_timer()
+            sps = self._solve(metal_contact=hrg.metal_image, rw=pw, cw=pw, l_r=hrg.lr, l_c=hrg.lc, v_start=0.9,
+                              initial_guess=initial_guess)
+            solve_time = timeit.default_timer() - start_time
+
+            # solve the processed netlist again to count the Newton iterations of the sweep
+            network = SparseNetwork(sps.spice_input)
+            network.run_dc_sweep()
+            return sps, solve_time, network.newton_iterations
+
+        coarse, coarse_time, _ = solve(pw=20)
+
+        for pw in [10, 5]:
+            cold, cold_time, cold_iterations = solve(pw)
+            warm, warm_time, warm_iterations = solve(pw, initial_guess=coarse)
+
+            print("pw: {}, coarse solve: {:.2f} s, cold start: {:.2f} s ({} iterations), "
+                  "warm start: {:.2f} s ({} iterations)".format(pw, coarse_time, cold_time, cold_iterations,
+                                                                warm_time, warm_iterations))
+
+            self.assertLess(warm_iterations, cold_iterations)
+            self.assertTrue(np.allclose(cold.I, warm.I, rtol=1e-3))
+            self.assertTrue(np.allclose(cold.v_junc, warm.v_junc, rtol=1e-4, atol=1e-5))
+
     def vary_pixel_width(self, input_solar_cells: SQCell,
                          file_prefix: str, illumination_mask=None, contacts_mask_obj=None,
                          test_pixel_width=[1, 2, 5, 10]):